@@ -0,0 +1,333 @@
+"""Fake Pyrogram client and messages for benchmarks and replay"""
+import asyncio
+import inspect
+import itertools
+import os
+import random
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from pyrogram.enums import ChatType
+from pyrogram.errors import FloodWait
+
+try:
+    from pyrogram.types import Story as _StoryBase
+except ImportError:  # Older Pyrogram builds have no stories support
+    _StoryBase = object
+
+_ids = itertools.count(1000)
+
+# One shared buffer keeps fake downloads cheap to produce
+_PAYLOAD = os.urandom(1024 * 1024)
+
+
+class FakeProfile:
+    """Tunable latency, bandwidth and FloodWait injection for a fake client"""
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        bandwidth: float = 50 * 1024 * 1024,
+        flood_wait_rate: float = 0.0,
+        flood_wait_seconds: int = 1,
+        seed: int = 1
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.random = random.Random(seed)
+
+    async def call(self, size: int = 0, flood: bool = False):
+        """Simulate one API round trip transferring size bytes"""
+        if flood and self.flood_wait_rate and self.random.random() < self.flood_wait_rate:
+            raise FloodWait(value=self.flood_wait_seconds)
+        await asyncio.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+
+class FakeUser:
+    def __init__(self, user_id: int, username: Optional[str] = None, first_name: str = "Test", is_self: bool = False):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.is_self = is_self
+        self.has_stories = True
+
+    @property
+    def mention(self) -> str:
+        return f"[{self.first_name}](tg://user?id={self.id})"
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, username: Optional[str] = None, chat_type: ChatType = ChatType.PRIVATE):
+        self.id = chat_id
+        self.username = username
+        self.type = chat_type
+
+
+class FakeMedia:
+    def __init__(self, file_size: int, ttl_seconds: Optional[int] = None):
+        self.file_id = f"fake_{next(_ids)}"
+        self.file_size = file_size
+        self.ttl_seconds = ttl_seconds
+
+
+class FakeMessage:
+    MEDIA_ATTRS = ("photo", "video", "document", "audio", "voice", "video_note")
+
+    def __init__(
+        self,
+        client: "FakeClient",
+        chat: FakeChat,
+        from_user: Optional[FakeUser],
+        text: Optional[str] = None,
+        media_type: Optional[str] = None,
+        file_size: int = 0,
+        ttl_seconds: Optional[int] = None,
+        caption: Optional[str] = None,
+        media_group_id: Optional[str] = None,
+        reply_to_message: Optional["FakeMessage"] = None,
+        outgoing: bool = False
+    ):
+        self._client = client
+        self.id = next(_ids)
+        self.chat = chat
+        self.from_user = from_user
+        self.date = datetime.now()
+        self.text = text
+        self.caption = caption
+        self.media_group_id = media_group_id
+        self.reply_to_message = reply_to_message
+        self.outgoing = outgoing
+        self.command = None
+        self.service = None
+        self.media = media_type
+        for attr in self.MEDIA_ATTRS:
+            setattr(self, attr, FakeMedia(file_size, ttl_seconds) if attr == media_type else None)
+        self.edits: List[str] = []
+
+    async def download(self, file_name: str = "", progress: Callable = None, progress_args: tuple = ()):
+        media = getattr(self, self.media) if self.media else None
+        if media is None:
+            return None
+        return await self._client.download_media(self, media.file_size, file_name, progress, progress_args)
+
+    async def edit_text(self, text: str, **kwargs):
+        self.edits.append(text)
+        await self._client.profile.call()
+        return self
+
+    async def reply_text(self, text: str, **kwargs):
+        await self._client.profile.call()
+        return self._client.make_message(self.chat, self._client.me, text=text, outgoing=True)
+
+    async def delete(self):
+        await self._client.profile.call()
+        return True
+
+
+class FakeStory(_StoryBase):
+    def __init__(self, client: "FakeClient", story_id: int, media_type: str, file_size: int, caption: Optional[str] = None):
+        self._client = client
+        self.id = story_id
+        self.date = datetime.now()
+        self.caption = caption
+        self.photo = FakeMedia(file_size) if media_type == "photo" else None
+        self.video = FakeMedia(file_size) if media_type == "video" else None
+        self.views = None
+        self.expire_date = None
+
+    async def download(self, file_name: str = "", progress: Callable = None, progress_args: tuple = ()):
+        media = self.photo or self.video
+        return await self._client.download_media(self, media.file_size, file_name, progress, progress_args)
+
+
+class FakeClient:
+    """Implements the subset of pyrogram.Client the handlers use"""
+
+    def __init__(self, profile: Optional[FakeProfile] = None, me_id: int = 1, name: str = "fake"):
+        self.profile = profile or FakeProfile()
+        self.name = name
+        self.me = FakeUser(me_id, username=f"{name}_me", is_self=True)
+        self.handlers: List[tuple] = []  # (group, filters, callback)
+        self.groups: Dict[str, List["FakeMessage"]] = {}
+        self.stories: Dict[str, List[FakeStory]] = {}
+        self.sent: List[Any] = []
+        self.calls: Dict[str, int] = {}
+        self.is_connected = False
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    # ---- Builders ----------------------------------------------------
+
+    def make_message(self, chat: FakeChat, from_user: Optional[FakeUser], **kwargs) -> FakeMessage:
+        return FakeMessage(self, chat, from_user, **kwargs)
+
+    def make_album(self, chat: FakeChat, from_user: FakeUser, count: int, file_size: int) -> List[FakeMessage]:
+        group_id = str(next(_ids))
+        album = [
+            self.make_message(chat, from_user, media_type="photo" if i % 2 == 0 else "video",
+                              file_size=file_size, media_group_id=group_id)
+            for i in range(count)
+        ]
+        self.groups[group_id] = album
+        return album
+
+    def add_stories(self, username: str, count: int, file_size: int):
+        self.stories[username] = [
+            FakeStory(self, i + 1, "photo" if i % 2 == 0 else "video", file_size) for i in range(count)
+        ]
+
+    # ---- Handler registration ----------------------------------------
+
+    def on_message(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers.append((group, filters, func))
+            self.handlers.sort(key=lambda h: h[0])
+            return func
+        return decorator
+
+    async def dispatch(self, message: FakeMessage) -> int:
+        """Run the first matching handler of every group, like Pyrogram's dispatcher"""
+        handled = 0
+        for group, handlers in itertools.groupby(self.handlers, key=lambda h: h[0]):
+            for _, flt, callback in handlers:
+                matched = True if flt is None else flt(self, message)
+                if inspect.isawaitable(matched):
+                    matched = await matched
+                if matched:
+                    await callback(self, message)
+                    handled += 1
+                    break
+        return handled
+
+    # ---- Lifecycle -----------------------------------------------------
+
+    async def start(self):
+        await self.profile.call()
+        self.is_connected = True
+        return self
+
+    async def stop(self):
+        self.is_connected = False
+        return self
+
+    async def get_me(self):
+        self._count("get_me")
+        await self.profile.call()
+        return self.me
+
+    # ---- API -----------------------------------------------------------
+
+    async def download_media(self, message, size: int, file_name: str, progress=None, progress_args=()):
+        self._count("download")
+        await self.profile.call(size, flood=True)
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = _PAYLOAD[:min(remaining, len(_PAYLOAD))]
+                f.write(chunk)
+                remaining -= len(chunk)
+        if progress:
+            await progress(size, size, *progress_args)
+        return file_name
+
+    async def _send(self, kind: str, chat_id, path: str, **kwargs):
+        self._count(kind)
+        await self.profile.call(os.path.getsize(path) if path and os.path.exists(path) else 0, flood=True)
+        message = self.make_message(FakeChat(self.me.id), self.me, outgoing=True, caption=kwargs.get("caption"))
+        self.sent.append((kind, chat_id, path))
+        return message
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._send("send_photo", chat_id, photo, **kwargs)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._send("send_video", chat_id, video, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._send("send_document", chat_id, document, **kwargs)
+
+    async def send_audio(self, chat_id, audio, **kwargs):
+        return await self._send("send_audio", chat_id, audio, **kwargs)
+
+    async def send_voice(self, chat_id, voice, **kwargs):
+        return await self._send("send_voice", chat_id, voice, **kwargs)
+
+    async def send_video_note(self, chat_id, video_note, **kwargs):
+        return await self._send("send_video_note", chat_id, video_note, **kwargs)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._count("send_message")
+        await self.profile.call()
+        return self.make_message(FakeChat(self.me.id), self.me, text=text, outgoing=True)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self._count("send_media_group")
+        size = sum(os.path.getsize(item.media) for item in media if isinstance(item.media, str))
+        await self.profile.call(size, flood=True)
+        return [self.make_message(FakeChat(self.me.id), self.me, outgoing=True) for _ in media]
+
+    async def get_media_group(self, chat_id, message_id):
+        self._count("get_media_group")
+        await self.profile.call()
+        for album in self.groups.values():
+            if any(m.id == message_id for m in album):
+                return album
+        raise ValueError("The message doesn't belong to a media group")
+
+    async def get_users(self, user_ids):
+        self._count("get_users")
+        await self.profile.call()
+        username = str(user_ids).lstrip("@")
+        return FakeUser(abs(hash(username)) % 10 ** 9, username=username)
+
+    async def get_chat_history(self, chat_id, limit: int = 0, **kwargs):
+        self._count("get_chat_history")
+        await self.profile.call()
+        for stories in self.stories.values():
+            for story in stories[:limit or None]:
+                yield story
+
+
+class FakeStoryClient(FakeClient):
+    """FakeClient with the stories methods of Pyrogram forks on newer layers"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pinned: Dict[str, List[FakeStory]] = {}
+
+    def add_stories(self, username: str, count: int, file_size: int, pinned: int = 0):
+        super().add_stories(username, count, file_size)
+        # Pinned listings come newest first, which is what offset_id paging relies on
+        self.pinned[username] = [
+            FakeStory(self, count + i + 1, "photo", file_size) for i in reversed(range(pinned))
+        ]
+
+    def _owner(self, chat_id) -> str:
+        for username in self.stories:
+            if abs(hash(username)) % 10 ** 9 == chat_id:
+                return username
+        return ""
+
+    async def get_peer_stories(self, chat_id):
+        self._count("get_peer_stories")
+        await self.profile.call()
+        for story in self.stories.get(self._owner(chat_id), []):
+            yield story
+
+    async def get_pinned_stories(self, chat_id, offset_id: int = 0, limit: int = 0):
+        self._count("get_pinned_stories")
+        await self.profile.call()
+        stories = [s for s in self.pinned.get(self._owner(chat_id), []) if not offset_id or s.id < offset_id]
+        for story in stories[:limit or None]:
+            yield story
+
+    async def get_stories(self, chat_id, story_ids):
+        self._count("get_stories")
+        await self.profile.call()
+        owner = self._owner(chat_id)
+        by_id = {s.id: s for s in self.stories.get(owner, []) + self.pinned.get(owner, [])}
+        return [by_id[i] for i in story_ids if i in by_id]
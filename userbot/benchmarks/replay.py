@@ -0,0 +1,205 @@
+"""Replay a recorded traffic log through TgSecretUserbot's registered handlers
+
+Record on a live session with `.record start` / `.record stop` (or
+TRAFFIC_RECORD=true), then from the userbot directory:
+    python -m benchmarks.replay logs/traffic/traffic_20240101_120000.jsonl.gz --speed 10
+    python -m benchmarks.replay traffic.jsonl.gz --speed max --baseline benchmarks/replay_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# benchmarks.run sets up sys.path and a throwaway STORAGE_PATH before src.config loads
+from benchmarks.run import BENCH_DIR, peak_rss_mb, percentile, compare, print_table
+from benchmarks.fakes import FakeClient, FakeProfile, FakeChat, FakeUser, FakeMessage  # noqa: E402
+from benchmarks.stubs import BackendStub, AIStub  # noqa: E402
+from src.main import TgSecretUserbot  # noqa: E402
+from src.utils.traffic_recorder import load_events  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "replay_baseline.json"
+
+
+class Replayer:
+    def __init__(self, client: FakeClient, bot: TgSecretUserbot):
+        self.client = client
+        self.bot = bot
+        self.users: Dict[int, FakeUser] = {}
+        self.chats: Dict[int, FakeChat] = {}
+        self.groups: Dict[int, List[FakeMessage]] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors = 0
+
+    def _user(self, anon_id) -> FakeUser:
+        if anon_id is None:
+            return None
+        if anon_id not in self.users:
+            self.users[anon_id] = FakeUser(100_000 + anon_id, username=f"user{anon_id}")
+        return self.users[anon_id]
+
+    def _chat(self, anon_id) -> FakeChat:
+        if anon_id not in self.chats:
+            self.chats[anon_id] = FakeChat(100_000 + (anon_id or 0))
+        return self.chats[anon_id]
+
+    def _media_message(self, chat: FakeChat, shape: Dict[str, Any]) -> FakeMessage:
+        group = shape.get("group")
+        message = self.client.make_message(
+            chat, self._user(shape.get("from")),
+            media_type=shape["media"], file_size=shape.get("size", 0),
+            ttl_seconds=shape.get("ttl"),
+            caption="x" * shape["caption_len"] if shape.get("caption_len") else None,
+            media_group_id=str(group) if group else None
+        )
+        if group:
+            self.groups.setdefault(group, []).append(message)
+            self.client.groups[str(group)] = self.groups[group]
+        return message
+
+    def build(self, event: Dict[str, Any]) -> FakeMessage:
+        """Turn a recorded event back into a message with the same shape"""
+        chat = self._chat(event.get("chat"))
+        outgoing = event.get("out", False)
+        sender = self.client.me if outgoing else self._user(event.get("from"))
+
+        if event.get("media") and not event.get("cmd"):
+            message = self._media_message(chat, {**event, "from": event.get("from")})
+            message.from_user = sender
+            message.outgoing = outgoing
+            return message
+
+        text = None
+        if event.get("cmd"):
+            text = f".{event['cmd']}"
+            if event.get("arg"):
+                arg = f"user{event['arg']}" if event["cmd"] in ("get", "story") else "x" * event.get("arg_len", 1)
+                text += f" {arg}"
+        elif event.get("text_len"):
+            text = "x" * event["text_len"]
+
+        reply = None
+        if event.get("reply", {}).get("media"):
+            reply = self._media_message(chat, event["reply"])
+
+        return self.client.make_message(chat, sender, text=text, reply_to_message=reply, outgoing=outgoing)
+
+    async def handle(self, event: Dict[str, Any]):
+        message = self.build(event)
+        kind = event.get("cmd") or ("media" if event.get("media") else "text")
+        start = time.perf_counter()
+        try:
+            await self.client.dispatch(message)
+        except Exception:
+            self.errors += 1
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    async def replay(self, events: List[Dict[str, Any]], speed: float) -> float:
+        """Dispatch events concurrently on their recorded schedule; speed 0 means max"""
+        tasks = []
+        start = time.perf_counter()
+        for event in events:
+            if speed:
+                delay = event.get("t", 0) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.handle(event)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    def report(self, wall: float) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for kind, values in sorted(self.latencies.items()):
+            results[kind] = {
+                "ops": len(values),
+                "failures": 0,
+                "throughput": len(values) / wall if wall else 0.0,
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        results["total"] = {
+            "ops": total,
+            "failures": self.errors,
+            "throughput": total / wall if wall else 0.0,
+            "p50_ms": percentile([x for v in self.latencies.values() for x in v], 0.50) * 1000,
+            "p99_ms": percentile([x for v in self.latencies.values() for x in v], 0.99) * 1000,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        return results
+
+
+def parse_speed(value: str) -> float:
+    value = value.lower().rstrip("x×")
+    return 0.0 if value == "max" else float(value)
+
+
+async def run(args) -> int:
+    events = load_events(args.log)
+    ai_stub = AIStub(tokens=args.tokens, token_latency=args.token_latency)
+    backend_stub = BackendStub(latency=args.backend_latency)
+    backend_stub.ai_endpoint = f"{await ai_stub.start()}/v1/chat/completions"
+    backend_url = await backend_stub.start()
+
+    client = FakeClient(FakeProfile(latency=args.latency, bandwidth=args.bandwidth * 1024 * 1024))
+    bot = TgSecretUserbot()
+    bot.backend.base_url = backend_url
+    bot.capture_handler.enabled = args.capture
+    await bot.initialize(client=client)
+    bot.job_queue.start()
+
+    replayer = Replayer(client, bot)
+    try:
+        wall = await replayer.replay(events, parse_speed(args.speed))
+    finally:
+        await bot.job_queue.stop()
+        await bot.backend.close()
+        await backend_stub.stop()
+        await ai_stub.stop()
+
+    results = replayer.report(wall)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print(f"Replayed {len(events)} events at {args.speed} in {wall:.2f}s")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", type=Path, help="recorded traffic log (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", default="1", help="1, 10 (×) or max")
+    parser.add_argument("--capture", action="store_true", help="enable auto-capture during replay")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--bandwidth", type=float, default=50, help="MB/s")
+    parser.add_argument("--backend-latency", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+    try:
+        return asyncio.run(run(args))
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
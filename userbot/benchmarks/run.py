@@ -0,0 +1,381 @@
+"""Benchmark the userbot handlers against fake Telegram, backend and AI stand-ins
+
+Usage (from the userbot directory):
+    python -m benchmarks.run                          # all scenarios, compare to baseline
+    python -m benchmarks.run -s media album --ops 200 --concurrency 8
+    python -m benchmarks.run --save-baseline          # record the current numbers
+    python -m benchmarks.run -s codec ai --codec json # stdlib JSON, to compare with --codec auto
+    python -m benchmarks.run -s store store_enc range_read --size 4096  # encryption at rest cost
+    SUBSCRIPTION_SPECULATIVE=false python -m benchmarks.run -s gate    # serial gate, to compare
+    python -m benchmarks.run -s story_list --pinned 250              # listing round trips per .get
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+USERBOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(USERBOT_DIR))
+
+# Keep benchmark artifacts out of the real storage tree; must happen before src.config loads
+BENCH_DIR = Path(tempfile.mkdtemp(prefix="tgsecret-bench-"))
+os.environ["STORAGE_PATH"] = str(BENCH_DIR / "storage")
+os.environ["TRACE_PATH"] = str(BENCH_DIR / "traces.jsonl")
+os.environ.setdefault("COMPACTION_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+from benchmarks.fakes import FakeClient, FakeProfile, FakeChat, FakeUser, FakeStoryClient  # noqa: E402
+from benchmarks.stubs import BackendStub, AIStub  # noqa: E402
+from src.handlers.media_handler import MediaHandler  # noqa: E402
+from src.handlers.story_handler import StoryHandler  # noqa: E402
+from src.handlers.ai_handler import AIHandler  # noqa: E402
+from src.middleware.force_subscribe import ForceSubscribeMiddleware  # noqa: E402
+from src.utils.backend_api import BackendAPI  # noqa: E402
+from src.utils.media_index import MediaIndex  # noqa: E402
+from src.utils.storage import MediaStorage  # noqa: E402
+from src.utils import encryption  # noqa: E402
+from src.utils.stories import StoryFetcher  # noqa: E402
+from src.utils import serialization  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def measure(name: str, ops: int, concurrency: int, op: Callable[[int], Awaitable[bool]]) -> Dict[str, float]:
+    """Run op(i) for i in range(ops) with bounded concurrency"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async def run_one(i: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            ok = await op(i)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_one(i) for i in range(ops)])
+    wall = time.perf_counter() - start
+
+    return {
+        "ops": ops,
+        "failures": failures,
+        "throughput": ops / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.profile = FakeProfile(
+            latency=args.latency,
+            bandwidth=args.bandwidth * 1024 * 1024,
+            flood_wait_rate=args.flood_rate,
+            flood_wait_seconds=1
+        )
+        self.client = FakeClient(self.profile)
+        self.backend_stub = BackendStub(latency=args.backend_latency)
+        self.ai_stub = AIStub(tokens=args.tokens, token_latency=args.token_latency)
+        self.backend = None
+        self.index = None
+
+    async def __aenter__(self):
+        ai_url = await self.ai_stub.start()
+        self.backend_stub.ai_endpoint = f"{ai_url}/v1/chat/completions"
+        backend_url = await self.backend_stub.start()
+        self.backend = BackendAPI(backend_url, "bench-secret")
+        self.index = MediaIndex(BENCH_DIR / "index.sqlite3")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.backend.close()
+        self.index.close()
+        await self.backend_stub.stop()
+        await self.ai_stub.stop()
+
+    def _sender(self, i: int):
+        return FakeChat(10_000 + i), FakeUser(10_000 + i, username=f"sender{i}")
+
+    async def media(self) -> Dict[str, float]:
+        handler = MediaHandler(self.backend, self.index)
+
+        async def op(i: int) -> bool:
+            chat, user = self._sender(i)
+            media = self.client.make_message(chat, user, media_type="photo" if i % 2 else "video",
+                                             file_size=self.args.size * 1024, ttl_seconds=10)
+            command = self.client.make_message(chat, self.client.me, text=".ok", outgoing=True)
+            result = await handler.save_disappearing_media(self.client, media, command)
+            return result["success"]
+
+        return await measure("media", self.args.ops, self.args.concurrency, op)
+
+    async def album(self) -> Dict[str, float]:
+        handler = MediaHandler(self.backend, self.index)
+
+        async def op(i: int) -> bool:
+            chat, user = self._sender(i)
+            album = self.client.make_album(chat, user, self.args.album_size, self.args.size * 1024)
+            command = self.client.make_message(chat, self.client.me, text=".ok", outgoing=True)
+            result = await handler.save_media_group(self.client, album[0], command)
+            return result["success"]
+
+        return await measure("album", max(1, self.args.ops // self.args.album_size), self.args.concurrency, op)
+
+    async def story(self) -> Dict[str, float]:
+        handler = StoryHandler(self.backend, self.index)
+        ops = max(1, self.args.ops // 20)
+
+        async def op(i: int) -> bool:
+            username = f"storyuser{i}"
+            self.client.stories = {}
+            self.client.add_stories(username, self.args.stories, self.args.size * 1024)
+            status = self.client.make_message(FakeChat(self.client.me.id), self.client.me, text=".get", outgoing=True)
+            result = await handler.download_stories(self.client, username, status)
+            return result["success"]
+
+        return await measure("story", ops, 1, op)
+
+    async def story_list(self) -> Dict[str, float]:
+        """Listing only: active stories plus --pinned pinned ones through the stories methods"""
+        client = FakeStoryClient(self.profile)
+        fetcher = StoryFetcher(client)
+        expected = self.args.stories + self.args.pinned
+
+        async def op(i: int) -> bool:
+            username = f"storyuser{i}"
+            client.add_stories(username, self.args.stories, self.args.size * 1024, pinned=self.args.pinned)
+            user = await client.get_users(username)
+            return len(await fetcher.fetch(user)) == min(expected, fetcher.limit)
+
+        result = await measure("story_list", self.args.ops, self.args.concurrency, op)
+        listing = sum(v for k, v in client.calls.items() if k != "get_users")
+        result["requests_per_op"] = listing / self.args.ops
+        return result
+
+    async def ai(self) -> Dict[str, float]:
+        handler = AIHandler(self.backend)
+
+        async def op(i: int) -> bool:
+            # Distinct users so the per-user rate limit doesn't skew throughput
+            result = await handler.process_query(20_000 + i, f"benchmark question {i}")
+            return result["success"]
+
+        return await measure("ai", self.args.ops, self.args.concurrency, op)
+
+    async def subscribe(self) -> Dict[str, float]:
+        self.backend_stub.channels = [{"id": -100123, "username": "bench_channel"}]
+        middleware = ForceSubscribeMiddleware(self.backend)
+
+        async def op(i: int) -> bool:
+            return await middleware.check_subscription(30_000 + i)
+
+        return await measure("subscribe", self.args.ops, self.args.concurrency, op)
+
+    async def gate(self) -> Dict[str, float]:
+        """Subscription check plus a .get user lookup, overlapped unless SUBSCRIPTION_SPECULATIVE=false"""
+        self.backend_stub.channels = [{"id": -100123, "username": "bench_channel"}]
+        middleware = ForceSubscribeMiddleware(self.backend)
+
+        async def op(i: int) -> bool:
+            allowed, user = await middleware.speculate(
+                40_000 + i, lambda: self.client.get_users(f"bench_user_{i}")
+            )
+            return allowed and user is not None
+
+        return await measure("gate", self.args.ops, self.args.concurrency, op)
+
+
+    async def codec(self) -> Dict[str, float]:
+        """Encode a media log payload and decode a large AI reply with the selected JSON codec"""
+        text = " ".join(f"token{i}" for i in range(self.args.reply_kb * 128))
+        reply = serialization.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion", "model": "bench-model",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": self.args.reply_kb * 128}
+        }).encode()
+        payload = {
+            "userId": "10000", "fileId": "bench", "mediaType": "photo", "fileSize": 524288,
+            "derivatives": {"thumbnail": "saved_media/202401/bench.thumb.webp"},
+            "items": [{"file_id": f"item{i}", "file_size": 524288, "media_type": "photo"} for i in range(10)]
+        }
+
+        async def op(i: int) -> bool:
+            serialization.dumps(payload)
+            response, _ = serialization.decode_reply("openai", reply)
+            return bool(response)
+
+        return await measure("codec", self.args.ops * 10, 1, op)
+
+    def _storage(self, name: str, encrypt: bool) -> Optional[MediaStorage]:
+        if encrypt and encryption.AESGCM is None:
+            print(f"Skipping {name}: cryptography is not installed")
+            return None
+        root = BENCH_DIR / name
+        storage = MediaStorage(root, root / "cold", encrypt=encrypt)
+        if encrypt:
+            storage.keyring.add(os.urandom(32))
+        return storage
+
+    async def _store(self, name: str, encrypt: bool) -> Optional[Dict[str, float]]:
+        """Move downloaded files into the archive (plaintext rename vs streaming encryption)"""
+        storage = self._storage(name, encrypt)
+        if storage is None:
+            return None
+        sources = BENCH_DIR / f"{name}-downloads"
+        sources.mkdir(parents=True, exist_ok=True)
+        # Pre-create the downloads on another filesystem path so only the store is timed
+        payload = os.urandom(self.args.size * 1024)
+        for i in range(self.args.ops):
+            (sources / f"{i}.bin").write_bytes(payload)
+
+        async def op(i: int) -> bool:
+            stored = await storage.store(sources / f"{i}.bin", storage.root / "saved_media" / f"{i}.bin")
+            return stored.exists()
+
+        result = await measure(name, self.args.ops, self.args.concurrency, op)
+        result["mb_per_s"] = result["throughput"] * self.args.size / 1024
+        return result
+
+    async def store(self) -> Optional[Dict[str, float]]:
+        return await self._store("store", encrypt=False)
+
+    async def store_enc(self) -> Optional[Dict[str, float]]:
+        return await self._store("store_enc", encrypt=True)
+
+    async def range_read(self) -> Optional[Dict[str, float]]:
+        """64KB reads at random offsets of one large encrypted file (only touched chunks decrypt)"""
+        storage = self._storage("range_read", encrypt=True)
+        if storage is None:
+            return None
+        source = BENCH_DIR / "range-source.bin"
+        source.write_bytes(os.urandom(self.args.size * 1024 * 16))
+        logical = storage.root / "saved_media" / "large.bin"
+        await storage.store(source, logical)
+        size = self.args.size * 1024 * 16
+        window = 64 * 1024
+
+        def read_window(offset: int) -> int:
+            with storage.open(logical) as f:
+                f.seek(offset)
+                return len(f.read(window))
+
+        async def op(i: int) -> bool:
+            offset = random.randrange(0, max(1, size - window))
+            return await asyncio.to_thread(read_window, offset) > 0
+
+        return await measure("range_read", self.args.ops * 10, self.args.concurrency, op)
+
+
+SCENARIOS = ("media", "album", "story", "story_list", "ai", "subscribe", "gate", "codec", "store", "store_enc", "range_read")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """Regressions beyond tolerance: lower throughput or higher p99"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput']:.1f}/s < baseline {base['throughput']:.1f}/s")
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']:.1f}ms > baseline {base['p99_ms']:.1f}ms")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]):
+    print(f"{'scenario':<12}{'ops':>6}{'fail':>6}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'rss MB':>9}{'vs base':>10}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        delta = f"{(r['throughput'] / base['throughput'] - 1) * 100:+.1f}%" if base and base["throughput"] else "-"
+        print(f"{name:<12}{r['ops']:>6}{r['failures']:>6}{r['throughput']:>10.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['peak_rss_mb']:>9.1f}{delta:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--ops", type=int, default=100, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--size", type=int, default=512, help="media size in KB")
+    parser.add_argument("--album-size", type=int, default=5)
+    parser.add_argument("--stories", type=int, default=3, help="stories per .get")
+    parser.add_argument("--pinned", type=int, default=250, help="pinned stories per user (story_list)")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Telegram RTT in seconds")
+    parser.add_argument("--bandwidth", type=float, default=50, help="fake Telegram bandwidth in MB/s")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of an injected FloodWait")
+    parser.add_argument("--backend-latency", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=50, help="tokens streamed per AI reply")
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--codec", default="auto", choices=("auto",) + serialization.CODECS,
+                        help="JSON codec for backend/AI traffic (compare json against auto)")
+    parser.add_argument("--reply-kb", type=int, default=64, help="AI reply size for the codec scenario")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression ratio")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> int:
+    print(f"JSON codec: {serialization.set_codec(args.codec)}")
+    results = {}
+    async with Bench(args) as bench:
+        for name in args.scenarios:
+            result = await getattr(bench, name)()
+            if result is not None:
+                results[name] = result
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({**baseline, **results}, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        return asyncio.run(run(args))
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Local aiohttp stand-ins for the NestJS backend and the AI providers"""
+import asyncio
+import json
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class BackendStub:
+    """Implements the endpoints BackendAPI calls with configurable latency"""
+
+    def __init__(self, latency: float = 0.005, channels: Optional[list] = None, ai_endpoint: str = ""):
+        self.latency = latency
+        self.channels = channels or []
+        self.ai_endpoint = ai_endpoint
+        self.ai_provider = "openai"
+        self.calls: Dict[str, int] = {}
+        self.events: list = []
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/session/status", self._ok)
+        app.router.add_get("/api-keys/user/{user_id}", self._api_key)
+        app.router.add_post("/media/log", self._log)
+        app.router.add_post("/stories/log", self._log)
+        app.router.add_post("/ai/usage", self._log)
+        app.router.add_get("/force-subscribe/channels", self._channels)
+        app.router.add_post("/force-subscribe/check", self._check)
+        return app
+
+    async def _delay(self, request: web.Request):
+        self.calls[request.path] = self.calls.get(request.path, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    async def _ok(self, request):
+        await self._delay(request)
+        return web.json_response({"success": True})
+
+    async def _api_key(self, request):
+        await self._delay(request)
+        return web.json_response({
+            "success": True,
+            "provider": self.ai_provider,
+            "key": "bench-key",
+            "model": "bench-model",
+            "endpoint": self.ai_endpoint
+        })
+
+    async def _log(self, request):
+        await self._delay(request)
+        self.events.append(await request.json())
+        return web.json_response({"success": True})
+
+    async def _channels(self, request):
+        await self._delay(request)
+        return web.json_response({"success": True, "channels": self.channels})
+
+    async def _check(self, request):
+        await self._delay(request)
+        return web.json_response({"success": True, "isSubscribed": True})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = await _serve(self.app(), host, port)
+        self.url = _runner_url(self.runner)
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class AIStub:
+    """Mock OpenAI/Claude/Gemini endpoints that stream the reply token by token"""
+
+    def __init__(self, tokens: int = 50, token_latency: float = 0.002, first_token_latency: float = 0.05):
+        self.tokens = tokens
+        self.token_latency = token_latency
+        self.first_token_latency = first_token_latency
+        self.requests = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._openai)
+        app.router.add_post("/v1/messages", self._claude)
+        app.router.add_post("/v1beta/models/{model_action}", self._gemini)
+        return app
+
+    async def _stream(self, request: web.Request, wrap) -> web.StreamResponse:
+        """Write the JSON envelope, then the text one token at a time"""
+        self.requests += 1
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        await asyncio.sleep(self.first_token_latency)
+
+        prefix, suffix = wrap.split("__TEXT__")
+        await response.write(prefix.encode())
+        for idx in range(self.tokens):
+            await response.write(f"token{idx} ".encode())
+            await asyncio.sleep(self.token_latency)
+        await response.write(suffix.encode())
+        await response.write_eof()
+        return response
+
+    async def _openai(self, request):
+        envelope = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": "__TEXT__"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": self.tokens}
+        })
+        return await self._stream(request, envelope)
+
+    async def _claude(self, request):
+        envelope = json.dumps({
+            "content": [{"type": "text", "text": "__TEXT__"}],
+            "usage": {"input_tokens": 10, "output_tokens": self.tokens}
+        })
+        return await self._stream(request, envelope)
+
+    async def _gemini(self, request):
+        envelope = json.dumps({
+            "candidates": [{"content": {"parts": [{"text": "__TEXT__"}]}}],
+            "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": self.tokens}
+        })
+        return await self._stream(request, envelope)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = await _serve(self.app(), host, port)
+        self.url = _runner_url(self.runner)
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+async def _serve(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def _runner_url(runner: web.AppRunner) -> str:
+    host, port = runner.addresses[0][:2]
+    return f"http://{host}:{port}"
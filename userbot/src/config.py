@@ -24,21 +24,129 @@ STORAGE_PATH = Path(os.getenv("STORAGE_PATH", BASE_DIR / "storage"))
 SESSIONS_PATH = BASE_DIR / "sessions"
 TEMP_PATH = STORAGE_PATH / "temp"
 
-# Create directories if they don't exist
-STORAGE_PATH.mkdir(parents=True, exist_ok=True)
-SESSIONS_PATH.mkdir(parents=True, exist_ok=True)
-TEMP_PATH.mkdir(parents=True, exist_ok=True)
+# Multi-account host: where sessions come from ("local", "backend" or "both")
+HOST_SESSIONS_SOURCE = os.getenv("HOST_SESSIONS_SOURCE", "local")
+HOST_START_CONCURRENCY = int(os.getenv("HOST_START_CONCURRENCY", "5"))
+HOST_HEALTH_INTERVAL = int(os.getenv("HOST_HEALTH_INTERVAL", "60"))  # seconds
+
+# Process-sharded supervisor (python -m src.supervisor)
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+SUPERVISOR_POLL = int(os.getenv("SUPERVISOR_POLL", "30"))  # seconds between session rescans
+
+def ensure_directories():
+    """Create storage, session and log directories; called once at startup, not on import"""
+    for path in (STORAGE_PATH, SESSIONS_PATH, TEMP_PATH, LOG_FILE.parent):
+        path.mkdir(parents=True, exist_ok=True)
+
+# Encryption at rest (chunked AES-256-GCM, data keys issued and wrapped by the backend)
+STORAGE_ENCRYPTION = os.getenv("STORAGE_ENCRYPTION", "false").lower() == "true"
+STORAGE_ENCRYPTION_KEY = os.getenv("STORAGE_ENCRYPTION_KEY", "")  # 64 hex chars, bypasses the backend
+STORAGE_KEY_FILE = STORAGE_PATH / ".storage_keys.json"  # wrapped keys only
+STORAGE_CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", str(64 * 1024)))
+
+# Local metadata index
+INDEX_PATH = STORAGE_PATH / "index.sqlite3"
+
+# Bulk export (.export writes here; the HTTP endpoint streams with X-Webhook-Secret auth)
+EXPORT_PATH = STORAGE_PATH / "exports"
+EXPORT_HTTP_ENABLED = os.getenv("EXPORT_HTTP_ENABLED", "false").lower() == "true"
+EXPORT_HOST = os.getenv("EXPORT_HOST", "127.0.0.1")
+EXPORT_PORT = int(os.getenv("EXPORT_PORT", "9465"))
+
+# Preview derivatives (thumbnails, video posters, audio waveforms)
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+THUMBNAIL_SIZE = 320  # max width/height in pixels
+WAVEFORM_POINTS = 100
+
+# Runtime speedups: JSON codec ("auto", "orjson", "msgspec" or "json") and uvloop in run.py
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+USE_UVLOOP = os.getenv("USE_UVLOOP", "false").lower() == "true"
 
 # Logging configuration
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
-LOG_FILE = BASE_DIR / "logs" / "userbot.log"
-LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+LOG_FILE = Path(os.getenv("LOG_FILE") or BASE_DIR / "logs" / "userbot.log")
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"  # JSON lines in the log file
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records buffered before dropping
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))  # repeated warnings/errors per call site per minute, 0 = unlimited
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "0"))  # past the limit, keep 1 in N repeats (0 = none)
+
+# Tracing and profiling
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_PATH = Path(os.getenv("TRACE_PATH") or LOG_FILE.parent / "traces.jsonl")
+PROFILE_PATH = LOG_FILE.parent / "profiles"
+
+# Traffic recording for load-test replay
+TRAFFIC_RECORD = os.getenv("TRAFFIC_RECORD", "false").lower() == "true"
+TRAFFIC_PATH = LOG_FILE.parent / "traffic"
+
+# Event loop watchdog
+WATCHDOG_ENABLED = os.getenv("WATCHDOG_ENABLED", "true").lower() == "true"
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))  # seconds before a stall is logged
+LOOP_DUMP_THRESHOLD = float(os.getenv("LOOP_DUMP_THRESHOLD", "1.0"))  # lag that dumps task stacks, 0 = off
+LOOP_DUMP_PATH = LOG_FILE.parent / "stalls"
 
 # Rate limiting
 MAX_CONCURRENT_DOWNLOADS = 3
 DOWNLOAD_TIMEOUT = 300  # 5 minutes
 AI_RATE_LIMIT = 10  # requests per minute
 
+# Force-subscribe gate: run the check alongside each command's first lookup, discarding it on deny
+SUBSCRIPTION_SPECULATIVE = os.getenv("SUBSCRIPTION_SPECULATIVE", "true").lower() == "true"
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))  # seconds a passed check is reused, 0 = off
+
+# AI failover: optional provider preference (e.g. "claude,openai,gemini") and hedging
+AI_FALLBACK_ORDER = os.getenv("AI_FALLBACK_ORDER", "")
+AI_HEDGE_ENABLED = os.getenv("AI_HEDGE_ENABLED", "true").lower() == "true"
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "1.0"))  # seconds
+AI_HEDGE_MAX_DELAY = float(os.getenv("AI_HEDGE_MAX_DELAY", "15.0"))  # used until a p95 is known
+AI_MAX_PARALLEL = 2  # primary plus one hedge in flight
+
+# AI admission control: in-flight requests per provider API key (adapts down on 429s)
+AI_MAX_IN_FLIGHT = int(os.getenv("AI_MAX_IN_FLIGHT", "4"))
+AI_PROVIDER_LIMITS = os.getenv("AI_PROVIDER_LIMITS", "")  # per-provider override, e.g. "openai=8,gemini=2"
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "60"))  # seconds a request may wait for a slot
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", "100"))  # waiting requests per key before rejecting
+
+# .ask conversation memory
+CONVERSATIONS_PATH = STORAGE_PATH / "conversations.sqlite3"
+AI_CONTEXT_TOKENS = int(os.getenv("AI_CONTEXT_TOKENS", "6000"))  # history budget per thread
+AI_SUMMARY_TOKENS = int(os.getenv("AI_SUMMARY_TOKENS", "800"))  # cap on the folded summary of older turns
+AI_CONVERSATION_TTL = int(os.getenv("AI_CONVERSATION_TTL", "3600"))  # seconds before a new .ask starts a fresh thread
+AI_CONVERSATION_CACHE = 256  # threads kept in memory
+
+# .get story listing (needs a Pyrogram build with the stories methods, else a 100-message history scan)
+STORY_FETCH_PINNED = os.getenv("STORY_FETCH_PINNED", "true").lower() == "true"  # profile/highlight stories
+STORY_FETCH_ARCHIVE = os.getenv("STORY_FETCH_ARCHIVE", "true").lower() == "true"  # own account only
+STORY_FETCH_LIMIT = int(os.getenv("STORY_FETCH_LIMIT", "500"))  # stories per .get
+
+# Graceful shutdown and warm restarts
+STATE_PATH = STORAGE_PATH / "state"  # cache snapshots, unfinished jobs and unsent backend events
+STATE_SHARED_NAME = os.getenv("STATE_SHARED_NAME", "shared")  # set per shard by the supervisor
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))  # seconds for queued/in-flight transfers
+BACKEND_FLUSH_TIMEOUT = float(os.getenv("BACKEND_FLUSH_TIMEOUT", "5"))  # seconds to resend pending backend events
+STATE_MAX_AGE = int(os.getenv("STATE_MAX_AGE", "3600"))  # older cache snapshots are ignored
+BACKEND_OUTBOX_SIZE = 1000  # failed backend events kept for retry
+STATE_MAX_PEERS = 5000  # most recently seen peers kept for in-memory sessions
+
+# Automatic view-once capture (opt-in)
+AUTO_CAPTURE_ENABLED = os.getenv("AUTO_CAPTURE_ENABLED", "false").lower() == "true"
+AUTO_CAPTURE_ALLOW = os.getenv("AUTO_CAPTURE_ALLOW", "")  # comma-separated chat ids/usernames
+AUTO_CAPTURE_DENY = os.getenv("AUTO_CAPTURE_DENY", "")
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "100"))
+CAPTURE_WORKERS = int(os.getenv("CAPTURE_WORKERS", str(MAX_CONCURRENT_DOWNLOADS)))
+
+# Archive compaction and cold tiering
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+COMPACTION_INTERVAL = int(os.getenv("COMPACTION_INTERVAL", "21600"))  # 6 hours
+COMPACTION_MIN_SAVING = 0.1  # keep compressed copies only if they save 10%+
+COLD_TIER_DAYS = int(os.getenv("COLD_TIER_DAYS", "30"))
+COLD_STORAGE_PATH = Path(os.getenv("COLD_STORAGE_PATH") or STORAGE_PATH / "cold")
+
+# Metrics endpoint (Prometheus text format)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
 # Media settings
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 SUPPORTED_MEDIA_TYPES = {
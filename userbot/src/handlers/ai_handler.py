@@ -1,22 +1,70 @@
 """AI handler for .ask command"""
 import asyncio
 import json
-from typing import Dict, Any, Optional
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 import aiohttp
 from datetime import datetime, timedelta
 
-from ..config import AI_ENDPOINTS, DEFAULT_AI_MODELS, AI_RATE_LIMIT
+from ..config import (
+    AI_ENDPOINTS, DEFAULT_AI_MODELS, AI_RATE_LIMIT,
+    AI_FALLBACK_ORDER, AI_HEDGE_ENABLED, AI_MAX_PARALLEL
+)
 from ..utils.logger import get_logger
+from ..utils.metrics import AI_REQUEST, AI_HEDGES, AI_TOKENS
+from ..utils.tracing import span
+from ..utils.serialization import dumps, loads, decode_reply
+from ..utils.provider_health import ProviderHealth
+from ..utils.admission import AdmissionController, PositionCallback, QueueTimeout
+from ..utils.conversations import Conversation, ConversationStore, estimate_tokens
 
 logger = get_logger(__name__)
 
+CACHE_CONTROL = {"type": "ephemeral"}
+
 class AIHandler:
     def __init__(self, backend_api):
         self.backend = backend_api
         self.rate_limit_cache = {}
+        self.health = ProviderHealth()
+        self.admission = AdmissionController()
+        self.conversations = ConversationStore()
+        self.session = None
+        
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        """One pooled session for all provider calls instead of one per request"""
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession(json_serialize=dumps)
+        return self.session
+    
+    async def close(self):
+        """Close aiohttp session and the conversation store"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+        self.conversations.close()
         
-    async def process_query(self, user_id: int, prompt: str) -> Dict[str, Any]:
-        """Process AI query from user"""
+    async def load_context(
+        self, user_id: int, chat_id: int, reply_to_id: Optional[int] = None
+    ) -> Tuple[Dict[str, Any], Conversation]:
+        """The user's API key config and the thread (of that account) a new question continues"""
+        api_config, conversation = await asyncio.gather(
+            self.backend.get_user_api_key(str(user_id)),
+            self.conversations.resolve(user_id, chat_id, reply_to_id)
+        )
+        return api_config or {}, conversation
+    
+    async def process_query(
+        self,
+        user_id: int,
+        prompt: str,
+        on_queued: Optional[Callable[[str, int], Awaitable[None]]] = None,
+        conversation: Optional[Conversation] = None,
+        api_config: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Process AI query from user, continuing `conversation` when given;
+        on_queued(provider, position) reports time spent queued, api_config
+        skips the key lookup when load_context already did it"""
         try:
             # Check rate limit
             if not self._check_rate_limit(user_id):
@@ -26,7 +74,8 @@ class AIHandler:
                 }
             
             # Get user's API key from backend
-            api_config = await self.backend.get_user_api_key(str(user_id))
+            if api_config is None:
+                api_config = await self.backend.get_user_api_key(str(user_id))
             
             if not api_config or not api_config.get('key'):
                 return {
@@ -34,24 +83,22 @@ class AIHandler:
                     "error": "No API key configured. Please add your AI API key in the admin panel."
                 }
             
-            provider = api_config.get('provider', 'openai')
-            api_key = api_config.get('key')
-            model = api_config.get('model') or DEFAULT_AI_MODELS.get(provider)
-            endpoint = api_config.get('endpoint') or AI_ENDPOINTS.get(provider)
+            history = conversation or Conversation(account_id=user_id, chat_id=user_id)
+            request = {"system": history.system_prompt(), "messages": history.messages(prompt)}
             
-            # Call appropriate AI provider
-            if provider == 'openai':
-                response = await self._call_openai(api_key, prompt, model, endpoint)
-            elif provider == 'claude':
-                response = await self._call_claude(api_key, prompt, model, endpoint)
-            elif provider == 'gemini':
-                response = await self._call_gemini(api_key, prompt, model, endpoint)
-            else:
-                response = await self._call_custom(api_key, prompt, endpoint, api_config)
+            # Primary provider first, then the user's other keys as fallbacks
+            response, routing = await self._race(self._candidates(api_config), request, user_id, on_queued)
             
             if response['success']:
+                if conversation is not None:
+                    await self.conversations.append(conversation, prompt, response['response'])
+                usage = self._record_usage(response, request)
+                
                 # Log usage to backend
-                await self.backend.log_ai_usage(str(user_id), provider, len(prompt), len(response['response']))
+                await self.backend.log_ai_usage(
+                    str(user_id), response['provider'], usage['prompt_tokens'], usage['completion_tokens'],
+                    routing, usage['cached_tokens']
+                )
                 
             return response
             
@@ -59,6 +106,195 @@ class AIHandler:
             logger.error(f"Error processing AI query: {e}", exc_info=True)
             return {"success": False, "error": str(e)}
     
+    def _record_usage(self, response: Dict[str, Any], request: Dict[str, Any]) -> Dict[str, int]:
+        """Token usage as reported by the provider (estimated if it reports none)"""
+        usage = response.get('usage') or {}
+        if not usage.get('prompt_tokens'):
+            usage = {
+                "prompt_tokens": estimate_tokens(request['system']) + sum(
+                    estimate_tokens(m['content']) for m in request['messages']),
+                "completion_tokens": estimate_tokens(response['response']),
+                "cached_tokens": 0
+            }
+        usage.setdefault('cached_tokens', 0)
+        provider = response['provider']
+        for kind in ('prompt', 'cached', 'completion'):
+            AI_TOKENS.inc(usage[f'{kind}_tokens'], provider=provider, kind=kind)
+        return usage
+    
+    def cache_hit_ratios(self) -> Dict[str, float]:
+        """Share of prompt tokens served from the provider's prompt cache"""
+        ratios = {}
+        for key, prompt_tokens in AI_TOKENS.values.items():
+            labels = dict(key)
+            if labels.get('kind') == 'prompt' and prompt_tokens:
+                cached = AI_TOKENS.values.get(
+                    tuple(sorted({**labels, 'kind': 'cached'}.items())), 0)
+                ratios[labels['provider']] = cached / prompt_tokens
+        return ratios
+    
+    def _candidates(self, api_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The fallback chain: the configured provider plus any `fallbacks` the backend returns"""
+        candidates, seen = [], set()
+        for config in [api_config] + list(api_config.get('fallbacks') or []):
+            provider = (config.get('provider') or 'openai').lower()
+            if not config.get('key') or provider in seen:
+                continue
+            seen.add(provider)
+            candidates.append({
+                **config,
+                'provider': provider,
+                'model': config.get('model') or DEFAULT_AI_MODELS.get(provider),
+                'endpoint': config.get('endpoint') or AI_ENDPOINTS.get(provider)
+            })
+        
+        if AI_FALLBACK_ORDER:
+            order = [p.strip().lower() for p in AI_FALLBACK_ORDER.split(',') if p.strip()]
+            candidates.sort(key=lambda c: order.index(c['provider']) if c['provider'] in order else len(order))
+        return candidates
+    
+    async def _race(
+        self,
+        candidates: List[Dict[str, Any]],
+        request: Dict[str, Any],
+        user_id: int,
+        on_queued: Optional[Callable[[str, int], Awaitable[None]]] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Try providers in health order, hedging to the next one when the current
+        is slower than its observed p95; the first success wins and the rest are cancelled"""
+        order = self.health.order(candidates)
+        pending: Dict[asyncio.Task, Dict[str, Any]] = {}
+        started: Dict[asyncio.Task, float] = {}
+        attempts: List[Dict[str, Any]] = []
+        result: Dict[str, Any] = {"success": False, "error": "No AI provider configured"}
+        winner = None
+        next_index = 0
+        start = time.perf_counter()
+        
+        def launch():
+            nonlocal next_index
+            candidate = order[next_index]
+            next_index += 1
+            task = asyncio.create_task(self._call_provider(candidate, request, user_id, on_queued))
+            pending[task] = candidate
+            started[task] = time.perf_counter()
+        
+        try:
+            if order:
+                launch()
+            while pending and winner is None:
+                newest = list(pending.values())[-1]
+                can_hedge = AI_HEDGE_ENABLED and next_index < len(order) and len(pending) < AI_MAX_PARALLEL
+                timeout = self.health.hedge_delay(newest['provider']) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    logger.info(f"Hedging slow {newest['provider']} request to {order[next_index]['provider']}")
+                    launch()
+                    continue
+                
+                for task in done:
+                    candidate = pending.pop(task)
+                    elapsed = time.perf_counter() - started.pop(task)
+                    outcome = task.result()
+                    self.health.record(candidate['provider'], elapsed, outcome['success'])
+                    attempts.append({
+                        "provider": candidate['provider'],
+                        "status": "ok" if outcome['success'] else "error",
+                        "latencyMs": round(elapsed * 1000)
+                    })
+                    if outcome['success'] and winner is None:
+                        winner = candidate['provider']
+                        result = {**outcome, "provider": winner}
+                    elif not outcome['success'] and winner is None:
+                        result = outcome
+                
+                # Fail over right away when the only in-flight request errored
+                if winner is None and not pending and next_index < len(order):
+                    launch()
+        finally:
+            for task, candidate in pending.items():
+                task.cancel()
+                attempts.append({"provider": candidate['provider'], "status": "cancelled"})
+        
+        hedged = len(attempts) > 1
+        if hedged and winner:
+            for attempt in attempts:
+                won = attempt['provider'] == winner
+                if won or attempt['status'] == "cancelled":
+                    self.health.record_hedge(attempt['provider'], won)
+                    AI_HEDGES.inc(provider=attempt['provider'], outcome="won" if won else "lost")
+        
+        routing = {
+            "winner": winner,
+            "hedged": hedged,
+            "latencyMs": round((time.perf_counter() - start) * 1000),
+            "attempts": attempts,
+            "health": {a['provider']: self.health.get(a['provider']).as_dict() for a in attempts},
+        }
+        return result, routing
+    
+    async def _call_provider(
+        self,
+        candidate: Dict[str, Any],
+        request: Dict[str, Any],
+        user_id: int,
+        on_queued: Optional[Callable[[str, int], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """Call appropriate AI provider once a slot for its API key is free"""
+        provider = candidate['provider']
+        api_key = candidate['key']
+        model = candidate['model']
+        endpoint = candidate['endpoint']
+        
+        limiter = self.admission.limiter(provider, api_key)
+        on_position: Optional[PositionCallback] = None
+        if on_queued is not None:
+            async def on_position(position: int):
+                await on_queued(provider, position)
+        try:
+            await limiter.acquire(user_id, on_position)
+        except QueueTimeout as e:
+            return {"success": False, "error": f"AI provider busy: {e}. Please try again shortly."}
+        
+        start = time.perf_counter()
+        response = {"success": False, "error": "cancelled"}
+        try:
+            with span("ai_provider", provider=provider, model=model):
+                if provider == 'openai':
+                    response = await self._call_openai(api_key, request, model, endpoint)
+                elif provider == 'claude':
+                    response = await self._call_claude(api_key, request, model, endpoint)
+                elif provider == 'gemini':
+                    response = await self._call_gemini(api_key, request, model, endpoint)
+                else:
+                    response = await self._call_custom(api_key, request, endpoint, candidate)
+        finally:
+            limiter.release(response['success'], response.get('status'), response.get('retry_after'))
+        AI_REQUEST.observe(
+            time.perf_counter() - start,
+            provider=provider, status="ok" if response['success'] else "error"
+        )
+        return response
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Rate-limit windows, provider health and adapted limits; API keys are never saved"""
+        return {
+            "rate_limits": {
+                str(uid): [t.timestamp() for t in times] for uid, times in self.rate_limit_cache.items()
+            },
+            "health": self.health.snapshot(),
+            "limits": self.admission.snapshot(),
+        }
+    
+    def restore(self, state: Dict[str, Any]):
+        self.rate_limit_cache.update({
+            int(uid): [datetime.fromtimestamp(t) for t in times]
+            for uid, times in state.get("rate_limits", {}).items()
+        })
+        self.health.restore(state.get("health", {}))
+        self.admission.restore(state.get("limits", {}))
+    
     def _check_rate_limit(self, user_id: int) -> bool:
         """Check if user has exceeded rate limit"""
         now = datetime.now()
@@ -81,132 +317,154 @@ class AIHandler:
         self.rate_limit_cache[user_id] = user_requests
         return True
     
-    async def _call_openai(self, api_key: str, prompt: str, model: str, endpoint: str) -> Dict[str, Any]:
-        """Call OpenAI API"""
+    async def _call_openai(self, api_key: str, request: Dict[str, Any], model: str, endpoint: str) -> Dict[str, Any]:
+        """Call OpenAI API (prompts over 1024 tokens are prefix-cached automatically)"""
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
         
+        system = [{"role": "system", "content": request['system']}] if request['system'] else []
         payload = {
             "model": model,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
+            "messages": system + request['messages'],
             "max_tokens": 4096,
             "temperature": 0.7
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return {
-                            "success": True,
-                            "response": data['choices'][0]['message']['content']
-                        }
-                    else:
-                        error_data = await response.text()
-                        return {
-                            "success": False,
-                            "error": f"OpenAI API error: {response.status} - {error_data}"
-                        }
+            session = await self._ensure_session()
+            async with session.post(endpoint, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    text, usage = decode_reply('openai', await response.read())
+                    return {
+                        "success": True,
+                        "response": text,
+                        "usage": usage
+                    }
+                else:
+                    error_data = await response.text()
+                    return {
+                        "success": False,
+                        "error": f"OpenAI API error: {response.status} - {error_data}",
+                        "status": response.status,
+                        "retry_after": response.headers.get("Retry-After")
+                    }
         except Exception as e:
             logger.error(f"OpenAI API call failed: {e}")
             return {"success": False, "error": str(e)}
     
-    async def _call_claude(self, api_key: str, prompt: str, model: str, endpoint: str) -> Dict[str, Any]:
-        """Call Claude API"""
+    async def _call_claude(self, api_key: str, request: Dict[str, Any], model: str, endpoint: str) -> Dict[str, Any]:
+        """Call Claude API, marking the summary and the history as cacheable prefixes"""
         headers = {
             "x-api-key": api_key,
             "anthropic-version": "2023-06-01",
             "Content-Type": "application/json"
         }
         
+        messages = [
+            {"role": m['role'], "content": [{"type": "text", "text": m['content']}]}
+            for m in request['messages']
+        ]
+        if len(messages) > 1:
+            # Everything before the new question is unchanged on the next turn
+            messages[-2]['content'][0]['cache_control'] = CACHE_CONTROL
         payload = {
             "model": model,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
+            "messages": messages,
             "max_tokens": 4096
         }
+        if request['system']:
+            payload['system'] = [{"type": "text", "text": request['system'], "cache_control": CACHE_CONTROL}]
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return {
-                            "success": True,
-                            "response": data['content'][0]['text']
-                        }
-                    else:
-                        error_data = await response.text()
-                        return {
-                            "success": False,
-                            "error": f"Claude API error: {response.status} - {error_data}"
-                        }
+            session = await self._ensure_session()
+            async with session.post(endpoint, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    text, usage = decode_reply('claude', await response.read())
+                    return {
+                        "success": True,
+                        "response": text,
+                        "usage": usage
+                    }
+                else:
+                    error_data = await response.text()
+                    return {
+                        "success": False,
+                        "error": f"Claude API error: {response.status} - {error_data}",
+                        "status": response.status,
+                        "retry_after": response.headers.get("Retry-After")
+                    }
         except Exception as e:
             logger.error(f"Claude API call failed: {e}")
             return {"success": False, "error": str(e)}
     
-    async def _call_gemini(self, api_key: str, prompt: str, model: str, endpoint: str) -> Dict[str, Any]:
-        """Call Gemini API"""
+    async def _call_gemini(self, api_key: str, request: Dict[str, Any], model: str, endpoint: str) -> Dict[str, Any]:
+        """Call Gemini API (repeated prefixes are cached implicitly)"""
         url = f"{endpoint}/{model}:generateContent?key={api_key}"
         
         payload = {
-            "contents": [{
-                "parts": [{
-                    "text": prompt
-                }]
-            }]
+            "contents": [
+                {"role": "model" if m['role'] == "assistant" else "user", "parts": [{"text": m['content']}]}
+                for m in request['messages']
+            ]
         }
+        if request['system']:
+            payload['systemInstruction'] = {"parts": [{"text": request['system']}]}
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return {
-                            "success": True,
-                            "response": data['candidates'][0]['content']['parts'][0]['text']
-                        }
-                    else:
-                        error_data = await response.text()
-                        return {
-                            "success": False,
-                            "error": f"Gemini API error: {response.status} - {error_data}"
-                        }
+            session = await self._ensure_session()
+            async with session.post(url, json=payload) as response:
+                if response.status == 200:
+                    text, usage = decode_reply('gemini', await response.read())
+                    return {
+                        "success": True,
+                        "response": text,
+                        "usage": usage
+                    }
+                else:
+                    error_data = await response.text()
+                    return {
+                        "success": False,
+                        "error": f"Gemini API error: {response.status} - {error_data}",
+                        "status": response.status,
+                        "retry_after": response.headers.get("Retry-After")
+                    }
         except Exception as e:
             logger.error(f"Gemini API call failed: {e}")
             return {"success": False, "error": str(e)}
     
-    async def _call_custom(self, api_key: str, prompt: str, endpoint: str, config: Dict) -> Dict[str, Any]:
-        """Call custom AI endpoint"""
-        headers = config.get('headers', {})
+    async def _call_custom(self, api_key: str, request: Dict[str, Any], endpoint: str, config: Dict) -> Dict[str, Any]:
+        """Call custom AI endpoint with the conversation flattened into one prompt"""
+        headers = dict(config.get('headers') or {})
         headers['Authorization'] = f"Bearer {api_key}"
         
-        payload = config.get('payload_template', {})
-        payload['prompt'] = prompt
+        transcript = [request['system']] if request['system'] else []
+        for m in request['messages'][:-1]:
+            transcript.append(f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}")
+        transcript.append(request['messages'][-1]['content'])
+        payload = dict(config.get('payload_template') or {})
+        payload['prompt'] = "\n\n".join(transcript)
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(endpoint, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        # Try to extract response from common patterns
-                        result = data.get('response') or data.get('text') or data.get('output') or str(data)
-                        return {
-                            "success": True,
-                            "response": result
-                        }
-                    else:
-                        error_data = await response.text()
-                        return {
-                            "success": False,
-                            "error": f"Custom API error: {response.status} - {error_data}"
-                        }
+            session = await self._ensure_session()
+            async with session.post(endpoint, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    data = loads(await response.read())
+                    # Try to extract response from common patterns
+                    result = data.get('response') or data.get('text') or data.get('output') or str(data)
+                    return {
+                        "success": True,
+                        "response": result
+                    }
+                else:
+                    error_data = await response.text()
+                    return {
+                        "success": False,
+                        "error": f"Custom API error: {response.status} - {error_data}",
+                        "status": response.status,
+                        "retry_after": response.headers.get("Retry-After")
+                    }
         except Exception as e:
             logger.error(f"Custom API call failed: {e}")
             return {"success": False, "error": str(e)}
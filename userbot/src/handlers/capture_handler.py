@@ -0,0 +1,71 @@
+"""Automatic capture of incoming self-destructing media"""
+from typing import Dict, Any, Set
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from ..config import AUTO_CAPTURE_ENABLED, AUTO_CAPTURE_ALLOW, AUTO_CAPTURE_DENY
+from ..utils.job_queue import MediaJobQueue, PRIORITY_AUTO
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _parse_chat_list(value: str) -> Set[str]:
+    return {item.strip().lstrip('@').lower() for item in value.split(',') if item.strip()}
+
+
+class CaptureHandler:
+    def __init__(self, media_handler, job_queue: MediaJobQueue):
+        self.media_handler = media_handler
+        self.job_queue = job_queue
+        self.enabled = AUTO_CAPTURE_ENABLED
+        self.allow = _parse_chat_list(AUTO_CAPTURE_ALLOW)
+        self.deny = _parse_chat_list(AUTO_CAPTURE_DENY)
+        self.captured = 0
+        self.skipped = 0
+
+    @staticmethod
+    def is_self_destructing(message: Message) -> bool:
+        """Whether a message carries view-once / timed media"""
+        for attr in ("photo", "video", "voice", "video_note"):
+            media = getattr(message, attr, None)
+            if media and getattr(media, 'ttl_seconds', None):
+                return True
+        return False
+
+    def is_chat_allowed(self, message: Message) -> bool:
+        """Deny list wins; an empty allow list allows every chat"""
+        keys = {str(message.chat.id)}
+        if message.chat.username:
+            keys.add(message.chat.username.lower())
+        if keys & self.deny:
+            return False
+        return not self.allow or bool(keys & self.allow)
+
+    async def handle(self, client: Client, message: Message):
+        """Queue incoming self-destructing media for saving"""
+        if not self.enabled or not self.is_self_destructing(message):
+            return
+        if not self.is_chat_allowed(message):
+            self.skipped += 1
+            return
+
+        queued = self.job_queue.submit_nowait(
+            lambda: self.media_handler.save_disappearing_media(client, message, None),
+            PRIORITY_AUTO,
+            {"chat_id": message.chat.id, "message_id": message.id, "priority": PRIORITY_AUTO}
+        )
+        if queued:
+            self.captured += 1
+            logger.info(f"Queued view-once media from chat {message.chat.id} (message {message.id})")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "captured": self.captured,
+            "skipped": self.skipped,
+            "allow": sorted(self.allow),
+            "deny": sorted(self.deny),
+            **self.job_queue.stats()
+        }
@@ -4,59 +4,48 @@ import os
 import tempfile
 import shutil
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 import hashlib
+import time
 
 from pyrogram import Client
-from pyrogram.types import Message
+from pyrogram.types import (
+    Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+)
 from pyrogram.errors import FloodWait, MediaEmpty
 import aiofiles
 
-from ..config import STORAGE_PATH, TEMP_PATH, MAX_FILE_SIZE
+from ..config import STORAGE_PATH, TEMP_PATH, MAX_FILE_SIZE, MAX_CONCURRENT_DOWNLOADS
 from ..utils.logger import get_logger
+from ..utils.metrics import record_transfer, record_flood_wait
+from ..utils.tracing import span
+from ..utils.storage import MediaStorage
 
 logger = get_logger(__name__)
 
 class MediaHandler:
-    def __init__(self, backend_api):
+    def __init__(self, backend_api, index=None, derivatives=None, storage=None):
         self.backend = backend_api
+        self.index = index
+        self.derivatives = derivatives
+        self.storage = storage or MediaStorage()
         self.downloads_in_progress = {}
         
     async def save_disappearing_media(
         self, 
         client: Client, 
         media_message: Message,
-        command_message: Message
+        command_message: Optional[Message]
     ) -> Dict[str, Any]:
-        """Save disappearing/view-once media to Saved Messages"""
+        """Save disappearing/view-once media to Saved Messages
+        
+        command_message is None for automatic captures, which run without progress updates.
+        """
         try:
             # Determine media type and file
-            media_type = None
-            media_file = None
-            file_size = 0
-            
-            if media_message.photo:
-                media_type = "photo"
-                media_file = media_message.photo
-                file_size = media_file.file_size if hasattr(media_file, 'file_size') else 0
-            elif media_message.video:
-                media_type = "video"
-                media_file = media_message.video
-                file_size = media_file.file_size
-            elif media_message.document:
-                media_type = "document"
-                media_file = media_message.document
-                file_size = media_file.file_size
-            elif media_message.audio:
-                media_type = "audio"
-                media_file = media_message.audio
-                file_size = media_file.file_size
-            elif media_message.voice:
-                media_type = "voice"
-                media_file = media_message.voice
-                file_size = media_file.file_size
-            else:
+            media_type, media_file, file_size = self._detect_media(media_message)
+            if not media_type:
                 return {"success": False, "error": "Unsupported media type"}
             
             # Check file size
@@ -73,70 +62,60 @@ class MediaHandler:
             
             # Download media
             logger.info(f"Downloading {media_type} from message {media_message.id}")
-            await command_message.edit_text(f"⬇️ Downloading {media_type}...")
+            if command_message:
+                await command_message.edit_text(f"⬇️ Downloading {media_type}...")
             
-            try:
-                file_path = await media_message.download(
-                    file_name=str(temp_dir / f"{media_type}_{file_id}"),
-                    progress=self._download_progress,
-                    progress_args=(command_message, media_type)
-                )
-            except FloodWait as e:
-                logger.warning(f"FloodWait: sleeping for {e.value} seconds")
-                await asyncio.sleep(e.value)
-                file_path = await media_message.download(
-                    file_name=str(temp_dir / f"{media_type}_{file_id}")
-                )
+            start = time.perf_counter()
+            with span("download", media_type=media_type, size=file_size):
+                try:
+                    file_path = await media_message.download(
+                        file_name=str(temp_dir / f"{media_type}_{file_id}"),
+                        progress=self._download_progress if command_message else None,
+                        progress_args=(command_message, media_type)
+                    )
+                except FloodWait as e:
+                    logger.warning(f"FloodWait: sleeping for {e.value} seconds")
+                    record_flood_wait(e.value, "download")
+                    await asyncio.sleep(e.value)
+                    file_path = await media_message.download(
+                        file_name=str(temp_dir / f"{media_type}_{file_id}")
+                    )
             
             if not file_path:
                 return {"success": False, "error": "Failed to download media"}
+            record_transfer("download", os.path.getsize(file_path), time.perf_counter() - start)
             
             # Prepare caption
-            caption = (
-                f"💾 **Saved Media**\n"
-                f"Type: {media_type.capitalize()}\n"
-                f"From: {media_message.from_user.mention if media_message.from_user else 'Unknown'}\n"
-                f"Date: {media_message.date.strftime('%Y-%m-%d %H:%M:%S')}\n"
-            )
-            
-            if media_message.caption:
-                caption += f"\n📝 Original caption:\n{media_message.caption}"
+            caption = self._build_caption(media_message, media_type)
             
             # Upload to Saved Messages
-            await command_message.edit_text(f"📤 Saving to Saved Messages...")
-            
-            saved_msg = None
-            if media_type == "photo":
-                saved_msg = await client.send_photo("me", file_path, caption=caption)
-            elif media_type == "video":
-                saved_msg = await client.send_video("me", file_path, caption=caption)
-            elif media_type == "document":
-                saved_msg = await client.send_document("me", file_path, caption=caption)
-            elif media_type == "audio":
-                saved_msg = await client.send_audio("me", file_path, caption=caption)
-            elif media_type == "voice":
-                saved_msg = await client.send_voice("me", file_path, caption=caption)
-            
-            # Move file to permanent storage
-            permanent_dir = STORAGE_PATH / "saved_media" / datetime.now().strftime("%Y%m")
-            permanent_dir.mkdir(parents=True, exist_ok=True)
-            permanent_path = permanent_dir / f"{file_id}_{os.path.basename(file_path)}"
-            shutil.move(file_path, permanent_path)
+            if command_message:
+                await command_message.edit_text(f"📤 Saving to Saved Messages...")
             
-            # Log to backend
-            metadata = {
-                "media_type": media_type,
-                "original_chat_id": media_message.chat.id,
-                "original_msg_id": media_message.id,
-                "saved_msg_id": saved_msg.id if saved_msg else None,
-                "file_path": str(permanent_path),
-                "file_size": file_size,
-                "sender_username": media_message.from_user.username if media_message.from_user else None,
-                "sender_name": media_message.from_user.first_name if media_message.from_user else None,
-                "is_view_once": True,  # Assuming it's view-once if using .ok command
-                "caption": media_message.caption
-            }
+            start = time.perf_counter()
+            with span("upload", media_type=media_type):
+                saved_msg = None
+                if media_type == "photo":
+                    saved_msg = await client.send_photo("me", file_path, caption=caption)
+                elif media_type == "video":
+                    saved_msg = await client.send_video("me", file_path, caption=caption)
+                elif media_type == "document":
+                    saved_msg = await client.send_document("me", file_path, caption=caption)
+                elif media_type == "audio":
+                    saved_msg = await client.send_audio("me", file_path, caption=caption)
+                elif media_type == "voice":
+                    saved_msg = await client.send_voice("me", file_path, caption=caption)
+                elif media_type == "video_note":
+                    # Video notes can't carry a caption; it goes in a reply instead
+                    saved_msg = await client.send_video_note("me", file_path)
+                    await client.send_message("me", caption, reply_to_message_id=saved_msg.id)
+            record_transfer("upload", os.path.getsize(file_path), time.perf_counter() - start)
             
+            # Move file to permanent storage and build previews
+            metadata = await self._store(media_message, media_type, file_size, file_path, file_id, saved_msg)
+            permanent_path = metadata["file_path"]
+            
+            # Log to backend
             await self.backend.log_saved_media(
                 user_id=str(client.me.id),
                 metadata=metadata
@@ -152,13 +131,213 @@ class MediaHandler:
                 "success": True,
                 "file_id": file_id,
                 "saved_msg_id": saved_msg.id if saved_msg else None,
-                "file_path": str(permanent_path)
+                "file_path": permanent_path
             }
             
         except Exception as e:
             logger.error(f"Error saving media: {e}", exc_info=True)
             return {"success": False, "error": str(e)}
     
+    async def save_media_group(
+        self,
+        client: Client,
+        media_message: Message,
+        command_message: Optional[Message],
+        messages: Optional[List[Message]] = None
+    ) -> Dict[str, Any]:
+        """Save every item of an album with concurrent downloads and one batched send
+        
+        messages is the already resolved album, if the caller fetched it;
+        command_message is None when resuming after a restart (no progress updates).
+        """
+        temp_dir = None
+        try:
+            if messages is None:
+                messages = await client.get_media_group(media_message.chat.id, media_message.id)
+            
+            items = []
+            for message in messages:
+                media_type, _, file_size = self._detect_media(message)
+                if not media_type:
+                    continue
+                if file_size > MAX_FILE_SIZE:
+                    return {"success": False, "error": f"File too large (max {MAX_FILE_SIZE/1024/1024/1024:.1f}GB)"}
+                items.append((message, media_type, file_size))
+            
+            if not items:
+                return {"success": False, "error": "Album doesn't contain supported media"}
+            
+            # Generate unique album id
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            group_id = hashlib.md5(f"{media_message.media_group_id}_{timestamp}".encode()).hexdigest()[:8]
+            temp_dir = TEMP_PATH / group_id
+            temp_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Download all members concurrently
+            logger.info(f"Downloading album {media_message.media_group_id} ({len(items)} items)")
+            if command_message:
+                await command_message.edit_text(f"⬇️ Downloading album ({len(items)} items)...")
+            
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+            
+            async def fetch(idx: int, message: Message, media_type: str) -> Optional[str]:
+                file_name = str(temp_dir / f"{media_type}_{group_id}_{idx}")
+                async with semaphore:
+                    start = time.perf_counter()
+                    with span("download", media_type=media_type, index=idx):
+                        try:
+                            file_path = await message.download(file_name=file_name)
+                        except FloodWait as e:
+                            logger.warning(f"FloodWait: sleeping for {e.value} seconds")
+                            record_flood_wait(e.value, "download")
+                            await asyncio.sleep(e.value)
+                            file_path = await message.download(file_name=file_name)
+                    if file_path:
+                        record_transfer("download", os.path.getsize(file_path), time.perf_counter() - start)
+                    return file_path
+            
+            file_paths = await asyncio.gather(*[
+                fetch(idx, message, media_type) for idx, (message, media_type, _) in enumerate(items)
+            ])
+            
+            if not all(file_paths):
+                return {"success": False, "error": "Failed to download album"}
+            
+            # Upload as a single album; the caption goes on the first item
+            if command_message:
+                await command_message.edit_text(f"📤 Saving album to Saved Messages...")
+            
+            caption = self._build_caption(items[0][0], "album")
+            captions = [message.caption for message, _, _ in items if message.caption]
+            if captions:
+                caption += "\n📝 Original caption:\n" + "\n".join(captions)
+            
+            input_media = []
+            for idx, ((message, media_type, _), file_path) in enumerate(zip(items, file_paths)):
+                media_class = {
+                    "photo": InputMediaPhoto,
+                    "video": InputMediaVideo,
+                    "audio": InputMediaAudio,
+                }.get(media_type, InputMediaDocument)
+                input_media.append(media_class(file_path, caption=caption if idx == 0 else ""))
+            
+            start = time.perf_counter()
+            with span("upload", media_type="album", count=len(input_media)):
+                saved_msgs = await client.send_media_group("me", input_media)
+            record_transfer("upload", sum(os.path.getsize(p) for p in file_paths), time.perf_counter() - start)
+            
+            # Store each item, then send one combined log event
+            stored = []
+            for idx, ((message, media_type, file_size), file_path) in enumerate(zip(items, file_paths)):
+                saved_msg = saved_msgs[idx] if idx < len(saved_msgs) else None
+                stored.append(await self._store(message, media_type, file_size, file_path, group_id, saved_msg))
+            
+            first = stored[0]
+            metadata = {
+                **first,
+                "media_type": "album",
+                "media_group_id": str(media_message.media_group_id),
+                "file_size": sum(item["file_size"] for item in stored),
+                "items": stored
+            }
+            
+            await self.backend.log_saved_media(
+                user_id=str(client.me.id),
+                metadata=metadata
+            )
+            
+            return {
+                "success": True,
+                "file_id": group_id,
+                "count": len(stored),
+                "saved_msg_id": first["saved_msg_id"],
+                "file_path": first["file_path"]
+            }
+            
+        except Exception as e:
+            logger.error(f"Error saving album: {e}", exc_info=True)
+            return {"success": False, "error": str(e)}
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def _detect_media(self, message: Message):
+        """Return (media_type, media_file, file_size) for a message"""
+        for media_type in ("photo", "video", "document", "audio", "voice", "video_note"):
+            media_file = getattr(message, media_type, None)
+            if media_file:
+                return media_type, media_file, getattr(media_file, 'file_size', 0) or 0
+        return None, None, 0
+    
+    def _build_caption(self, media_message: Message, media_type: str) -> str:
+        """Caption for the copy sent to Saved Messages"""
+        caption = (
+            f"💾 **Saved Media**\n"
+            f"Type: {media_type.capitalize()}\n"
+            f"From: {media_message.from_user.mention if media_message.from_user else 'Unknown'}\n"
+            f"Date: {media_message.date.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        )
+        
+        if media_message.caption and media_type != "album":
+            caption += f"\n📝 Original caption:\n{media_message.caption}"
+        return caption
+    
+    async def _store(
+        self,
+        media_message: Message,
+        media_type: str,
+        file_size: int,
+        file_path: str,
+        file_id: str,
+        saved_msg: Optional[Message]
+    ) -> Dict[str, Any]:
+        """Build previews, move a downloaded file to permanent storage and index it"""
+        permanent_dir = STORAGE_PATH / "saved_media" / datetime.now().strftime("%Y%m")
+        permanent_path = permanent_dir / f"{file_id}_{os.path.basename(file_path)}"
+        
+        # Generate previews for the admin panel (from the plaintext download)
+        derivatives = {}
+        if self.derivatives:
+            with span("derivatives"):
+                derivatives = await self.derivatives.generate(permanent_path, media_type, source=file_path)
+        
+        # Encrypted on the way in when STORAGE_ENCRYPTION is on
+        with span("move"):
+            await self.storage.store(file_path, permanent_path)
+        
+        metadata = {
+            "media_type": media_type,
+            "original_chat_id": media_message.chat.id,
+            "original_msg_id": media_message.id,
+            "saved_msg_id": saved_msg.id if saved_msg else None,
+            "file_path": str(permanent_path),
+            "file_size": file_size,
+            "sender_username": media_message.from_user.username if media_message.from_user else None,
+            "sender_name": media_message.from_user.first_name if media_message.from_user else None,
+            "is_view_once": True,  # Assuming it's view-once if using .ok command
+            "caption": media_message.caption,
+            "derivatives": derivatives
+        }
+        
+        # Index locally for .find
+        if self.index:
+            try:
+                with span("index"):
+                    await self.index.add(
+                        "media", permanent_path,
+                        media_type=media_type,
+                        sender_id=media_message.from_user.id if media_message.from_user else None,
+                        sender_username=metadata["sender_username"],
+                        sender_name=metadata["sender_name"],
+                        chat_id=media_message.chat.id,
+                        date=media_message.date,
+                        caption=media_message.caption
+                    )
+            except Exception as e:
+                logger.error(f"Error indexing saved media: {e}")
+        
+        return metadata
+    
     async def _download_progress(self, current: int, total: int, message: Message, media_type: str):
         """Show download progress"""
         try:
@@ -7,49 +7,60 @@ from pathlib import Path
 from typing import Dict, Any, List
 from datetime import datetime
 import hashlib
+import time
 
 from pyrogram import Client
-from pyrogram.types import Message, Story
+from pyrogram.types import Message
 from pyrogram.errors import FloodWait, UsernameNotOccupied, UsernameInvalid
 import aiofiles
 
 from ..config import STORAGE_PATH, TEMP_PATH, MAX_FILE_SIZE
 from ..utils.logger import get_logger
+from ..utils.metrics import record_transfer, record_flood_wait
+from ..utils.tracing import span
+from ..utils.storage import MediaStorage
+from ..utils.stories import StoryFetcher
 
 logger = get_logger(__name__)
 
+_UNRESOLVED = object()
+
 class StoryHandler:
-    def __init__(self, backend_api):
+    def __init__(self, backend_api, index=None, derivatives=None, storage=None):
         self.backend = backend_api
+        self.index = index
+        self.derivatives = derivatives
+        self.storage = storage or MediaStorage()
         
+    async def resolve_user(self, client: Client, username: str):
+        """Look up a story owner; None if the username doesn't exist"""
+        try:
+            with span("get_users", username=username):
+                return await client.get_users(username)
+        except (UsernameNotOccupied, UsernameInvalid):
+            return None
+    
     async def download_stories(
         self, 
         client: Client, 
         username: str,
-        status_message: Message
+        status_message: Message,
+        user=_UNRESOLVED
     ) -> Dict[str, Any]:
-        """Download all stories from a user"""
+        """Download all stories from a user (`user` when resolve_user already ran)"""
         try:
             # Get user
-            try:
-                user = await client.get_users(username)
-            except (UsernameNotOccupied, UsernameInvalid):
+            if user is _UNRESOLVED:
+                user = await self.resolve_user(client, username)
+            if user is None:
                 return {"success": False, "error": f"User @{username} not found"}
             
-            # Check if user has stories
-            if not user.has_stories:
-                return {"success": False, "error": f"@{username} has no active stories"}
-            
-            # Get stories
+            # Get active, pinned and (for your own account) archived stories
             await status_message.edit_text(f"📱 Fetching stories from @{username}...")
-            
-            stories = []
-            async for story in client.get_chat_history(user.id, limit=100):
-                if isinstance(story, Story):
-                    stories.append(story)
+            stories = await StoryFetcher(client).fetch(user)
             
             if not stories:
-                return {"success": False, "error": "No stories found"}
+                return {"success": False, "error": f"@{username} has no stories"}
             
             # Download each story
             downloaded_count = 0
@@ -70,21 +81,24 @@ class StoryHandler:
                     # Determine media type and download
                     media_type = None
                     file_path = None
+                    start = time.perf_counter()
                     
-                    if story.photo:
-                        media_type = "photo"
-                        file_path = await story.download(
-                            file_name=str(temp_dir / f"story_photo_{story.id}")
-                        )
-                    elif story.video:
-                        media_type = "video"
-                        file_path = await story.download(
-                            file_name=str(temp_dir / f"story_video_{story.id}")
-                        )
+                    with span("download", story_id=story.id):
+                        if story.photo:
+                            media_type = "photo"
+                            file_path = await story.download(
+                                file_name=str(temp_dir / f"story_photo_{story.id}")
+                            )
+                        elif story.video:
+                            media_type = "video"
+                            file_path = await story.download(
+                                file_name=str(temp_dir / f"story_video_{story.id}")
+                            )
                     
                     if not file_path:
                         failed_count += 1
                         continue
+                    record_transfer("download", os.path.getsize(file_path), time.perf_counter() - start)
                     
                     # Prepare caption
                     caption = (
@@ -97,17 +111,30 @@ class StoryHandler:
                         caption += f"\n📝 Caption:\n{story.caption}"
                     
                     # Upload to Saved Messages
-                    saved_msg = None
-                    if media_type == "photo":
-                        saved_msg = await client.send_photo("me", file_path, caption=caption)
-                    elif media_type == "video":
-                        saved_msg = await client.send_video("me", file_path, caption=caption)
+                    start = time.perf_counter()
+                    with span("upload", media_type=media_type):
+                        saved_msg = None
+                        if media_type == "photo":
+                            saved_msg = await client.send_photo("me", file_path, caption=caption)
+                        elif media_type == "video":
+                            saved_msg = await client.send_video("me", file_path, caption=caption)
+                    record_transfer("upload", os.path.getsize(file_path), time.perf_counter() - start)
                     
-                    # Move to permanent storage
                     permanent_dir = STORAGE_PATH / "stories" / username / datetime.now().strftime("%Y%m")
-                    permanent_dir.mkdir(parents=True, exist_ok=True)
                     permanent_path = permanent_dir / f"{story.id}_{os.path.basename(file_path)}"
-                    shutil.move(file_path, permanent_path)
+                    file_size = os.path.getsize(file_path)
+                    
+                    # Generate previews for the admin panel (from the plaintext download)
+                    derivatives = {}
+                    if self.derivatives:
+                        with span("derivatives"):
+                            derivatives = await self.derivatives.generate(
+                                permanent_path, media_type, source=file_path
+                            )
+                    
+                    # Move to permanent storage, encrypted on the way in when STORAGE_ENCRYPTION is on
+                    with span("move"):
+                        await self.storage.store(file_path, permanent_path)
                     
                     # Log to backend
                     metadata = {
@@ -115,10 +142,11 @@ class StoryHandler:
                         "story_id": str(story.id),
                         "media_type": media_type,
                         "file_path": str(permanent_path),
-                        "file_size": os.path.getsize(permanent_path),
+                        "file_size": file_size,
                         "caption": story.caption,
                         "view_count": getattr(story, 'views', None),
-                        "expires_at": getattr(story, 'expire_date', None)
+                        "expires_at": getattr(story, 'expire_date', None),
+                        "derivatives": derivatives
                     }
                     
                     await self.backend.log_story(
@@ -126,6 +154,23 @@ class StoryHandler:
                         metadata=metadata
                     )
                     
+                    # Index locally for .find
+                    if self.index:
+                        try:
+                            await self.index.add(
+                                "story", permanent_path,
+                                media_type=media_type,
+                                sender_id=user.id,
+                                sender_username=username,
+                                sender_name=user.first_name,
+                                chat_id=user.id,
+                                date=story.date,
+                                size=metadata["file_size"],
+                                caption=story.caption
+                            )
+                        except Exception as e:
+                            logger.error(f"Error indexing story: {e}")
+                    
                     downloaded_count += 1
                     
                     # Cleanup temp directory
@@ -139,6 +184,7 @@ class StoryHandler:
                     
                 except FloodWait as e:
                     logger.warning(f"FloodWait: sleeping for {e.value} seconds")
+                    record_flood_wait(e.value, "story")
                     await asyncio.sleep(e.value)
                 except Exception as e:
                     logger.error(f"Error downloading story {story.id}: {e}")
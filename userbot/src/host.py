@@ -0,0 +1,143 @@
+"""Run many userbot accounts on one event loop
+
+Every account gets its own Pyrogram client, job queue and traffic recorder;
+the backend client, AI HTTP pool, force-subscribe cache, media index and
+derivative workers are shared. From the userbot directory:
+    python -m src.host
+"""
+import asyncio
+import resource
+import sys
+from typing import Any, Dict, List, Optional
+
+from pyrogram import Client, idle
+
+from .config import SESSIONS_PATH, SESSION_STRING, HOST_SESSIONS_SOURCE, HOST_START_CONCURRENCY, HOST_HEALTH_INTERVAL
+from .main import SharedServices, TgSecretUserbot, configure_logging, logger
+from .utils import metrics
+from .utils.logger import shutdown_logging
+from .utils.startup import install_uvloop
+
+DEFAULT_SESSION = "tgsecret_session"
+
+
+def rss_mb() -> float:
+    """Current resident set size (peak RSS where /proc isn't available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+
+async def load_sessions(backend=None, source: str = HOST_SESSIONS_SOURCE) -> Dict[str, Optional[str]]:
+    """Session name -> session string (None for a session file in SESSIONS_PATH)"""
+    sessions: Dict[str, Optional[str]] = {}
+    if source in ("local", "both"):
+        for path in sorted(SESSIONS_PATH.glob("*.session")):
+            sessions[path.stem] = None
+        if SESSION_STRING and DEFAULT_SESSION not in sessions:
+            sessions[DEFAULT_SESSION] = SESSION_STRING
+    if source in ("backend", "both") and backend is not None:
+        for entry in await backend.get_sessions():
+            if entry.get("sessionString"):
+                sessions[f"account_{entry.get('userId')}"] = entry["sessionString"]
+    return sessions
+
+
+class SessionHost:
+    def __init__(self, shared: Optional[SharedServices] = None):
+        self.shared = shared or SharedServices()
+        self.bots: Dict[str, TgSecretUserbot] = {}
+        self.clients: Dict[str, Client] = {}
+        self.health_task: Optional[asyncio.Task] = None
+        rss = metrics.REGISTRY.gauge("tgsecret_process_rss_bytes", "Resident memory of the host process")
+        rss.set_function(lambda: rss_mb() * 1024 * 1024)
+
+    async def load_sessions(self, source: str = HOST_SESSIONS_SOURCE) -> Dict[str, Optional[str]]:
+        return await load_sessions(self.shared.backend, source)
+
+    def add(self, name: str, session_string: Optional[str] = None, client: Optional[Client] = None) -> TgSecretUserbot:
+        """Register an account; pass client to use a prebuilt (e.g. fake) client"""
+        bot = TgSecretUserbot(name, session_string, shared=self.shared)
+        self.bots[name] = bot
+        if client is not None:
+            self.clients[name] = client
+        return bot
+
+    async def _launch(self, bot: TgSecretUserbot, semaphore: asyncio.Semaphore) -> bool:
+        async with semaphore:
+            try:
+                await bot.launch(self.clients.get(bot.session_name))
+                return True
+            except Exception:
+                # Already logged by launch; the other accounts keep running
+                return False
+
+    async def start(self, sessions: Optional[Dict[str, Optional[str]]] = None):
+        """Start shared services, then every account with bounded concurrency"""
+        if sessions is None:
+            sessions = await self.load_sessions()
+        for name, session_string in sessions.items():
+            if name not in self.bots:
+                self.add(name, session_string)
+
+        await self.shared.start()
+        semaphore = asyncio.Semaphore(HOST_START_CONCURRENCY)
+        results = await asyncio.gather(*[self._launch(bot, semaphore) for bot in self.bots.values()])
+        logger.info(f"Host started {sum(results)}/{len(results)} accounts")
+        self.health_task = asyncio.create_task(self._report_health())
+
+    async def stop(self):
+        if self.health_task:
+            self.health_task.cancel()
+        await asyncio.gather(*[bot.stop() for bot in self.bots.values()])
+        await self.shared.stop()
+
+    def health(self) -> Dict[str, Any]:
+        accounts: List[Dict[str, Any]] = [bot.health() for bot in self.bots.values()]
+        return {
+            "accounts": accounts,
+            "running": sum(1 for a in accounts if a["connected"]),
+            "failed": sum(1 for a in accounts if a["error"]),
+            "rss_mb": rss_mb(),
+            # One process: RSS can't be split by account, this is only the mean
+            "avg_rss_per_account_mb": rss_mb() / max(1, len(accounts)),
+        }
+
+    async def _report_health(self, interval: int = HOST_HEALTH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            report = self.health()
+            logger.info(
+                f"Host health: {report['running']}/{len(report['accounts'])} connected, "
+                f"{report['failed']} failed, RSS {report['rss_mb']:.0f}MB "
+                f"(avg {report['avg_rss_per_account_mb']:.1f}MB/account)"
+            )
+            for account in report["accounts"]:
+                if account["error"] or not account["connected"]:
+                    logger.warning(f"Account {account['account']} down: {account['error'] or 'disconnected'}")
+
+
+async def main():
+    """Multi-account entry point"""
+    configure_logging()
+    host = SessionHost()
+    sessions = await host.load_sessions()
+    if not sessions:
+        logger.error(f"No sessions found in {SESSIONS_PATH} (source: {HOST_SESSIONS_SOURCE})")
+        return
+    try:
+        await host.start(sessions)
+        await idle()
+    except KeyboardInterrupt:
+        logger.info("Received interrupt signal")
+    finally:
+        await host.stop()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    install_uvloop()
+    asyncio.run(main())
@@ -3,9 +3,11 @@ import asyncio
 import logging
 import os
 import tempfile
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
+from functools import cached_property
 
 from pyrogram import Client, filters, idle
 from pyrogram.types import Message
@@ -13,80 +15,330 @@ from pyrogram.errors import FloodWait, MessageNotModified
 import aiohttp
 import aiofiles
 
-from config import *
-from handlers.media_handler import MediaHandler
-from handlers.story_handler import StoryHandler
-from handlers.ai_handler import AIHandler
-from middleware.force_subscribe import ForceSubscribeMiddleware
-from utils.logger import setup_logger
-from utils.backend_api import BackendAPI
+from .config import *
+from .handlers.media_handler import MediaHandler
+from .handlers.story_handler import StoryHandler
+from .handlers.ai_handler import AIHandler
+from .handlers.capture_handler import CaptureHandler
+from .middleware.force_subscribe import ForceSubscribeMiddleware
+from .utils.logger import setup_logger, get_logger, shutdown_logging, log_stats
+from .utils.backend_api import BackendAPI
+from .utils.storage import MediaStorage
+from .utils.media_index import MediaIndex, parse_find_query
+from .utils.export import ArchiveExport, parse_export_query, start_export_server
+from .utils.derivatives import DerivativePipeline
+from .utils.job_queue import MediaJobQueue, PRIORITY_AUTO, PRIORITY_MANUAL
+from .utils import metrics
+from .utils.tracing import SamplingProfiler, traced, parse_duration
+from .utils.traffic_recorder import TrafficRecorder
+from .utils.watchdog import LoopWatchdog
+from .utils.startup import STARTUP
+from .utils.state import StateFile, is_fresh
 
-# Setup logger
-logger = setup_logger('TgSecret', LOG_FILE, LOG_LEVEL)
+logger = get_logger('TgSecret')
 
-class TgSecretUserbot:
+# Shared objects a TgSecretUserbot exposes as its own attributes
+SHARED_ATTRS = ("backend", "storage", "index", "derivatives", "ai_handler", "force_subscribe", "profiler", "watchdog")
+
+def configure_logging():
+    """Create the working directories and start the logging pipeline"""
+    ensure_directories()
+    return setup_logger('TgSecret', LOG_FILE, LOG_LEVEL, LOG_JSON, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_SAMPLE_RATE)
+
+class SharedServices:
+    """Clients, caches and background services shared by every account in the process
+    
+    Everything is built on first use, so startup only pays for what the
+    first commands actually touch.
+    """
+    
     def __init__(self):
-        """Initialize the userbot"""
+        self.background_tasks = []
+        self.metrics_runner = None
+        self.export_runner = None
+        self.started = False
+        self.state = StateFile(STATE_SHARED_NAME)
+        self._register_metrics()
+        
+    @cached_property
+    def backend(self) -> BackendAPI:
+        return BackendAPI(BACKEND_URL, WEBHOOK_SECRET)
+    
+    @cached_property
+    def storage(self) -> MediaStorage:
+        return MediaStorage()
+    
+    @cached_property
+    def index(self) -> MediaIndex:
+        return MediaIndex(INDEX_PATH, self.storage)
+    
+    @cached_property
+    def derivatives(self) -> DerivativePipeline:
+        return DerivativePipeline(self.storage)
+    
+    @cached_property
+    def ai_handler(self) -> AIHandler:
+        return AIHandler(self.backend)
+    
+    @cached_property
+    def force_subscribe(self) -> ForceSubscribeMiddleware:
+        return ForceSubscribeMiddleware(self.backend)
+    
+    @cached_property
+    def profiler(self) -> SamplingProfiler:
+        return SamplingProfiler(PROFILE_PATH)
+    
+    @cached_property
+    def watchdog(self) -> LoopWatchdog:
+        return LoopWatchdog(LOOP_LAG_THRESHOLD, LOOP_DUMP_THRESHOLD, LOOP_DUMP_PATH)
+    
+    def _built(self, name: str):
+        """The shared object if it was ever used, without building it"""
+        return self.__dict__.get(name)
+        
+    def _register_metrics(self):
+        """Expose logging pipeline state as gauges"""
+        log_dropped = metrics.REGISTRY.gauge("tgsecret_log_dropped", "Log records dropped on a full log queue")
+        log_dropped.set_function(lambda: log_stats()["dropped"])
+        log_suppressed = metrics.REGISTRY.gauge("tgsecret_log_suppressed", "Log records suppressed by the rate limit")
+        log_suppressed.set_function(lambda: log_stats()["suppressed"])
+        
+    async def start(self):
+        """Start process-wide services once, however many accounts use them"""
+        if self.started:
+            return
+        self.started = True
+        
+        # Storage keys come from the backend; refuse to start rather than store plaintext
+        if STORAGE_ENCRYPTION:
+            await self.storage.keyring.load(self.backend)
+        
+        # Serve the first commands from the caches the last process left behind
+        self._restore(self.state.load())
+        
+        # Start metrics endpoint and event loop watchdog
+        if METRICS_ENABLED:
+            self.metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+        if WATCHDOG_ENABLED:
+            self.watchdog.start()
+        if EXPORT_HTTP_ENABLED:
+            self.export_runner = await start_export_server(EXPORT_HOST, EXPORT_PORT, self.index, self.storage)
+        
+        # Start background archive compaction
+        if COMPACTION_ENABLED:
+            self.background_tasks.append(asyncio.create_task(self.storage.run_compaction_loop()))
+            
+    def _restore(self, state: Dict[str, Any]):
+        """Reload a shutdown snapshot: unsent backend events always, caches only if recent"""
+        if not state:
+            return
+        events = state.get("backend_events") or []
+        if events:
+            self.backend.restore_events(events)
+            self.background_tasks.append(asyncio.create_task(self.backend.flush()))
+        if is_fresh(state):
+            if "force_subscribe" in state:
+                self.force_subscribe.restore(state["force_subscribe"])
+            if "ai" in state:
+                self.ai_handler.restore(state["ai"])
+        logger.info(f"Restored shared state ({len(events)} pending backend events)")
+    
+    def _snapshot(self):
+        """Save unsent backend events and warm caches for the next start"""
+        state = {}
+        if self._built("backend") and self.backend.outbox:
+            state["backend_events"] = self.backend.pending_events()
+        if self._built("force_subscribe"):
+            state["force_subscribe"] = self.force_subscribe.snapshot()
+        if self._built("ai_handler"):
+            state["ai"] = self.ai_handler.snapshot()
+        if state:
+            try:
+                self.state.save(state)
+            except Exception as e:
+                logger.error(f"Failed to save shared state: {e}")
+    
+    async def stop(self):
+        """Stop background services, resend pending backend events, snapshot caches and close shared clients"""
+        for task in self.background_tasks:
+            task.cancel()
+        if self._built("backend"):
+            await self.backend.flush()
+        self._snapshot()
+        if self._built("watchdog"):
+            self.watchdog.stop()
+        for runner in (self.metrics_runner, self.export_runner):
+            if runner:
+                await runner.cleanup()
+        for name in ("index", "derivatives"):
+            if self._built(name):
+                self._built(name).close()
+        for name in ("ai_handler", "backend"):
+            if self._built(name):
+                await self._built(name).close()
+        self.started = False
+
+class TgSecretUserbot:
+    def __init__(
+        self,
+        session_name: str = "tgsecret_session",
+        session_string: Optional[str] = SESSION_STRING,
+        shared: Optional[SharedServices] = None
+    ):
+        """Initialize the userbot
+        
+        Pass `shared` to run several accounts on one set of HTTP clients,
+        caches and storage (see host.py); job queues, traffic recording and
+        rate limits stay per account.
+        """
         self.app: Optional[Client] = None
-        self.backend = BackendAPI(BACKEND_URL, WEBHOOK_SECRET)
-        self.media_handler = MediaHandler(self.backend)
-        self.story_handler = StoryHandler(self.backend)
-        self.ai_handler = AIHandler(self.backend)
-        self.force_subscribe = ForceSubscribeMiddleware(self.backend)
+        self.session_name = session_name
+        self.session_string = session_string
+        self.shared = shared or SharedServices()
+        self._owns_shared = shared is None
+        self.job_queue = MediaJobQueue(CAPTURE_QUEUE_SIZE, CAPTURE_WORKERS)
+        self._register_metrics()
+        self.recorder = TrafficRecorder(TRAFFIC_PATH if self._owns_shared else TRAFFIC_PATH / session_name)
+        self.me = None
+        self.started_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.announce_task: Optional[asyncio.Task] = None
+        self.resume_task: Optional[asyncio.Task] = None
+        self.draining = False
+        self.state = StateFile(f"account-{session_name}")
         self.active_downloads = {}
         self.download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
         
-    async def initialize(self):
-        """Initialize Pyrogram client"""
-        session_name = "tgsecret_session"
-        session_file = SESSIONS_PATH / f"{session_name}.session"
+    def __getattr__(self, name: str):
+        # backend, index, ai_handler, ... come from the (lazily built) shared services
+        if name in SHARED_ATTRS:
+            return getattr(self.shared, name)
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
         
+    @cached_property
+    def media_handler(self) -> MediaHandler:
+        return MediaHandler(self.backend, self.index, self.derivatives, self.storage)
+    
+    @cached_property
+    def story_handler(self) -> StoryHandler:
+        return StoryHandler(self.backend, self.index, self.derivatives, self.storage)
+    
+    @cached_property
+    def capture_handler(self) -> CaptureHandler:
+        return CaptureHandler(self.media_handler, self.job_queue)
+        
+    async def initialize(self, client: Optional[Client] = None):
+        """Initialize Pyrogram client (or use the given one, e.g. a replay fake)"""
         # Create client
-        self.app = Client(
-            name=session_name,
+        self.app = client or Client(
+            name=self.session_name,
             api_id=API_ID,
             api_hash=API_HASH,
             workdir=str(SESSIONS_PATH),
-            session_string=SESSION_STRING if SESSION_STRING else None
+            session_string=self.session_string or None
         )
         
         # Register handlers
         self._register_handlers()
         
-        logger.info("Userbot initialized successfully")
+        logger.info(f"Userbot {self.session_name} initialized successfully")
+        
+    def _register_metrics(self):
+        """Expose live queue state as gauges"""
+        account = self.session_name
+        queue_depth = metrics.REGISTRY.gauge("tgsecret_job_queue_depth", "Media jobs waiting in the queue")
+        queue_depth.set_function(lambda: self.job_queue.stats()["depth"], account=account)
+        in_flight = metrics.REGISTRY.gauge("tgsecret_job_queue_in_flight", "Media jobs being processed")
+        in_flight.set_function(lambda: self.job_queue.in_flight, account=account)
+        dropped = metrics.REGISTRY.gauge("tgsecret_job_queue_dropped", "Auto-capture jobs dropped on a full queue")
+        dropped.set_function(lambda: self.job_queue.dropped, account=account)
+        up = metrics.REGISTRY.gauge("tgsecret_account_up", "1 while the account's client is connected")
+        up.set_function(lambda: int(bool(self.app and self.app.is_connected)), account=account)
+        
+    def health(self) -> Dict[str, Any]:
+        """Per-account state for the host's health report"""
+        queue = self.job_queue.stats()
+        return {
+            "account": self.session_name,
+            "user_id": self.me.id if self.me else None,
+            "connected": bool(self.app and self.app.is_connected),
+            "uptime": time.time() - self.started_at if self.started_at else 0,
+            "error": self.error,
+            "queue_depth": queue["depth"],
+            "in_flight": queue["in_flight"],
+            "processed": queue["processed"],
+            "failed": queue["failed"],
+            "downloads": len(self.__dict__["media_handler"].downloads_in_progress) if "media_handler" in self.__dict__ else 0,
+        }
         
+    async def _gate(self, message: Message, first_step=None):
+        """Force-subscribe gate for a command, overlapped with its first lookup
+        
+        Returns (allowed, first step result); on deny the command message is
+        replaced with the channels to join.
+        """
+        allowed, result = await self.force_subscribe.speculate(message.from_user.id, first_step)
+        if not allowed:
+            channels = await self.force_subscribe.get_required_channels()
+            links = "\n".join([f"• @{ch['username']}" for ch in channels])
+            await message.edit_text(
+                f"❌ **Subscription Required**\n\n"
+                f"Please join the following channels first:\n{links}"
+            )
+        return allowed, result
+    
+    def _media_job(self, client: Client, media: Message, command: Optional[Message], album=None):
+        """Save job for a media message (the whole album if it's part of one) and its restart checkpoint"""
+        if media.media_group_id:
+            job = lambda: self.media_handler.save_media_group(client, media, command, album)
+        else:
+            job = lambda: self.media_handler.save_disappearing_media(client, media, command)
+        return job, {"chat_id": media.chat.id, "message_id": media.id, "priority": PRIORITY_MANUAL}
+    
     def _register_handlers(self):
         """Register all command handlers"""
         
+        # While shutting down, turn commands away instead of starting work that would be cut off
+        @self.app.on_message(filters.me & filters.regex(r"^\."), group=-2)
+        async def reject_while_draining(client: Client, message: Message):
+            if self.draining:
+                await message.edit_text("⏳ Restarting, send the command again in a moment")
+                message.stop_propagation()
+        
+        # Traffic recorder sees every update before the command handlers
+        @self.app.on_message(group=-1)
+        async def record_traffic(client: Client, message: Message):
+            self.recorder.record(message)
+        
         # .ok command - Save disappearing media
         @self.app.on_message(filters.me & filters.command("ok", prefixes="."))
+        @traced("cmd.ok")
         async def save_disappearing_media(client: Client, message: Message):
             try:
-                # Check force subscribe
-                if not await self.force_subscribe.check_subscription(message.from_user.id):
-                    channels = await self.force_subscribe.get_required_channels()
-                    links = "\n".join([f"• @{ch['username']}" for ch in channels])
-                    await message.edit_text(
-                        f"❌ **Subscription Required**\n\n"
-                        f"Please join the following channels first:\n{links}"
-                    )
+                # Resolve the album while the subscription check is in flight
+                reply = message.reply_to_message
+                prefetch = None
+                if reply and reply.media_group_id:
+                    prefetch = lambda: client.get_media_group(reply.chat.id, reply.id)
+                allowed, album = await self._gate(message, prefetch)
+                if not allowed:
                     return
                 
                 # Check if replying to media
-                if not message.reply_to_message:
+                if not reply:
                     await message.edit_text("❌ Reply to a media message with `.ok` to save it")
                     return
                 
-                reply = message.reply_to_message
                 
                 # Check if it's view-once media
                 if not (reply.photo or reply.video or reply.document or reply.audio):
                     await message.edit_text("❌ Reply message doesn't contain media")
                     return
                 
-                # Download and save media
+                # Download and save media (the whole album if it's part of one)
                 await message.edit_text("⏳ Downloading media...")
-                result = await self.media_handler.save_disappearing_media(client, reply, message)
+                job, checkpoint = self._media_job(client, reply, message, album)
+                result = await self.job_queue.submit(job, PRIORITY_MANUAL, checkpoint)
                 
                 if result['success']:
                     await message.delete()  # Delete command message
@@ -100,29 +352,25 @@ class TgSecretUserbot:
         
         # .get/.story command - Save stories
         @self.app.on_message(filters.me & filters.command(["get", "story"], prefixes="."))
+        @traced("cmd.get")
         async def save_stories(client: Client, message: Message):
             try:
-                # Check force subscribe
-                if not await self.force_subscribe.check_subscription(message.from_user.id):
-                    channels = await self.force_subscribe.get_required_channels()
-                    links = "\n".join([f"• @{ch['username']}" for ch in channels])
-                    await message.edit_text(
-                        f"❌ **Subscription Required**\n\n"
-                        f"Please join the following channels first:\n{links}"
-                    )
+                # Parse username, then look it up while the subscription check is in flight
+                args = message.text.split(maxsplit=1)
+                username = args[1].strip().replace("@", "") if len(args) > 1 else None
+                prefetch = (lambda: self.story_handler.resolve_user(client, username)) if username else None
+                allowed, user = await self._gate(message, prefetch)
+                if not allowed:
                     return
                 
-                # Parse username
-                args = message.text.split(maxsplit=1)
-                if len(args) < 2:
+                if not username:
                     await message.edit_text("❌ Usage: `.get username` or `.story username`")
                     return
                 
-                username = args[1].strip().replace("@", "")
                 await message.edit_text(f"📱 Fetching stories from @{username}...")
                 
                 # Download stories
-                result = await self.story_handler.download_stories(client, username, message)
+                result = await self.story_handler.download_stories(client, username, message, user)
                 
                 if result['success']:
                     count = result.get('count', 0)
@@ -140,32 +388,43 @@ class TgSecretUserbot:
         
         # .ask command - AI assistant
         @self.app.on_message(filters.me & filters.command("ask", prefixes="."))
+        @traced("cmd.ask")
         async def ai_assistant(client: Client, message: Message):
             try:
-                # Check force subscribe
-                if not await self.force_subscribe.check_subscription(message.from_user.id):
-                    channels = await self.force_subscribe.get_required_channels()
-                    links = "\n".join([f"• @{ch['username']}" for ch in channels])
-                    await message.edit_text(
-                        f"❌ **Subscription Required**\n\n"
-                        f"Please join the following channels first:\n{links}"
+                # Parse prompt
+                args = message.text.split(maxsplit=1)
+                prompt = args[1].strip() if len(args) > 1 else None
+                
+                # Load the API key and the thread while the subscription check is in flight.
+                # Replying to an earlier answer continues that thread, otherwise the chat's recent one
+                prefetch = None
+                if prompt:
+                    prefetch = lambda: self.ai_handler.load_context(
+                        message.from_user.id, message.chat.id, message.reply_to_message_id
                     )
+                allowed, context = await self._gate(message, prefetch)
+                if not allowed:
                     return
                 
-                # Parse prompt
-                args = message.text.split(maxsplit=1)
-                if len(args) < 2:
+                if not prompt:
                     await message.edit_text("❌ Usage: `.ask your question here`")
                     return
                 
-                prompt = args[1].strip()
+                api_config, conversation = context
+                conversations = self.ai_handler.conversations
                 await message.edit_text("🤔 Thinking...")
                 
+                async def show_position(provider: str, position: int):
+                    await message.edit_text(f"⏳ Waiting for {provider}, position {position} in queue...")
+                
                 # Get AI response
-                result = await self.ai_handler.process_query(message.from_user.id, prompt)
+                result = await self.ai_handler.process_query(
+                    message.from_user.id, prompt, show_position, conversation, api_config
+                )
                 
                 if result['success']:
                     response = result['response']
+                    message_ids = [message.id]
                     
                     # Handle long responses
                     if len(response) > 4096:
@@ -173,9 +432,11 @@ class TgSecretUserbot:
                         chunks = [response[i:i+4096] for i in range(0, len(response), 4096)]
                         await message.edit_text(chunks[0])
                         for chunk in chunks[1:]:
-                            await message.reply_text(chunk)
+                            sent = await message.reply_text(chunk)
+                            message_ids.append(sent.id)
                     else:
                         await message.edit_text(response)
+                    await conversations.link(conversation, message_ids)
                 else:
                     error_msg = result.get('error', 'Unknown error')
                     if 'api_key' in error_msg.lower():
@@ -191,16 +452,264 @@ class TgSecretUserbot:
                 logger.error(f"Error in .ask handler: {e}")
                 await message.edit_text(f"❌ Error: {str(e)}")
         
+        # .forget command - Clear .ask conversation memory for this chat
+        @self.app.on_message(filters.me & filters.command("forget", prefixes="."))
+        async def forget_conversation(client: Client, message: Message):
+            try:
+                removed = await self.ai_handler.conversations.forget(message.from_user.id, message.chat.id)
+                await message.edit_text(f"🧹 Forgot {removed} conversation(s) in this chat")
+            except Exception as e:
+                logger.error(f"Error in .forget handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # Auto-capture incoming view-once media (opt-in, see .capture)
+        @self.app.on_message(
+            filters.private & filters.incoming
+            & (filters.photo | filters.video | filters.voice | filters.video_note),
+            group=1
+        )
+        async def auto_capture(client: Client, message: Message):
+            try:
+                await self.capture_handler.handle(client, message)
+            except Exception as e:
+                logger.error(f"Error in auto-capture handler: {e}")
+        
+        # .capture command - Control automatic view-once capture
+        @self.app.on_message(filters.me & filters.command("capture", prefixes="."))
+        async def capture_settings(client: Client, message: Message):
+            try:
+                args = message.text.split()[1:]
+                action = args[0].lower() if args else "status"
+                target = args[1].lstrip("@").lower() if len(args) > 1 else None
+                
+                if action in ("on", "off"):
+                    self.capture_handler.enabled = action == "on"
+                elif action in ("allow", "deny", "unallow", "undeny") and target:
+                    chats = self.capture_handler.allow if action.endswith("allow") else self.capture_handler.deny
+                    if action.startswith("un"):
+                        chats.discard(target)
+                    else:
+                        chats.add(target)
+                elif action != "status":
+                    await message.edit_text("❌ Usage: `.capture [on|off|status|allow|deny|unallow|undeny chat]`")
+                    return
+                
+                stats = self.capture_handler.stats()
+                await message.edit_text(
+                    f"📸 **Auto-capture {'ON' if stats['enabled'] else 'OFF'}**\n\n"
+                    f"Allow: {', '.join(stats['allow']) or 'all chats'}\n"
+                    f"Deny: {', '.join(stats['deny']) or 'none'}\n\n"
+                    f"Queue: {stats['depth']}/{stats['capacity']} (in flight: {stats['in_flight']})\n"
+                    f"Captured: {stats['captured']} • Processed: {stats['processed']}\n"
+                    f"Failed: {stats['failed']} • Dropped: {stats['dropped']} • Skipped: {stats['skipped']}"
+                )
+            except Exception as e:
+                logger.error(f"Error in .capture handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .stats command - Show hot-path metrics
+        @self.app.on_message(filters.me & filters.command("stats", prefixes="."))
+        async def show_stats(client: Client, message: Message):
+            try:
+                lines = metrics.summary()
+                loop = self.watchdog.stats()
+                ai_handler = self.shared._built("ai_handler")
+                ratios = ai_handler.cache_hit_ratios() if ai_handler else {}
+                cache = " • ".join(f"{provider} {ratio:.0%}" for provider, ratio in sorted(ratios.items()))
+                await message.edit_text(
+                    "📊 **Metrics**\n\n" + ("\n".join(f"`{line}`" for line in lines) or "No data yet") +
+                    f"\n\n⏱ Loop lag p50 {loop['p50_ms']:.1f}ms • p99 {loop['p99_ms']:.1f}ms • "
+                    f"max {loop['max_lag_ms']:.0f}ms • stalls {loop['stalls']}" +
+                    (f"\n🧠 AI prompt cache hits: {cache}" if cache else "")
+                )
+            except Exception as e:
+                logger.error(f"Error in .stats handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .profile command - Sample the event loop into a flamegraph stack file
+        @self.app.on_message(filters.me & filters.command("profile", prefixes="."))
+        async def run_profiler(client: Client, message: Message):
+            try:
+                args = message.text.split()
+                duration = parse_duration(args[1]) if len(args) > 1 else 30
+                if not 0 < duration <= 600:
+                    await message.edit_text("❌ Duration must be between 0 and 10 minutes")
+                    return
+                
+                await message.edit_text(f"🔬 Profiling for {duration:g}s...")
+                result = await self.profiler.profile(duration)
+                await message.edit_text(
+                    f"✅ **Profile Saved**\n\n"
+                    f"Samples: {result['samples']} • Unique stacks: {result['stacks']}\n"
+                    f"`{result['path']}`\n\n"
+                    f"Render with `flamegraph.pl` or speedscope"
+                )
+            except Exception as e:
+                logger.error(f"Error in .profile handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .record command - Record anonymized traffic for load-test replay
+        @self.app.on_message(filters.me & filters.command("record", prefixes="."))
+        async def record_command(client: Client, message: Message):
+            try:
+                args = message.text.split()
+                action = args[1].lower() if len(args) > 1 else "status"
+                
+                if action == "start":
+                    path = self.recorder.start()
+                    await message.edit_text(f"⏺ Recording traffic to `{path}`")
+                elif action == "stop":
+                    path = self.recorder.stop()
+                    await message.edit_text(
+                        f"⏹ Recorded {self.recorder.events} events to `{path}`" if path else "❌ Not recording"
+                    )
+                else:
+                    state = f"recording ({self.recorder.events} events)" if self.recorder.active else "idle"
+                    await message.edit_text(f"⏺ Traffic recorder: {state}\nUsage: `.record start|stop`")
+            except Exception as e:
+                logger.error(f"Error in .record handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .find command - Search the local media index
+        @self.app.on_message(filters.me & filters.command("find", prefixes="."))
+        async def find_media(client: Client, message: Message):
+            try:
+                args = message.text.split(maxsplit=1)
+                if len(args) < 2:
+                    await message.edit_text(
+                        "❌ Usage: `.find [@user] [type:photo] [kind:story] "
+                        "[since:2024-01] [until:2024-02] [caption words]`"
+                    )
+                    return
+                
+                try:
+                    query = parse_find_query(args[1])
+                except ValueError as e:
+                    await message.edit_text(f"❌ {e}")
+                    return
+                
+                results = await self.index.search(**query)
+                if not results:
+                    await message.edit_text("🔍 Nothing found")
+                    return
+                
+                lines = []
+                for item in results:
+                    date = datetime.fromtimestamp(item['date']).strftime('%Y-%m-%d') if item['date'] else '?'
+                    sender = f"@{item['sender_username']}" if item['sender_username'] else (item['sender_name'] or '?')
+                    size = f"{(item['size'] or 0)/1024/1024:.1f}MB"
+                    caption = (item['caption'] or '').replace("\n", " ")[:40]
+                    lines.append(f"• {date} {item['media_type'] or item['kind']} from {sender} ({size}) {caption}\n  `{item['file_path']}`")
+                
+                await message.edit_text(f"🔍 **{len(results)} results**\n\n" + "\n".join(lines))
+            except Exception as e:
+                logger.error(f"Error in .find handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+
+        # .export command - Stream matching archived media into a tar/zip file
+        @self.app.on_message(filters.me & filters.command("export", prefixes="."))
+        async def export_media(client: Client, message: Message):
+            try:
+                args = message.text.split(maxsplit=1)
+                if len(args) < 2:
+                    await message.edit_text(
+                        "❌ Usage: `.export [@user] [type:photo] [kind:story] "
+                        "[since:2024-01] [until:2024-02] [format:zip]`"
+                    )
+                    return
+
+                try:
+                    query, fmt = parse_export_query(args[1])
+                except ValueError as e:
+                    await message.edit_text(f"❌ {e}")
+                    return
+
+                export = await ArchiveExport.create(self.index, self.storage, query, fmt)
+                if not export.items:
+                    await message.edit_text("📦 Nothing to export")
+                    return
+
+                await message.edit_text(
+                    f"📦 Exporting {export.manifest['count']} files "
+                    f"({export.manifest['bytes']/1024/1024:.1f}MB) as {fmt}..."
+                )
+                result = await export.to_file()
+                resumed = f"\nResumed at {result['resumed_from']/1024/1024:.1f}MB" if result['resumed_from'] else ""
+                await message.edit_text(
+                    f"✅ **Export Ready**\n\n"
+                    f"Files: {result['items']} • Size: {result['bytes']/1024/1024:.1f}MB{resumed}\n"
+                    f"`{result['path']}`"
+                )
+            except Exception as e:
+                logger.error(f"Error in .export handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+
+        # .reindex command - Backfill the local index from STORAGE_PATH
+        @self.app.on_message(filters.me & filters.command("reindex", prefixes="."))
+        async def reindex_media(client: Client, message: Message):
+            try:
+                await message.edit_text("🗂 Indexing existing files...")
+                added = await self.index.backfill(STORAGE_PATH)
+                await message.edit_text(f"✅ Indexed {added} new files")
+            except Exception as e:
+                logger.error(f"Error in .reindex handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .thumbs command - Backfill or regenerate previews
+        @self.app.on_message(filters.me & filters.command("thumbs", prefixes="."))
+        async def generate_previews(client: Client, message: Message):
+            try:
+                force = "force" in message.text.split()[1:]
+                await message.edit_text("🖼 Generating previews...")
+                count = await self.derivatives.backfill(STORAGE_PATH, force=force)
+                await message.edit_text(f"✅ Previews ready for {count} files")
+            except Exception as e:
+                logger.error(f"Error in .thumbs handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
+        # .compact command - Run archive compaction now
+        @self.app.on_message(filters.me & filters.command("compact", prefixes="."))
+        async def compact_storage(client: Client, message: Message):
+            try:
+                await message.edit_text("🗜 Compacting archive...")
+                report = await self.storage.compact()
+                
+                lines = [
+                    f"• `{ext}`: {stats['files']} files, ratio {stats['ratio']:.2f}"
+                    for ext, stats in sorted(report['by_extension'].items())
+                ]
+                await message.edit_text(
+                    f"✅ **Compaction Finished**\n\n"
+                    f"Moved to cold tier: {report['files_moved']}\n"
+                    f"Compressed: {report['files_compressed']}\n"
+                    f"Size: {report['bytes_before']/1024/1024:.1f}MB → {report['bytes_after']/1024/1024:.1f}MB "
+                    f"(ratio {report['ratio']:.2f})\n"
+                    + ("\n".join(lines) if lines else "")
+                )
+            except Exception as e:
+                logger.error(f"Error in .compact handler: {e}")
+                await message.edit_text(f"❌ Error: {str(e)}")
+        
         # .help command
         @self.app.on_message(filters.me & filters.command("help", prefixes="."))
         async def show_help(client: Client, message: Message):
             help_text = """
 **🤖 TgSecret Commands**
 
-• `.ok` - Reply to disappearing/view-once media to save it
+• `.ok` - Reply to disappearing/view-once media (or any album item) to save it
 • `.get username` - Download stories from a user  
 • `.story username` - Alternative for .get
-• `.ask question` - Ask AI assistant anything
+• `.ask question` - Ask AI assistant anything (reply to an answer to continue that thread)
+• `.forget` - Clear AI conversation memory for this chat
+• `.capture [on|off|allow chat|deny chat]` - Auto-save incoming view-once media
+• `.find @user type:photo since:2024-01 words` - Search saved media
+• `.export @user type:photo since:2024-01 [format:zip]` - Export matching media as tar/zip (rerun to resume)
+• `.reindex` - Index files already in storage
+• `.thumbs [force]` - Generate missing previews (or regenerate all)
+• `.stats` - Show latency and throughput metrics
+• `.profile 30s` - Record a flamegraph-compatible profile of the event loop
+• `.record start|stop` - Record anonymized traffic for load-test replay
+• `.compact` - Move old media to the cold tier and compress it
 
 **⚙️ Admin Panel**
 Visit http://localhost:3000 to:
@@ -217,44 +726,136 @@ Visit http://localhost:3000 to:
             await message.edit_text(help_text)
             
     async def start(self):
-        """Start the userbot"""
+        """Start the userbot and run until interrupted"""
+        with STARTUP.phase("services"):
+            await self.shared.start()
+        await self.launch()
+        logger.info(STARTUP.report())
+        
+        # Keep the bot running
+        await idle()
+        
+    async def launch(self, client: Optional[Client] = None):
+        """Connect this account and start its per-account services"""
         try:
-            await self.initialize()
-            await self.app.start()
+            with STARTUP.phase("initialize"):
+                await self.initialize(client)
+            with STARTUP.phase("connect"):
+                await self.app.start()
             
-            me = await self.app.get_me()
-            logger.info(f"Userbot started as @{me.username} (ID: {me.id})")
+            # Client.start() already fetched our own user
+            self.me = getattr(self.app, "me", None) or await self.app.get_me()
+            self.started_at = time.time()
+            logger.info(f"Userbot started as @{self.me.username} (ID: {self.me.id})")
             
-            # Notify backend that bot is online
-            await self.backend.update_session_status(str(me.id), True)
+            # Record traffic from startup if configured
+            if TRAFFIC_RECORD:
+                self.recorder.start()
             
-            # Send startup message
-            await self.app.send_message(
-                "me",
-                "✅ **TgSecret Userbot Started**\n\n"
-                "Type `.help` for available commands"
-            )
+            # Start media job workers
+            self.job_queue.start()
+            
+            # Peers and unfinished jobs from the last shutdown
+            await self._restore(self.state.load())
             
-            # Keep the bot running
-            await idle()
+            # Status update and startup notice don't gate command handling
+            self.announce_task = asyncio.create_task(self._announce())
             
         except Exception as e:
-            logger.error(f"Failed to start userbot: {e}")
+            self.error = str(e)
+            logger.error(f"Failed to start userbot {self.session_name}: {e}")
             raise
             
+    async def _announce(self):
+        """Notify backend that bot is online and send the startup message, concurrently"""
+        results = await asyncio.gather(
+            self.backend.update_session_status(str(self.me.id), True),
+            self.app.send_message(
+                "me",
+                "✅ **TgSecret Userbot Started**\n\n"
+                "Type `.help` for available commands"
+            ),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Startup notice failed for {self.session_name}: {result}")
+            
+    async def _restore(self, state: Dict[str, Any]):
+        if not state:
+            return
+        peers = state.get("peers") or []
+        if peers and is_fresh(state):
+            try:
+                await self.app.storage.update_peers([tuple(peer) for peer in peers])
+            except Exception as e:
+                logger.warning(f"Could not restore peers for {self.session_name}: {e}")
+        jobs = state.get("jobs") or []
+        if jobs:
+            self.resume_task = asyncio.create_task(self._resume_jobs(jobs))
+        logger.info(f"Restored {len(peers)} peers and {len(jobs)} unfinished jobs for {self.session_name}")
+    
+    async def _resume_jobs(self, jobs: List[Dict[str, Any]]):
+        """Requeue jobs the last shutdown checkpointed (view-once media may be gone by now)"""
+        for checkpoint in jobs:
+            try:
+                media = await self.app.get_messages(checkpoint["chat_id"], checkpoint["message_id"])
+                if not media or media.empty:
+                    logger.info(f"Checkpointed message {checkpoint['message_id']} is gone, not resuming")
+                    continue
+                job, _ = self._media_job(self.app, media, None)
+                self.job_queue.submit_nowait(job, checkpoint.get("priority", PRIORITY_AUTO), checkpoint)
+            except Exception as e:
+                logger.warning(f"Could not resume job for message {checkpoint.get('message_id')}: {e}")
+    
+    def _dump_peers(self) -> List[List[Any]]:
+        """Recently seen peers of an in-memory session, which Pyrogram doesn't persist itself"""
+        conn = getattr(getattr(self.app, "storage", None), "conn", None)
+        if conn is None or not (self.session_string or getattr(self.app, "in_memory", False)):
+            return []
+        rows = conn.execute(
+            "SELECT id, access_hash, type, username, phone_number FROM peers "
+            "ORDER BY last_update_on DESC LIMIT ?",
+            (STATE_MAX_PEERS,)
+        )
+        return [list(row) for row in rows]
+    
+    def _snapshot(self, jobs: List[Dict[str, Any]]):
+        """Save unfinished jobs and (while still connected) peers for the next start"""
+        try:
+            peers = self._dump_peers() if self.app and self.app.is_connected else []
+            if jobs or peers:
+                self.state.save({"jobs": jobs, "peers": peers})
+        except Exception as e:
+            logger.error(f"Failed to save state for {self.session_name}: {e}")
+    
     async def stop(self):
-        """Stop the userbot"""
+        """Stop the userbot: turn away new commands, give transfers SHUTDOWN_DRAIN_TIMEOUT
+        to finish (checkpointing the rest), save warm state, then disconnect"""
         try:
-            if self.app:
-                me = await self.app.get_me()
-                await self.backend.update_session_status(str(me.id), False)
+            self.draining = True
+            for task in (self.announce_task, self.resume_task):
+                if task:
+                    task.cancel()
+            jobs = await self.job_queue.drain(SHUTDOWN_DRAIN_TIMEOUT)
+            self.recorder.stop()
+            self._snapshot(jobs)
+            
+            if self.app and self.app.is_connected:
+                if self.me:
+                    await self.backend.update_session_status(str(self.me.id), False)
                 await self.app.stop()
-                logger.info("Userbot stopped")
+                logger.info(f"Userbot {self.session_name} stopped")
         except Exception as e:
-            logger.error(f"Error stopping userbot: {e}")
+            logger.error(f"Error stopping userbot {self.session_name}: {e}")
+        finally:
+            if self._owns_shared:
+                await self.shared.stop()
             
 async def main():
     """Main entry point"""
+    with STARTUP.phase("logging"):
+        configure_logging()
     bot = TgSecretUserbot()
     
     try:
@@ -263,6 +864,7 @@ async def main():
         logger.info("Received interrupt signal")
     finally:
         await bot.stop()
+        shutdown_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,8 +1,15 @@
 """Force subscribe middleware for userbot"""
-from typing import List, Dict, Any
+import asyncio
+import time
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Tuple
 from pyrogram import Client
 from pyrogram.errors import UserNotParticipant, ChatAdminRequired
+from ..config import SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_SPECULATIVE
 from ..utils.logger import get_logger
+from ..utils.metrics import (
+    SUBSCRIPTION_CHECK, SUBSCRIPTION_SAVED, SUBSCRIPTION_SPECULATION, SUBSCRIPTION_WASTED
+)
+from ..utils.tracing import span
 
 logger = get_logger(__name__)
 
@@ -12,23 +19,79 @@ class ForceSubscribeMiddleware:
         self.channels_cache = []
         self.cache_ttl = 300  # 5 minutes
         self.last_cache_update = 0
+        self.subscribed: Dict[int, float] = {}  # user id -> when a check last passed
     
     async def check_subscription(self, user_id: int) -> bool:
         """Check if user is subscribed to all required channels"""
         try:
-            # Get required channels from backend
-            channels = await self.get_required_channels()
-            
-            if not channels:
-                return True  # No channels required
-            
-            # Check subscription status via backend
-            return await self.backend.check_subscription(user_id)
+            with SUBSCRIPTION_CHECK.time(), span("subscription_check", user_id=user_id):
+                # A recent pass is reused; failures are always rechecked
+                if time.time() - self.subscribed.get(user_id, 0) < SUBSCRIPTION_CACHE_TTL:
+                    return True
+                
+                # Get required channels from backend
+                channels = await self.get_required_channels()
+                
+                if not channels:
+                    return True  # No channels required
+                
+                # Check subscription status via backend
+                subscribed = await self.backend.check_subscription(user_id)
+                if subscribed:
+                    self.subscribed[user_id] = time.time()
+                return subscribed
             
         except Exception as e:
             logger.error(f"Error checking subscription: {e}")
             return True  # Allow on error to prevent blocking
     
+    async def speculate(
+        self,
+        user_id: int,
+        first_step: Optional[Callable[[], Awaitable[Any]]] = None
+    ) -> Tuple[bool, Any]:
+        """Check the subscription while the command's first step already runs
+        
+        first_step must only look things up (no messages sent or edited): on a
+        deny it is cancelled and its result dropped. Returns (allowed, result).
+        """
+        if first_step is None:
+            return await self.check_subscription(user_id), None
+        if not SUBSCRIPTION_SPECULATIVE:
+            if not await self.check_subscription(user_id):
+                return False, None
+            return True, await first_step()
+        
+        started = time.perf_counter()
+        finished = {}
+        
+        async def timed():
+            try:
+                return await first_step()
+            finally:
+                finished["at"] = time.perf_counter()
+        
+        work = asyncio.create_task(timed())
+        try:
+            allowed = await self.check_subscription(user_id)
+        except BaseException:
+            work.cancel()
+            raise
+        checked = time.perf_counter()
+        
+        if not allowed:
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            SUBSCRIPTION_SPECULATION.inc(outcome="denied")
+            SUBSCRIPTION_WASTED.inc(finished.get("at", checked) - started)
+            return False, None
+        
+        result = await work
+        SUBSCRIPTION_SPECULATION.inc(outcome="allowed")
+        # Run serially this would take check + step; running both at once hides the shorter one
+        SUBSCRIPTION_SAVED.observe(min(checked, finished["at"]) - started)
+        return True, result
+    
     async def get_required_channels(self) -> List[Dict[str, Any]]:
         """Get list of required channels from backend"""
         try:
@@ -52,6 +115,21 @@ class ForceSubscribeMiddleware:
             logger.error(f"Error getting required channels: {e}")
             return []
     
+    def snapshot(self) -> Dict[str, Any]:
+        """Channel list and recent passed checks, for a warm restart"""
+        cutoff = time.time() - SUBSCRIPTION_CACHE_TTL
+        return {
+            "channels": self.channels_cache,
+            "channels_updated": self.last_cache_update,
+            "subscribed": {str(uid): at for uid, at in self.subscribed.items() if at > cutoff},
+        }
+    
+    def restore(self, state: Dict[str, Any]):
+        # Original timestamps, so the usual TTLs still decide when to refetch
+        self.channels_cache = state.get("channels") or []
+        self.last_cache_update = state.get("channels_updated", 0)
+        self.subscribed.update({int(uid): at for uid, at in state.get("subscribed", {}).items()})
+    
     async def check_user_in_channel(self, client: Client, user_id: int, channel_id: int) -> bool:
         """Check if a user is member of a specific channel"""
         try:
@@ -0,0 +1,310 @@
+"""Shard accounts across worker processes, each running a SessionHost
+
+Sessions are assigned to shards by rendezvous hashing, so adding or removing
+an account only moves that account. Crashed workers are restarted with their
+sessions, and each shard's metrics are merged behind one endpoint (with a
+`shard` label). From the userbot directory:
+    python -m src.supervisor --workers 4
+    python -m src.supervisor --workers 2 --fake 10      # fake clients + backend stub
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import signal
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from .config import (
+    LOG_FILE, LOG_LEVEL, METRICS_HOST, METRICS_PORT, HOST_SESSIONS_SOURCE,
+    BACKEND_URL, WEBHOOK_SECRET, SUPERVISOR_WORKERS, SUPERVISOR_POLL, ensure_directories
+)
+from .utils.logger import setup_logger, get_logger, shutdown_logging
+
+logger = get_logger('TgSecret.supervisor')
+
+MAX_RESTART_DELAY = 60  # seconds
+
+
+def shard_for(session: str, shards: int) -> int:
+    """Rendezvous (highest random weight) hashing of a session onto a shard"""
+    return max(
+        range(shards),
+        key=lambda shard: hashlib.blake2b(f"{shard}:{session}".encode(), digest_size=8).digest()
+    )
+
+
+def assign(sessions: Dict[str, Optional[str]], shards: int) -> List[Dict[str, Optional[str]]]:
+    assignment: List[Dict[str, Optional[str]]] = [{} for _ in range(shards)]
+    for name, session_string in sessions.items():
+        assignment[shard_for(name, shards)][name] = session_string
+    return assignment
+
+
+def shard_metrics_port(shard: int) -> int:
+    return METRICS_PORT + 1 + shard
+
+
+@contextmanager
+def _environ(overrides: Dict[str, str]):
+    """Spawned workers read config from the environment at import time"""
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _worker_main(shard: int, sessions: Dict[str, Optional[str]], fake: bool):
+    from .utils.startup import install_uvloop
+
+    install_uvloop()
+    asyncio.run(_run_worker(shard, sessions, fake))
+
+
+async def _run_worker(shard: int, sessions: Dict[str, Optional[str]], fake: bool):
+    from .host import SessionHost
+    from .main import configure_logging
+
+    configure_logging()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    host = SessionHost()
+    backend_stub = None
+    if fake:
+        from benchmarks.fakes import FakeClient
+        from benchmarks.stubs import BackendStub
+        backend_stub = BackendStub()
+        host.shared.backend.base_url = await backend_stub.start()
+        for idx, name in enumerate(sessions):
+            host.add(name, client=FakeClient(me_id=shard * 100_000 + idx + 1, name=name))
+
+    try:
+        await host.start(sessions)
+        await stop.wait()
+    finally:
+        await host.stop()
+        if backend_stub:
+            await backend_stub.stop()
+        shutdown_logging()
+
+
+class Shard:
+    def __init__(self, shard_id: int):
+        self.id = shard_id
+        self.sessions: Dict[str, Optional[str]] = {}
+        self.process: Optional[multiprocessing.Process] = None
+        self.restarts = 0
+        self.next_start = 0.0
+
+
+class Supervisor:
+    def __init__(self, workers: int = SUPERVISOR_WORKERS, fake: int = 0, sessions_file: Optional[Path] = None):
+        self.context = multiprocessing.get_context("spawn")
+        self.shards = [Shard(i) for i in range(workers)]
+        self.fake = fake
+        self.sessions_file = sessions_file
+        self.metrics_runner: Optional[web.AppRunner] = None
+        self.http: Optional[aiohttp.ClientSession] = None
+
+    async def discover(self) -> Dict[str, Optional[str]]:
+        """Current session set; re-read every poll so new accounts get placed"""
+        if self.sessions_file and self.sessions_file.exists():
+            names = [line.strip() for line in self.sessions_file.read_text().splitlines() if line.strip()]
+            return {name: None for name in names}
+        if self.fake:
+            return {f"fake_{idx}": None for idx in range(self.fake)}
+
+        from .host import load_sessions
+        from .utils.backend_api import BackendAPI
+        backend = BackendAPI(BACKEND_URL, WEBHOOK_SECRET)
+        try:
+            return await load_sessions(backend, HOST_SESSIONS_SOURCE)
+        finally:
+            await backend.close()
+
+    def _start(self, shard: Shard):
+        shard.next_start = 0.0
+        overrides = {
+            "METRICS_ENABLED": "true",
+            "METRICS_PORT": str(shard_metrics_port(shard.id)),
+            "LOG_FILE": str(LOG_FILE.parent / f"shard{shard.id}.log"),
+            "TRACE_PATH": str(LOG_FILE.parent / f"traces_shard{shard.id}.jsonl"),
+            # Account snapshots are keyed by session and follow it across shards
+            "STATE_SHARED_NAME": f"shared-shard{shard.id}",
+        }
+        if shard.id != 0:
+            # One compactor per storage tree is enough, and only one process can bind EXPORT_PORT
+            overrides["COMPACTION_ENABLED"] = "false"
+            overrides["EXPORT_HTTP_ENABLED"] = "false"
+        with _environ(overrides):
+            shard.process = self.context.Process(
+                target=_worker_main, args=(shard.id, shard.sessions, bool(self.fake)),
+                name=f"tgsecret-shard{shard.id}", daemon=False
+            )
+            shard.process.start()
+        logger.info(f"Shard {shard.id} started (pid {shard.process.pid}) with {len(shard.sessions)} sessions")
+
+    def _terminate(self, shard: Shard, timeout: float = 30):
+        if shard.process and shard.process.is_alive():
+            shard.process.terminate()  # SIGTERM: the worker stops its accounts cleanly
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.kill()
+                shard.process.join()
+        shard.process = None
+
+    async def rebalance(self):
+        """Place the current sessions and restart shards whose set changed"""
+        assignment = assign(await self.discover(), len(self.shards))
+        for shard, sessions in zip(self.shards, assignment):
+            if sessions == shard.sessions and shard.process:
+                continue
+            if shard.process:
+                logger.info(f"Rebalancing shard {shard.id}: {len(shard.sessions)} -> {len(sessions)} sessions")
+                await asyncio.to_thread(self._terminate, shard)
+            shard.sessions = sessions
+            if sessions:
+                self._start(shard)
+
+    def check_workers(self):
+        """Restart crashed workers with exponential backoff"""
+        now = time.monotonic()
+        for shard in self.shards:
+            if not shard.process or shard.process.is_alive() or not shard.sessions:
+                continue
+            if not shard.next_start:
+                shard.restarts += 1
+                delay = min(MAX_RESTART_DELAY, 2 ** shard.restarts)
+                shard.next_start = now + delay
+                logger.error(
+                    f"Shard {shard.id} exited with code {shard.process.exitcode}, restarting in {delay}s"
+                )
+            elif now >= shard.next_start:
+                self._start(shard)
+
+    async def aggregate_metrics(self) -> str:
+        """Merge every shard's exposition, grouping samples by metric family"""
+        families: Dict[str, List[str]] = {}
+        headers: Dict[str, List[str]] = {}
+
+        async def fetch(shard: Shard) -> str:
+            try:
+                url = f"http://127.0.0.1:{shard_metrics_port(shard.id)}/metrics"
+                async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    return await response.text()
+            except Exception:
+                return ""
+
+        texts = await asyncio.gather(*[fetch(shard) for shard in self.shards])
+        for shard, text in zip(self.shards, texts):
+            family = None
+            for line in text.splitlines():
+                if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                    family = line.split()[2]
+                    headers.setdefault(family, [])
+                    if line not in headers[family]:
+                        headers[family].append(line)
+                elif line and family:
+                    families.setdefault(family, []).append(_add_label(line, "shard", str(shard.id)))
+
+        lines = [
+            "# HELP tgsecret_shard_up 1 while the shard worker process is alive",
+            "# TYPE tgsecret_shard_up gauge",
+        ]
+        lines += [
+            f'tgsecret_shard_up{{shard="{s.id}"}} {int(bool(s.process and s.process.is_alive()))}'
+            for s in self.shards
+        ]
+        lines += [
+            "# HELP tgsecret_shard_restarts_total Worker restarts after a crash",
+            "# TYPE tgsecret_shard_restarts_total counter",
+        ]
+        lines += [f'tgsecret_shard_restarts_total{{shard="{s.id}"}} {s.restarts}' for s in self.shards]
+        for family, samples in families.items():
+            lines.extend(headers.get(family, []))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    async def start_metrics_server(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        async def handle_metrics(request):
+            return web.Response(text=await self.aggregate_metrics(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.metrics_runner = web.AppRunner(app, access_log=None)
+        await self.metrics_runner.setup()
+        await web.TCPSite(self.metrics_runner, host, port).start()
+        logger.info(f"Aggregated metrics on http://{host}:{port}/metrics")
+
+    async def run(self, poll: int = SUPERVISOR_POLL):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        self.http = aiohttp.ClientSession()
+        await self.start_metrics_server()
+        last_poll = 0.0
+        try:
+            while not stop.is_set():
+                if time.monotonic() - last_poll >= poll:
+                    last_poll = time.monotonic()
+                    try:
+                        await self.rebalance()
+                    except Exception as e:
+                        logger.error(f"Error rebalancing shards: {e}")
+                self.check_workers()
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            logger.info("Stopping shards")
+            await asyncio.gather(*[asyncio.to_thread(self._terminate, shard) for shard in self.shards])
+            await self.metrics_runner.cleanup()
+            await self.http.close()
+
+
+def _add_label(sample: str, key: str, value: str) -> str:
+    name, _, rest = sample.partition(" ")
+    if "{" in name:
+        metric, _, labels = name.partition("{")
+        return f'{metric}{{{key}="{value}",{labels} {rest}'
+    return f'{name}{{{key}="{value}"}} {rest}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=SUPERVISOR_WORKERS, help="worker processes")
+    parser.add_argument("--fake", type=int, default=0, help="run N fake accounts (benchmarks.fakes)")
+    parser.add_argument("--sessions-file", type=Path, help="session names, one per line, re-read every poll")
+    parser.add_argument("--poll", type=int, default=SUPERVISOR_POLL, help="seconds between session rescans")
+    args = parser.parse_args(argv)
+
+    ensure_directories()
+    setup_logger('TgSecret.supervisor', LOG_FILE.parent / "supervisor.log", LOG_LEVEL)
+    supervisor = Supervisor(args.workers, args.fake, args.sessions_file)
+    try:
+        asyncio.run(supervisor.run(args.poll))
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
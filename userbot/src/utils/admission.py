@@ -0,0 +1,239 @@
+"""Admission control for outbound AI calls
+
+One limiter per provider API key bounds requests in flight. The limit adapts
+AIMD-style: +1 per window of successes, halved on a 429, with the queue held
+for the provider's Retry-After. Waiters are served round-robin across users
+so one user's burst can't starve everyone else, and give up after a bounded wait.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from ..config import AI_MAX_IN_FLIGHT, AI_PROVIDER_LIMITS, AI_QUEUE_SIZE, AI_QUEUE_TIMEOUT
+from ..utils import metrics
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+POSITION_INTERVAL = 3.0  # seconds between queue position updates (message edits are rate limited)
+DECREASE_INTERVAL = 1.0  # concurrent 429s from one burst only halve the limit once
+DEFAULT_RETRY_AFTER = 1.0
+
+AI_QUEUE_WAIT = metrics.REGISTRY.histogram(
+    "tgsecret_ai_queue_wait_seconds", "Time AI requests waited for a provider slot")
+AI_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "tgsecret_ai_queue_depth", "AI requests waiting for a provider slot")
+AI_LIMIT = metrics.REGISTRY.gauge(
+    "tgsecret_ai_concurrency_limit", "Current adaptive in-flight limit per provider key")
+AI_THROTTLED = metrics.REGISTRY.counter(
+    "tgsecret_ai_throttled_total", "429 responses from AI providers")
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueTimeout(Exception):
+    """No provider slot freed up within the wait budget (or the queue is full)"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Waiter:
+    __slots__ = ("user_id", "future", "queued_at")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str, label: str, max_limit: int):
+        self.provider = provider
+        self.label = label
+        self.max_limit = max(1, max_limit)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.waiters: "OrderedDict[object, Deque[_Waiter]]" = OrderedDict()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.waiters.values())
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.limit) and time.monotonic() >= self.blocked_until
+
+    def _service_order(self) -> List[_Waiter]:
+        """Waiters in the order they will be admitted: one per user per round"""
+        queues = [list(queue) for queue in self.waiters.values()]
+        order = []
+        for round_ in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[round_] for q in queues if round_ < len(q))
+        return order
+
+    def position(self, waiter: _Waiter) -> int:
+        return self._service_order().index(waiter) + 1
+
+    async def acquire(self, user_id, on_position: Optional[PositionCallback] = None,
+                      timeout: float = AI_QUEUE_TIMEOUT):
+        if not self.waiters and self._has_slot():
+            self.in_flight += 1
+            AI_QUEUE_WAIT.observe(0, provider=self.provider)
+            return
+        if self.depth >= AI_QUEUE_SIZE:
+            raise QueueTimeout(f"{self.provider} queue is full")
+
+        waiter = _Waiter(user_id)
+        self.waiters.setdefault(user_id, deque()).append(waiter)
+        self._schedule_wake()
+        deadline = time.perf_counter() + timeout
+        reported = None
+        try:
+            while True:
+                if on_position is not None:
+                    position = self.position(waiter)
+                    if position != reported:
+                        reported = position
+                        try:
+                            await on_position(position)
+                        except Exception as e:
+                            logger.debug(f"Queue position update failed: {e}")
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise QueueTimeout(f"Waited {timeout:g}s for a {self.provider} slot")
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(waiter.future), timeout=min(POSITION_INTERVAL, remaining)
+                    )
+                    break
+                except asyncio.TimeoutError:
+                    if waiter.future.done():
+                        break
+        except BaseException:
+            self._discard(waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just as we gave up: hand the slot on
+                self.in_flight -= 1
+                self._wake()
+            raise
+        AI_QUEUE_WAIT.observe(time.perf_counter() - waiter.queued_at, provider=self.provider)
+
+    def release(self, ok: bool, status: Optional[int] = None, retry_after: Optional[str] = None):
+        """Free the slot and adapt the limit to how the provider answered"""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if status == 429:
+            AI_THROTTLED.inc(provider=self.provider)
+            if now - self.last_decrease >= DECREASE_INTERVAL:
+                self.last_decrease = now
+                self.limit = max(1.0, self.limit / 2)
+                logger.warning(f"{self.provider} throttled, in-flight limit now {int(self.limit)}")
+            delay = parse_retry_after(retry_after)
+            self.blocked_until = max(self.blocked_until, now + (delay if delay is not None else DEFAULT_RETRY_AFTER))
+        elif ok:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        self._wake()
+
+    def _discard(self, waiter: _Waiter):
+        queue = self.waiters.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.waiters[waiter.user_id]
+
+    def _schedule_wake(self):
+        """Admit what fits now, or try again once a Retry-After block lifts"""
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            if self._wake_handle is None:
+                self._wake_handle = asyncio.get_running_loop().call_later(delay, self._on_unblocked)
+        else:
+            self._wake()
+
+    def _on_unblocked(self):
+        self._wake_handle = None
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self._has_slot():
+            # Round-robin: take the head user's oldest request, move that user to the back
+            user_id, queue = next(iter(self.waiters.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.waiters.move_to_end(user_id)
+            else:
+                del self.waiters[user_id]
+            if waiter.future.done():
+                continue
+            self.in_flight += 1
+            waiter.future.set_result(None)
+        if self.waiters and time.monotonic() < self.blocked_until:
+            self._schedule_wake()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "depth": self.depth,
+            "blocked_for": max(0.0, round(self.blocked_until - time.monotonic(), 1)),
+        }
+
+
+class AdmissionController:
+    """ProviderLimiter per (provider, API key)"""
+
+    def __init__(self):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+        self.provider_limits = self._parse_limits(AI_PROVIDER_LIMITS)
+        self.learned: Dict[str, float] = {}  # limits from before a restart, applied on first use
+
+    @staticmethod
+    def _parse_limits(spec: str) -> Dict[str, int]:
+        limits = {}
+        for item in spec.split(','):
+            provider, _, value = item.partition('=')
+            if provider.strip() and value.strip().isdigit():
+                limits[provider.strip().lower()] = int(value)
+        return limits
+
+    def limiter(self, provider: str, api_key: str) -> ProviderLimiter:
+        # Keys never appear in metrics or logs, only a short digest
+        digest = hashlib.blake2b(api_key.encode(), digest_size=4).hexdigest()
+        name = f"{provider}:{digest}"
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = self.limiters[name] = ProviderLimiter(
+                provider, digest, self.provider_limits.get(provider, AI_MAX_IN_FLIGHT)
+            )
+            if name in self.learned:
+                limiter.limit = max(1.0, min(float(limiter.max_limit), self.learned.pop(name)))
+            AI_QUEUE_DEPTH.set_function(lambda: limiter.depth, provider=provider, key=digest)
+            AI_LIMIT.set_function(lambda: int(limiter.limit), provider=provider, key=digest)
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+    def snapshot(self) -> Dict[str, float]:
+        """Adapted in-flight limits by provider:key digest (never the key itself)"""
+        return {**self.learned, **{name: limiter.limit for name, limiter in self.limiters.items()}}
+
+    def restore(self, state: Dict[str, float]):
+        self.learned.update(state)
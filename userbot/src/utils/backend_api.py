@@ -1,22 +1,42 @@
 """Backend API client for userbot"""
 import aiohttp
+import asyncio
 import json
-from typing import Dict, Any, Optional
-from ..config import BACKEND_URL, WEBHOOK_SECRET
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+from ..config import BACKEND_URL, WEBHOOK_SECRET, BACKEND_FLUSH_TIMEOUT, BACKEND_OUTBOX_SIZE
 from ..utils.logger import get_logger
+from ..utils.metrics import REGISTRY, BACKEND_REQUEST, BACKEND_ERRORS, endpoint_label
+from ..utils.tracing import span
+from ..utils.serialization import dumps, loads
 
 logger = get_logger(__name__)
 
+
+def _retryable(result: Dict[str, Any]) -> bool:
+    """Failures worth resending later: network errors, 5xx and 429 (not other 4xx or local errors)"""
+    if result.get("permanent"):
+        return False
+    status = result.get("status")
+    return status is None or status >= 500 or status == 429
+
 class BackendAPI:
     def __init__(self, base_url: str, webhook_secret: str):
         self.base_url = base_url
         self.webhook_secret = webhook_secret
         self.session = None
+        # Log events the backend couldn't take yet, oldest first: (endpoint, payload)
+        self.outbox = deque(maxlen=BACKEND_OUTBOX_SIZE)
+        outbox_depth = REGISTRY.gauge("tgsecret_backend_outbox_depth", "Backend events waiting to be resent")
+        outbox_depth.set_function(lambda: len(self.outbox))
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
     
     async def _ensure_session(self):
         """Ensure aiohttp session exists"""
         if not self.session:
-            self.session = aiohttp.ClientSession()
+            self.session = aiohttp.ClientSession(json_serialize=dumps)
     
     async def _request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
         """Make HTTP request to backend"""
@@ -28,18 +48,75 @@ class BackendAPI:
         }
         
         url = f"{self.base_url}{endpoint}"
+        label = endpoint_label(endpoint)
+        start = time.perf_counter()
         
         try:
-            async with self.session.request(method, url, json=data, headers=headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Backend API error: {response.status} - {error_text}")
-                    return {"success": False, "error": f"API error: {response.status}"}
-        except Exception as e:
+            with span(f"backend {method} {label}") as current:
+                async with self.session.request(method, url, json=data, headers=headers) as response:
+                    if current:
+                        current.set(status=response.status)
+                    if response.status == 200:
+                        # The backend is reachable again: resend what it missed
+                        if self.outbox and not (self._flush_task and not self._flush_task.done()):
+                            self._flush_task = asyncio.create_task(self.flush())
+                        return loads(await response.read())
+                    else:
+                        error_text = await response.text()
+                        logger.error(f"Backend API error: {response.status} - {error_text}")
+                        BACKEND_ERRORS.inc(endpoint=label, method=method)
+                        return {"success": False, "error": f"API error: {response.status}", "status": response.status}
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
             logger.error(f"Backend API request failed: {e}")
+            BACKEND_ERRORS.inc(endpoint=label, method=method)
             return {"success": False, "error": str(e)}
+        except Exception as e:
+            # Not a transport failure (e.g. a payload that doesn't serialize): resending won't help
+            logger.error(f"Backend API request to {label} failed permanently: {e!r}")
+            BACKEND_ERRORS.inc(endpoint=label, method=method)
+            return {"success": False, "error": str(e), "permanent": True}
+        finally:
+            BACKEND_REQUEST.observe(time.perf_counter() - start, endpoint=label, method=method)
+    
+    async def _emit(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a log event, keeping it in the outbox for a later flush if the backend is unavailable"""
+        result = await self._request("POST", endpoint, payload)
+        if not result.get("success") and _retryable(result):
+            if len(self.outbox) == self.outbox.maxlen:
+                logger.warning(f"Backend outbox full, dropping oldest event ({self.outbox[0][0]})")
+            self.outbox.append((endpoint, payload))
+        return result
+    
+    async def flush(self, timeout: float = BACKEND_FLUSH_TIMEOUT) -> int:
+        """Resend outbox events in order until it's empty, the backend is unavailable again
+        or timeout passes; events that fail permanently are dropped. Returns how many are
+        still pending"""
+        async def send_all():
+            async with self._flush_lock:
+                while self.outbox:
+                    endpoint, payload = self.outbox[0]
+                    result = await self._request("POST", endpoint, payload)
+                    if not result.get("success"):
+                        if _retryable(result):
+                            return
+                        logger.warning(f"Dropping backend event {endpoint}: {result.get('error')}")
+                    self.outbox.popleft()
+        
+        if self.outbox:
+            try:
+                await asyncio.wait_for(send_all(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self.outbox:
+                logger.warning(f"{len(self.outbox)} backend event(s) still pending after flush")
+        return len(self.outbox)
+    
+    def pending_events(self) -> List[List[Any]]:
+        return [[endpoint, payload] for endpoint, payload in self.outbox]
+    
+    def restore_events(self, events: List[List[Any]]):
+        for endpoint, payload in events:
+            self.outbox.append((endpoint, payload))
     
     async def update_session_status(self, user_id: str, is_active: bool) -> Dict[str, Any]:
         """Update userbot session status"""
@@ -48,33 +125,58 @@ class BackendAPI:
             "isActive": is_active
         })
     
+    async def get_sessions(self) -> list:
+        """Get session strings of the accounts this host should run"""
+        result = await self._request("GET", "/session/list")
+        return result.get("sessions", []) if result.get("success") else []
+    
     async def get_user_api_key(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user's AI API key configuration"""
         result = await self._request("GET", f"/api-keys/user/{user_id}")
         return result if result.get("success") else None
     
+    async def create_data_key(self) -> Dict[str, Any]:
+        """New storage data key: {"key": hex, "wrapped": {encrypted, iv, authTag}}"""
+        return await self._request("POST", "/crypto/data-key")
+    
+    async def unwrap_data_key(self, wrapped: Dict[str, str]) -> Dict[str, Any]:
+        """Plaintext of a storage data key wrapped by the backend: {"key": hex}"""
+        return await self._request("POST", "/crypto/unwrap", {"wrapped": wrapped})
+    
     async def log_saved_media(self, user_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Log saved media to backend"""
-        return await self._request("POST", "/media/log", {
+        return await self._emit("/media/log", {
             "userId": user_id,
             **metadata
         })
     
     async def log_story(self, user_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Log downloaded story to backend"""
-        return await self._request("POST", "/stories/log", {
+        return await self._emit("/stories/log", {
             "userId": user_id,
             **metadata
         })
     
-    async def log_ai_usage(self, user_id: str, provider: str, prompt_tokens: int, response_tokens: int) -> Dict[str, Any]:
-        """Log AI usage to backend"""
-        return await self._request("POST", "/ai/usage", {
+    async def log_ai_usage(
+        self,
+        user_id: str,
+        provider: str,
+        prompt_tokens: int,
+        response_tokens: int,
+        routing: Optional[Dict[str, Any]] = None,
+        cached_tokens: int = 0
+    ) -> Dict[str, Any]:
+        """Log AI token usage (and failover/hedging stats when given) to backend"""
+        payload = {
             "userId": user_id,
             "provider": provider,
             "promptTokens": prompt_tokens,
-            "responseTokens": response_tokens
-        })
+            "responseTokens": response_tokens,
+            "cachedTokens": cached_tokens
+        }
+        if routing:
+            payload["routing"] = routing
+        return await self._emit("/ai/usage", payload)
     
     async def get_required_channels(self) -> list:
         """Get list of force-subscribe channels"""
@@ -90,5 +192,7 @@ class BackendAPI:
     
     async def close(self):
         """Close aiohttp session"""
+        if self._flush_task:
+            self._flush_task.cancel()
         if self.session:
             await self.session.close()
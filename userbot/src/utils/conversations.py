@@ -0,0 +1,269 @@
+"""Per-chat `.ask` conversation memory
+
+Threads belong to the account that asked (accounts in a multi-account host
+share the store), so two accounts in the same chat never see each other's
+history.
+
+Recent threads are kept in memory (LRU) and persisted to SQLite so they survive
+restarts. Each thread is bounded by a token budget: once a thread goes over it,
+the oldest turns are folded into a short extractive summary. Folding is done in
+one step down to well under the budget, so the summary and the older turns stay
+the same over the next several turns. Providers can cache that stable prefix.
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import (
+    AI_CONTEXT_TOKENS, AI_CONVERSATION_CACHE, AI_CONVERSATION_TTL,
+    AI_SUMMARY_TOKENS, CONVERSATIONS_PATH
+)
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SCHEMA_VERSION = 2  # 2: threads and links scoped by account
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    account_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_chat ON conversations(account_id, chat_id, updated_at);
+
+CREATE TABLE IF NOT EXISTS turns (
+    conversation_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    response TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS links (
+    account_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    PRIMARY KEY (account_id, chat_id, message_id)
+);
+"""
+
+FOLD_TARGET = 0.6  # fold down to this share of the budget so the prefix stays put for a while
+SUMMARY_PROMPT_CHARS = 200
+SUMMARY_RESPONSE_CHARS = 400
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting only"""
+    return len(text) // 4 + 1
+
+
+class Conversation:
+    def __init__(self, account_id: int, chat_id: int, id: Optional[int] = None, summary: str = "",
+                 turns: Optional[List[Tuple[int, str, str]]] = None, updated_at: float = 0.0):
+        self.id = id
+        self.account_id = account_id
+        self.chat_id = chat_id
+        self.summary = summary
+        self.turns: List[Tuple[int, str, str]] = turns or []  # (seq, prompt, response)
+        self.updated_at = updated_at
+
+    @property
+    def next_seq(self) -> int:
+        return self.turns[-1][0] + 1 if self.turns else 0
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(prompt) + estimate_tokens(response) for _, prompt, response in self.turns
+        )
+
+    def system_prompt(self) -> str:
+        if not self.summary:
+            return ""
+        return "Summary of the earlier part of this conversation:\n" + self.summary
+
+    def messages(self, prompt: str) -> List[Dict[str, str]]:
+        """History plus the new question as user/assistant messages"""
+        messages = []
+        for _, past_prompt, response in self.turns:
+            messages.append({"role": "user", "content": past_prompt})
+            messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+
+def _summarize_turn(prompt: str, response: str) -> str:
+    def clip(text: str, limit: int) -> str:
+        text = " ".join(text.split())
+        return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+    return f"Q: {clip(prompt, SUMMARY_PROMPT_CHARS)}\nA: {clip(response, SUMMARY_RESPONSE_CHARS)}"
+
+
+class ConversationStore:
+    def __init__(self, db_path: Path = CONVERSATIONS_PATH, budget: int = AI_CONTEXT_TOKENS):
+        self.db_path = Path(db_path)
+        self.budget = budget
+        self.cache: "OrderedDict[int, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                # Threads from before per-account scoping can't be attributed to an account
+                conn.executescript(
+                    "DROP TABLE IF EXISTS turns; DROP TABLE IF EXISTS links; DROP TABLE IF EXISTS conversations;"
+                )
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, conversation: Conversation):
+        self.cache[conversation.id] = conversation
+        self.cache.move_to_end(conversation.id)
+        while len(self.cache) > AI_CONVERSATION_CACHE:
+            self.cache.popitem(last=False)
+
+    async def resolve(self, account_id: int, chat_id: int, reply_to_id: Optional[int] = None) -> Conversation:
+        """The account's thread a replied-to message belongs to, else its recent thread
+        in the chat, else a new one"""
+        return await asyncio.to_thread(self._resolve_sync, account_id, chat_id, reply_to_id)
+
+    def _resolve_sync(self, account_id: int, chat_id: int, reply_to_id: Optional[int]) -> Conversation:
+        with self._lock:
+            conn = self._connect()
+            row = None
+            if reply_to_id:
+                row = conn.execute(
+                    "SELECT conversation_id FROM links WHERE account_id = ? AND chat_id = ? AND message_id = ?",
+                    (account_id, chat_id, reply_to_id)
+                ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT id FROM conversations WHERE account_id = ? AND chat_id = ? AND updated_at >= ? "
+                    "ORDER BY updated_at DESC LIMIT 1",
+                    (account_id, chat_id, time.time() - AI_CONVERSATION_TTL)
+                ).fetchone()
+            if row is None:
+                return Conversation(account_id, chat_id)
+
+            conversation_id = row[0]
+            if conversation_id in self.cache:
+                conversation = self.cache[conversation_id]
+            else:
+                summary, updated_at = conn.execute(
+                    "SELECT summary, updated_at FROM conversations WHERE id = ?", (conversation_id,)
+                ).fetchone()
+                turns = conn.execute(
+                    "SELECT seq, prompt, response FROM turns WHERE conversation_id = ? ORDER BY seq",
+                    (conversation_id,)
+                ).fetchall()
+                conversation = Conversation(account_id, chat_id, conversation_id, summary, list(turns), updated_at)
+            self._remember(conversation)
+            return conversation
+
+    async def append(self, conversation: Conversation, prompt: str, response: str):
+        """Record a finished turn, folding old turns into the summary when over budget"""
+        await asyncio.to_thread(self._append_sync, conversation, prompt, response)
+
+    def _append_sync(self, conversation: Conversation, prompt: str, response: str):
+        with self._lock:
+            conn = self._connect()
+            conversation.updated_at = time.time()
+            if conversation.id is None:
+                conversation.id = conn.execute(
+                    "INSERT INTO conversations (account_id, chat_id, summary, updated_at) VALUES (?, ?, '', ?)",
+                    (conversation.account_id, conversation.chat_id, conversation.updated_at)
+                ).lastrowid
+            seq = conversation.next_seq
+            conversation.turns.append((seq, prompt, response))
+            conn.execute(
+                "INSERT INTO turns (conversation_id, seq, prompt, response) VALUES (?, ?, ?, ?)",
+                (conversation.id, seq, prompt, response)
+            )
+            folded = self._fold(conversation)
+            if folded:
+                conn.execute(
+                    "DELETE FROM turns WHERE conversation_id = ? AND seq <= ?",
+                    (conversation.id, folded)
+                )
+            conn.execute(
+                "UPDATE conversations SET summary = ?, updated_at = ? WHERE id = ?",
+                (conversation.summary, conversation.updated_at, conversation.id)
+            )
+            conn.commit()
+            self._remember(conversation)
+
+    def _fold(self, conversation: Conversation) -> Optional[int]:
+        """Move the oldest turns into the summary; returns the last folded seq"""
+        if conversation.tokens() <= self.budget:
+            return None
+        folded = None
+        lines = [conversation.summary] if conversation.summary else []
+        # Always keep the latest turn verbatim
+        while len(conversation.turns) > 1 and conversation.tokens() > self.budget * FOLD_TARGET:
+            seq, prompt, response = conversation.turns.pop(0)
+            lines.append(_summarize_turn(prompt, response))
+            folded = seq
+            summary = "\n".join(lines)
+            while len(lines) > 1 and estimate_tokens(summary) > AI_SUMMARY_TOKENS:
+                lines.pop(0)
+                summary = "\n".join(lines)
+            conversation.summary = summary
+        return folded
+
+    async def link(self, conversation: Conversation, message_ids: Iterable[int]):
+        """Map Telegram messages to the thread so replying to them continues it"""
+        if conversation.id is None:
+            return
+        rows = [
+            (conversation.account_id, conversation.chat_id, message_id, conversation.id)
+            for message_id in message_ids
+        ]
+        await asyncio.to_thread(self._link_sync, rows)
+
+    def _link_sync(self, rows: List[Tuple[int, int, int, int]]):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO links (account_id, chat_id, message_id, conversation_id) "
+                "VALUES (?, ?, ?, ?)", rows
+            )
+            conn.commit()
+
+    async def forget(self, account_id: int, chat_id: int) -> int:
+        """Drop every thread the account has in a chat; returns how many were removed"""
+        return await asyncio.to_thread(self._forget_sync, account_id, chat_id)
+
+    def _forget_sync(self, account_id: int, chat_id: int) -> int:
+        with self._lock:
+            conn = self._connect()
+            scope = (account_id, chat_id)
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM conversations WHERE account_id = ? AND chat_id = ?", scope
+            )]
+            for conversation_id in ids:
+                conn.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+                self.cache.pop(conversation_id, None)
+            conn.execute("DELETE FROM links WHERE account_id = ? AND chat_id = ?", scope)
+            conn.execute("DELETE FROM conversations WHERE account_id = ? AND chat_id = ?", scope)
+            conn.commit()
+            return len(ids)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,182 @@
+"""Thumbnail, poster and waveform derivatives generated in a process pool"""
+import array
+import asyncio
+import json
+import os
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+from ..config import (
+    STORAGE_PATH, SUPPORTED_MEDIA_TYPES,
+    DERIVATIVE_WORKERS, THUMBNAIL_SIZE, WAVEFORM_POINTS
+)
+from ..utils.logger import get_logger
+from ..utils.storage import MediaStorage, ARCHIVE_DIRS, DERIVATIVE_SUFFIXES, STORED_SUFFIXES, is_derivative
+
+logger = get_logger(__name__)
+
+
+def derivative_path(file_path, kind: str) -> Path:
+    file_path = Path(file_path)
+    return file_path.with_name(file_path.name + DERIVATIVE_SUFFIXES[kind])
+
+
+def derivative_kinds(media_type: str, file_path) -> tuple:
+    """Which derivatives make sense for a media item"""
+    ext = Path(file_path).suffix.lower()
+    if media_type == "photo" or ext in SUPPORTED_MEDIA_TYPES['photo']:
+        return ("thumbnail",)
+    if media_type in ("video", "video_note") or ext in SUPPORTED_MEDIA_TYPES['video']:
+        return ("poster",)
+    if media_type in ("audio", "voice") or ext in SUPPORTED_MEDIA_TYPES['audio']:
+        return ("waveform",)
+    return ()
+
+
+# ---- Workers (run in child processes, must stay module-level) ----------
+
+def _save_webp(image, target: str, size: int):
+    from PIL import Image
+
+    image.thumbnail((size, size), Image.LANCZOS)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    partial = target + ".part"
+    image.save(partial, "WEBP", quality=70, method=4)
+    os.replace(partial, target)
+
+
+def _make_thumbnail(source: str, target: str, size: int):
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image.seek(0)
+        _save_webp(image.copy(), target, size)
+
+
+def _make_poster(source: str, target: str, size: int):
+    from PIL import Image
+    from moviepy.editor import VideoFileClip
+
+    clip = VideoFileClip(source, audio=False)
+    try:
+        # A frame a little into the clip avoids black intro frames
+        frame = clip.get_frame(min(1.0, (clip.duration or 0) / 2))
+    finally:
+        clip.close()
+    _save_webp(Image.fromarray(frame), target, size)
+
+
+def _read_samples(source: str):
+    """Mono samples as a flat sequence plus the sample rate"""
+    if source.lower().endswith('.wav'):
+        with wave.open(source, 'rb') as wav:
+            if wav.getsampwidth() == 2:
+                samples = array.array('h', wav.readframes(wav.getnframes()))
+                channels = wav.getnchannels()
+                return samples[::channels], wav.getframerate(), 32768.0
+
+    from moviepy.editor import AudioFileClip
+
+    fps = 8000
+    clip = AudioFileClip(source, fps=fps)
+    try:
+        sound = clip.to_soundarray(fps=fps)
+    finally:
+        clip.close()
+    if sound.ndim > 1:
+        sound = sound.mean(axis=1)
+    return sound, fps, 1.0
+
+
+def _make_waveform(source: str, target: str, points: int):
+    samples, rate, scale = _read_samples(source)
+    count = len(samples)
+    bucket = max(1, count // points)
+    peaks = []
+    for start in range(0, count, bucket):
+        chunk = samples[start:start + bucket]
+        peaks.append(round(max(abs(float(s)) for s in chunk) / scale, 3) if len(chunk) else 0.0)
+
+    partial = target + ".part"
+    with open(partial, 'w') as f:
+        json.dump({"duration": round(count / rate, 2), "peaks": peaks[:points]}, f)
+    os.replace(partial, target)
+
+
+WORKERS = {
+    "thumbnail": (_make_thumbnail, THUMBNAIL_SIZE),
+    "poster": (_make_poster, THUMBNAIL_SIZE),
+    "waveform": (_make_waveform, WAVEFORM_POINTS),
+}
+
+
+class DerivativePipeline:
+    def __init__(self, storage: Optional[MediaStorage] = None, workers: int = DERIVATIVE_WORKERS):
+        self.storage = storage or MediaStorage()
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def generate(self, file_path, media_type: str = "", force: bool = False,
+                       source=None) -> Dict[str, str]:
+        """Generate derivatives for a file; existing up-to-date ones are reused
+
+        `source` is the plaintext to read when file_path is not stored yet (it is
+        about to be encrypted). Derivatives are encrypted too when storage is.
+        """
+        file_path = Path(file_path)
+        source = Path(source or file_path)
+        loop = asyncio.get_running_loop()
+        results = {}
+
+        for kind in derivative_kinds(media_type, file_path):
+            target = derivative_path(file_path, kind)
+            existing = self.storage.resolve(target)
+            if not force and existing and existing.stat().st_mtime >= source.stat().st_mtime:
+                results[kind] = str(target)
+                continue
+
+            worker, arg = WORKERS[kind]
+            try:
+                # Previews are built before the original is stored, so its folder may not exist yet
+                target.parent.mkdir(parents=True, exist_ok=True)
+                await loop.run_in_executor(self._pool(), worker, str(source), str(target), arg)
+                if self.storage.encrypt:
+                    await self.storage.store(target, target)
+                results[kind] = str(target)
+            except Exception as e:
+                logger.error(f"Error generating {kind} for {file_path}: {e}")
+
+        return results
+
+    async def backfill(self, root: Path = STORAGE_PATH, force: bool = False) -> int:
+        """Generate missing derivatives for everything already archived"""
+        generated = 0
+        for base in (Path(root), self.storage.cold_root):
+            for archive_dir in ARCHIVE_DIRS:
+                tree = base / archive_dir
+                if not tree.exists():
+                    continue
+                files = await asyncio.to_thread(
+                    lambda: [p for p in tree.rglob('*') if p.is_file() and not is_derivative(p)]
+                )
+                for path in files:
+                    if path.name.endswith(STORED_SUFFIXES + ('.part',)):
+                        continue  # Compressed or encrypted items got their previews when saved
+                    if await self.generate(path, force=force):
+                        generated += 1
+
+        logger.info(f"Derivative backfill processed {generated} files")
+        return generated
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
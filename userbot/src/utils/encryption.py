@@ -0,0 +1,257 @@
+"""Chunked AES-256-GCM encryption at rest for archived media
+
+File layout: a 28-byte header (magic, key id, chunk size, nonce prefix)
+followed by chunks of ciphertext plus a 16-byte tag. Each chunk's nonce is the
+random per-file prefix plus the chunk index. The header, the index and a
+final-chunk flag are authenticated as associated data, so chunks can't be
+reordered, swapped between files or truncated away unnoticed.
+
+Any chunk can be located and decrypted on its own, so seeks, range reads and
+exports only decrypt the chunks they touch. Data keys are issued and wrapped by
+the backend's crypto module. Only the wrapped form is kept on disk, in
+STORAGE_KEY_FILE.
+"""
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import os
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # Only needed when STORAGE_ENCRYPTION is on
+    AESGCM = None
+    InvalidTag = ValueError
+
+from ..config import STORAGE_CHUNK_SIZE, STORAGE_ENCRYPTION_KEY, STORAGE_KEY_FILE
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MAGIC = b"TGSENC01"
+HEADER = struct.Struct(">8s8sI8s")  # magic, key id, chunk size, nonce prefix
+TAG_SIZE = 16
+ENCRYPTED_SUFFIX = ".enc"
+
+
+class DecryptionError(IOError):
+    """A chunk failed authentication (wrong key, corruption or tampering)"""
+
+
+def key_id(key: bytes) -> bytes:
+    return hashlib.sha256(key).digest()[:8]
+
+
+class StorageKeyring:
+    """Data keys by id; the newest one encrypts, any known one decrypts"""
+
+    def __init__(self, key_file: Path = STORAGE_KEY_FILE):
+        self.key_file = Path(key_file)
+        self.ciphers: Dict[bytes, "AESGCM"] = {}
+        self.current: Optional[bytes] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.current is not None
+
+    def add(self, key: bytes) -> bytes:
+        if AESGCM is None:
+            raise RuntimeError("cryptography is required for STORAGE_ENCRYPTION")
+        if len(key) != 32:
+            raise ValueError("Storage keys must be 32 bytes")
+        kid = key_id(key)
+        self.ciphers[kid] = AESGCM(key)
+        self.current = kid
+        return kid
+
+    def cipher(self, kid: bytes) -> "AESGCM":
+        try:
+            return self.ciphers[kid]
+        except KeyError:
+            raise DecryptionError(f"Unknown storage key {kid.hex()}") from None
+
+    async def load(self, backend) -> None:
+        """Unwrap the stored data keys through the backend, creating the first one if needed"""
+        if STORAGE_ENCRYPTION_KEY:
+            self.add(bytes.fromhex(STORAGE_ENCRYPTION_KEY))
+            logger.info("Storage encryption key loaded from STORAGE_ENCRYPTION_KEY")
+            return
+
+        # Supervisor shards start together; the lock makes sure only the first creates a key
+        async with self._locked():
+            entries = self._read()
+            for entry in entries:
+                result = await backend.unwrap_data_key(entry["wrapped"])
+                if not result.get("success"):
+                    raise RuntimeError(f"Backend could not unwrap storage key {entry['id']}: {result.get('error')}")
+                self.add(bytes.fromhex(result["key"]))
+
+            if not entries:
+                result = await backend.create_data_key()
+                if not result.get("success"):
+                    raise RuntimeError(f"Backend could not issue a storage key: {result.get('error')}")
+                kid = self.add(bytes.fromhex(result["key"]))
+                self._save([{"id": kid.hex(), "wrapped": result["wrapped"]}])
+        logger.info(f"Storage encryption enabled with key {self.current.hex()}")
+
+    @contextlib.asynccontextmanager
+    async def _locked(self):
+        """Exclusive lock on the key file, shared by every process using it"""
+        self.key_file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.key_file.with_name(self.key_file.name + ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _read(self):
+        return json.loads(self.key_file.read_text())["keys"] if self.key_file.exists() else []
+
+    def _save(self, entries):
+        """Add entries to the key file; keys already in it are kept"""
+        merged = {entry["id"]: entry for entry in self._read()}
+        for entry in entries:
+            merged.setdefault(entry["id"], entry)
+        partial = self.key_file.with_name(self.key_file.name + ".part")
+        partial.write_text(json.dumps({"keys": list(merged.values())}, indent=2))
+        os.chmod(partial, 0o600)
+        os.replace(partial, self.key_file)
+
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+
+def _aad(header: bytes, index: int, last: bool) -> bytes:
+    return header + struct.pack(">I?", index, last)
+
+
+class EncryptedWriter(io.RawIOBase):
+    """Encrypts whatever is written to it, one chunk at a time, as it streams to `raw`"""
+
+    def __init__(self, raw: BinaryIO, keyring: StorageKeyring, chunk_size: int = STORAGE_CHUNK_SIZE):
+        super().__init__()
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.cipher = keyring.cipher(keyring.current)
+        self.header = HEADER.pack(MAGIC, keyring.current, chunk_size, os.urandom(8))
+        self.prefix = self.header[-8:]
+        self.buffer = bytearray()
+        self.index = 0
+        raw.write(self.header)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        # Keep the tail buffered: only close() knows which chunk is the last
+        while len(self.buffer) > self.chunk_size:
+            self._seal(bytes(self.buffer[:self.chunk_size]), last=False)
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _seal(self, chunk: bytes, last: bool):
+        self.raw.write(self.cipher.encrypt(
+            _nonce(self.prefix, self.index), chunk, _aad(self.header, self.index, last)
+        ))
+        self.index += 1
+
+    def close(self):
+        if not self.closed:
+            self._seal(bytes(self.buffer), last=True)
+            self.buffer.clear()
+            self.raw.close()
+        super().close()
+
+
+class EncryptedReader(io.RawIOBase):
+    """Seekable plaintext view of an encrypted file; decrypts only the chunks read"""
+
+    def __init__(self, path, keyring: StorageKeyring):
+        super().__init__()
+        self.raw = open(path, "rb")
+        try:
+            self.header = self.raw.read(HEADER.size)
+            magic, kid, self.chunk_size, self.prefix = HEADER.unpack(self.header)
+            if magic != MAGIC:
+                raise DecryptionError(f"{path} is not an encrypted archive file")
+            self.cipher = keyring.cipher(kid)
+            body = os.fstat(self.raw.fileno()).st_size - HEADER.size
+            self.chunks, self.size = self._layout(body)
+        except Exception:
+            self.raw.close()
+            raise
+        self.position = 0
+        self._cached: Tuple[int, bytes] = (-1, b"")
+
+    def _layout(self, body: int) -> Tuple[int, int]:
+        """Chunk count and plaintext size from the ciphertext length"""
+        stride = self.chunk_size + TAG_SIZE
+        chunks = max(1, -(-body // stride))
+        last = body - (chunks - 1) * stride
+        if last < TAG_SIZE:
+            raise DecryptionError("Encrypted file is truncated")
+        return chunks, (chunks - 1) * self.chunk_size + last - TAG_SIZE
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self.position = offset
+        return offset
+
+    def _chunk(self, index: int) -> bytes:
+        if self._cached[0] == index:
+            return self._cached[1]
+        stride = self.chunk_size + TAG_SIZE
+        self.raw.seek(HEADER.size + index * stride)
+        sealed = self.raw.read(stride)
+        try:
+            chunk = self.cipher.decrypt(
+                _nonce(self.prefix, index), sealed, _aad(self.header, index, index == self.chunks - 1)
+            )
+        except InvalidTag:
+            raise DecryptionError(f"Chunk {index} of {self.raw.name} failed authentication") from None
+        self._cached = (index, chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+        index, start = divmod(self.position, self.chunk_size)
+        chunk = self._chunk(index)
+        count = min(len(buffer), len(chunk) - start)
+        buffer[:count] = chunk[start:start + count]
+        self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+def open_encrypted(path, keyring: StorageKeyring) -> BinaryIO:
+    reader = EncryptedReader(path, keyring)
+    return io.BufferedReader(reader, buffer_size=reader.chunk_size)
+
@@ -0,0 +1,351 @@
+"""Streaming tar/zip export of archived media
+
+Archives are generated on the fly from MediaStorage reads. Nothing is staged in
+memory or on temp disk. Tar output is fully deterministic and its size is known
+before streaming. A transfer can therefore resume at any byte offset: whole
+entries before the offset are skipped without being read. Zip output streams too
+(stored entries with data descriptors), but resuming it regenerates and discards
+the bytes before the offset, because the central directory needs every CRC.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+from ..config import EXPORT_PATH, STORAGE_PATH, WEBHOOK_SECRET
+from ..utils.logger import get_logger
+from ..utils.media_index import MediaIndex, hash_file, parse_find_query
+from ..utils.storage import MediaStorage
+
+logger = get_logger(__name__)
+
+FORMATS = ("tar", "zip")
+CHUNK_SIZE = 1024 * 1024
+BLOCK = tarfile.BLOCKSIZE
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FIELDS = ("kind", "media_type", "sender_id", "sender_username", "sender_name",
+                   "chat_id", "date", "size", "sha256", "caption")
+
+
+def parse_export_query(text: str) -> Tuple[Dict[str, Any], str]:
+    """`.find` syntax plus an optional `format:zip` (tar is the default)"""
+    fmt = "tar"
+    words = []
+    for token in text.split():
+        key, _, value = token.partition(':')
+        if key == 'format' and value:
+            fmt = value.lower()
+        else:
+            words.append(token)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt} (use tar or zip)")
+    return parse_find_query(" ".join(words)), fmt
+
+
+class ArchiveExport:
+    def __init__(self, storage: MediaStorage, manifest: Dict[str, Any], fmt: str = "tar"):
+        self.storage = storage
+        self.manifest = manifest
+        self.fmt = fmt
+        # Local paths are for reading only; the archive lists items by name
+        public = {**manifest, "items": [{k: v for k, v in item.items() if k != "path"} for item in manifest["items"]]}
+        self.manifest_bytes = json.dumps(public, indent=2, ensure_ascii=False, sort_keys=True).encode()
+        # Same selection, same bytes: clients use this as the If-Range validator
+        self.etag = hashlib.sha256(self.manifest_bytes + fmt.encode()).hexdigest()[:32]
+
+    @classmethod
+    async def create(cls, index: MediaIndex, storage: MediaStorage, query: Dict[str, Any],
+                     fmt: str = "tar") -> "ArchiveExport":
+        """Select items from the index and freeze them into a manifest"""
+        rows = await index.select(**query)
+        items = await asyncio.to_thread(cls._describe_items, storage, rows)
+        manifest = {
+            "format": 1,
+            "query": dict(query),
+            "count": len(items),
+            "bytes": sum(item["size"] for item in items),
+            "items": items,
+        }
+        return cls(storage, manifest, fmt)
+
+    @staticmethod
+    def _describe_items(storage: MediaStorage, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        items, names = [], set()
+        for row in rows:
+            path = Path(row["file_path"])
+            if storage.resolve(path) is None:
+                logger.warning(f"Skipping missing file in export: {path}")
+                continue
+            try:
+                name = path.relative_to(STORAGE_PATH).as_posix()
+            except ValueError:
+                name = f"other/{path.name}"
+            if name in names:
+                continue
+            names.add(name)
+            item = {"name": name, "path": str(path)}
+            item.update({field: row.get(field) for field in MANIFEST_FIELDS})
+            if item["size"] is None:
+                item.update(hash_file(storage, path))
+            items.append(item)
+        return items
+
+    @property
+    def items(self) -> List[Dict[str, Any]]:
+        return self.manifest["items"]
+
+    @property
+    def mtime(self) -> int:
+        return int(max((item["date"] or 0 for item in self.items), default=0))
+
+    @property
+    def filename(self) -> str:
+        return f"tgsecret-export-{self.etag[:12]}.{self.fmt}"
+
+    @property
+    def total_size(self) -> Optional[int]:
+        """Exact archive size (tar only; zip sizes depend on zip64 decisions made while writing)"""
+        if self.fmt != "tar":
+            return None
+        return sum(length for length, _ in self._tar_segments())
+
+    # ---- Tar ---------------------------------------------------------
+
+    def _tar_header(self, name: str, size: int, mtime: float) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    @staticmethod
+    def _padding(size: int) -> bytes:
+        return b"\0" * (-size % BLOCK)
+
+    def _tar_segments(self) -> Iterator[Tuple[int, Any]]:
+        """(length, bytes or manifest item) in archive order"""
+        segments = [self._tar_header(MANIFEST_NAME, len(self.manifest_bytes), self.mtime),
+                    self.manifest_bytes, self._padding(len(self.manifest_bytes))]
+        for data in segments:
+            yield len(data), data
+        for item in self.items:
+            header = self._tar_header(item["name"], item["size"], item["date"] or 0)
+            yield len(header), header
+            yield item["size"], item
+            padding = self._padding(item["size"])
+            yield len(padding), padding
+        end = b"\0" * (2 * BLOCK)
+        yield len(end), end
+
+    def _iter_tar(self, offset: int) -> Iterator[bytes]:
+        position = 0
+        for length, segment in self._tar_segments():
+            if position + length <= offset:
+                position += length
+                continue
+            skip = max(0, offset - position)
+            position += length
+            if isinstance(segment, bytes):
+                if segment[skip:]:
+                    yield segment[skip:]
+            else:
+                yield from self._read_item(segment, skip)
+
+    def _read_item(self, item: Dict[str, Any], skip: int = 0) -> Iterator[bytes]:
+        """Exactly item['size'] bytes from `skip` on, zero-padded if the file shrank"""
+        remaining = item["size"] - skip
+        with self.storage.open(item["path"]) as f:
+            try:
+                f.seek(skip)
+            except (OSError, ValueError, AttributeError):
+                # Compressed streams may not seek; read through instead
+                while skip:
+                    skipped = len(f.read(min(CHUNK_SIZE, skip)))
+                    if not skipped:
+                        break
+                    skip -= skipped
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        if remaining > 0:
+            logger.warning(f"{item['path']} is shorter than indexed, padding {remaining} bytes")
+            while remaining > 0:
+                yield b"\0" * min(CHUNK_SIZE, remaining)
+                remaining -= CHUNK_SIZE
+
+    # ---- Zip ---------------------------------------------------------
+
+    def _iter_zip(self, offset: int) -> Iterator[bytes]:
+        sink = _Sink()
+        position = 0
+
+        def drain() -> Iterator[bytes]:
+            nonlocal position
+            data = sink.take()
+            start = max(0, offset - position)
+            position += len(data)
+            if start < len(data):
+                yield data[start:]
+
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            archive.writestr(self._zip_info(MANIFEST_NAME, self.mtime), self.manifest_bytes)
+            yield from drain()
+            for item in self.items:
+                info = self._zip_info(item["name"], item["date"] or 0)
+                info.file_size = item["size"]
+                with archive.open(info, "w", force_zip64=item["size"] >= zipfile.ZIP64_LIMIT) as dest:
+                    for chunk in self._read_item(item):
+                        dest.write(chunk)
+                        yield from drain()
+                yield from drain()
+        yield from drain()
+
+    @staticmethod
+    def _zip_info(name: str, mtime: float) -> zipfile.ZipInfo:
+        date_time = time.localtime(max(mtime, 315532800))[:6]  # zip dates start in 1980
+        info = zipfile.ZipInfo(name, date_time)
+        info.external_attr = 0o644 << 16
+        return info
+
+    # ---- Output ------------------------------------------------------
+
+    def iter_chunks(self, offset: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Archive bytes [offset, end), or to the end of the archive when end is None"""
+        chunks = self._iter_tar(offset) if self.fmt == "tar" else self._iter_zip(offset)
+        position = offset
+        for chunk in chunks:
+            if end is not None and position + len(chunk) >= end:
+                yield chunk[:end - position]
+                return
+            position += len(chunk)
+            yield chunk
+
+    async def stream(self, offset: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """iter_chunks with the reads and decompression kept off the event loop"""
+        chunks = self.iter_chunks(offset, end)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            chunks.close()
+
+    async def to_file(self, path: Optional[Path] = None, resume: bool = True) -> Dict[str, Any]:
+        """Write the archive to a file, continuing a partial one from where it stopped"""
+        path = Path(path or EXPORT_PATH / self.filename)
+        return await asyncio.to_thread(self._to_file_sync, path, resume)
+
+    def _to_file_sync(self, path: Path, resume: bool) -> Dict[str, Any]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        offset = path.stat().st_size if resume and path.exists() else 0
+        total = self.total_size
+        if total is not None and offset > total:
+            offset = 0
+        with open(path, "ab" if offset else "wb") as f:
+            for chunk in self.iter_chunks(offset):
+                f.write(chunk)
+        return {
+            "path": str(path),
+            "items": self.manifest["count"],
+            "bytes": path.stat().st_size,
+            "resumed_from": offset,
+        }
+
+
+class _Sink:
+    """Write-only buffer zipfile streams into; drained after every write"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def parse_range(header: Optional[str], total: Optional[int]) -> Optional[Tuple[int, Optional[int]]]:
+    """(start, end exclusive) for a single `bytes=` range, None to send everything"""
+    if not header or total is None or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].partition("-")
+    try:
+        if not first:
+            start, end = max(0, total - int(last)), total
+        else:
+            start = int(first)
+            end = min(total, int(last) + 1) if last else total
+    except ValueError:
+        return None
+    if start >= total or start >= end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+async def start_export_server(host: str, port: int, index: MediaIndex, storage: MediaStorage) -> web.AppRunner:
+    """Serve GET /export?q=<.find query>&format=tar|zip with Range resume (tar)"""
+    async def handle_export(request: web.Request):
+        secret = request.headers.get("X-Webhook-Secret", "")
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            return web.json_response({"success": False, "error": "Unauthorized"}, status=401)
+        try:
+            query, fmt = parse_export_query(request.query.get("q", ""))
+            fmt = request.query.get("format", fmt)
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown format: {fmt}")
+        except ValueError as e:
+            return web.json_response({"success": False, "error": str(e)}, status=400)
+
+        export = await ArchiveExport.create(index, storage, query, fmt)
+        total = export.total_size
+        etag = f'"{export.etag}"'
+        if_range = request.headers.get("If-Range")
+        try:
+            byte_range = parse_range(request.headers.get("Range"), total) if if_range in (None, etag) else None
+        except ValueError:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+
+        start, end = byte_range or (0, total)
+        headers = {
+            "Content-Type": "application/x-tar" if fmt == "tar" else "application/zip",
+            "Content-Disposition": f'attachment; filename="{export.filename}"',
+            "ETag": etag,
+            "Accept-Ranges": "bytes" if total is not None else "none",
+        }
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+        response = web.StreamResponse(status=206 if byte_range else 200, headers=headers)
+        if total is not None:
+            response.content_length = end - start
+        await response.prepare(request)
+        async for chunk in export.stream(start, end):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/export", handle_export)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Export endpoint listening on http://{host}:{port}/export")
+    return runner
@@ -0,0 +1,153 @@
+"""Bounded priority job queue for media transfers"""
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Lower value runs first
+PRIORITY_AUTO = 0
+PRIORITY_MANUAL = 1
+
+JobFactory = Callable[[], Awaitable[Any]]
+# What's needed to redo a job after a restart, e.g. {"chat_id": ..., "message_id": ...}
+Checkpoint = Dict[str, Any]
+
+
+class JobInterrupted(Exception):
+    """The queue shut down before the job finished"""
+
+
+class MediaJobQueue:
+    def __init__(self, maxsize: int, workers: int):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[int, Tuple[Optional[asyncio.Future], Optional[Checkpoint]]] = {}
+        self.closed = False
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_queue(self) -> asyncio.PriorityQueue:
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+        return self.queue
+
+    def start(self):
+        """Start the worker pool"""
+        self.closed = False
+        queue = self._ensure_queue()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker(queue)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def drain(self, timeout: float) -> List[Checkpoint]:
+        """Stop taking jobs, give queued and in-flight ones `timeout` seconds to finish,
+        then stop the workers; returns the checkpoints of the jobs that didn't finish"""
+        self.closed = True
+        if self.queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Job queue didn't drain in {timeout:g}s "
+                    f"({self.in_flight} in flight, {self.queue.qsize()} queued)"
+                )
+        
+        unfinished = []
+        interrupted = JobInterrupted("Interrupted by shutdown, it will resume after the restart")
+        for future, checkpoint in list(self._running.values()):
+            if future and not future.done():
+                future.set_exception(interrupted)
+            if checkpoint:
+                unfinished.append(checkpoint)
+        while self.queue is not None and not self.queue.empty():
+            _, _, _, future, checkpoint = self.queue.get_nowait()
+            self.queue.task_done()
+            if future and not future.done():
+                future.set_exception(interrupted)
+            if checkpoint:
+                unfinished.append(checkpoint)
+        
+        await self.stop()
+        if unfinished:
+            logger.info(f"Checkpointed {len(unfinished)} unfinished job(s)")
+        return unfinished
+
+    def submit_nowait(
+        self, factory: JobFactory, priority: int = PRIORITY_AUTO, checkpoint: Optional[Checkpoint] = None
+    ) -> bool:
+        """Enqueue a fire-and-forget job, dropping it if the queue is full or shutting down"""
+        if self.closed:
+            logger.warning("Job queue is shutting down, dropped job")
+            return False
+        try:
+            self._ensure_queue().put_nowait((priority, next(self._sequence), factory, None, checkpoint))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Job queue full ({self.maxsize}), dropped job (total dropped: {self.dropped})")
+            return False
+
+    async def submit(
+        self, factory: JobFactory, priority: int = PRIORITY_MANUAL, checkpoint: Optional[Checkpoint] = None
+    ) -> Any:
+        """Enqueue a job and wait for its result; waits for room when the queue is full
+        
+        checkpoint identifies the job if it has to be redone after a restart.
+        """
+        if self.closed:
+            raise JobInterrupted("Shutting down, try again after the restart")
+        future = asyncio.get_running_loop().create_future()
+        await self._ensure_queue().put((priority, next(self._sequence), factory, future, checkpoint))
+        return await future
+
+    async def _worker(self, queue: asyncio.PriorityQueue):
+        while True:
+            _, sequence, factory, future, checkpoint = await queue.get()
+            self._running[sequence] = (future, checkpoint)
+            self.in_flight += 1
+            try:
+                result = await factory()
+                # Handlers report most failures as {"success": False, ...} rather than raising
+                if isinstance(result, dict) and result.get("success") is False:
+                    self.failed += 1
+                    logger.warning(f"Job failed: {result.get('error')}")
+                else:
+                    self.processed += 1
+                if future and not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if future and not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Job failed: {e}", exc_info=True)
+                if future and not future.done():
+                    future.set_exception(e)
+            finally:
+                self._running.pop(sequence, None)
+                self.in_flight -= 1
+                queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.queue.qsize() if self.queue else 0,
+            "capacity": self.maxsize,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
@@ -1,24 +1,145 @@
-"""Logger configuration for the userbot"""
+"""Logger configuration for the userbot
+
+Records are handed to a bounded queue on the calling thread and formatted and
+written (console, rotating file) by a background listener thread, so a log call
+never blocks the event loop on disk I/O or rotation.
+"""
+import atexit
 import logging
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Tuple
 import colorlog
 
-def setup_logger(name: str, log_file: Path, level: str = 'INFO'):
-    """Setup logger with console and file handlers"""
-    
-    # Create logger
-    logger = logging.getLogger(name)
-    logger.setLevel(getattr(logging, level.upper()))
-    
-    # Clear existing handlers
-    logger.handlers = []
-    
+try:
+    from pythonjsonlogger import jsonlogger
+except ImportError:  # JSON output is optional
+    jsonlogger = None
+
+# Loggers of the handler/utils modules live under the package name (src.*)
+PACKAGE_LOGGER = __name__.split('.')[0]
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args and render the traceback here; the listener thread
+        # applies the real formatters
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `limit` repeats of a warning or error through every `interval` seconds
+
+    Repeats are records from the same call site with the same message
+    template. Past the limit only every `sample`-th repeat is let through (0
+    lets none through); the rest are counted and reported on the first record
+    of the next window, e.g. a burst of "Error updating progress". Records
+    below `level` are never limited.
+    """
+
+    MAX_KEYS = 1000  # expired windows are pruned past this
+
+    def __init__(self, limit: int, interval: float = 60.0, sample: int = 0, level: int = logging.WARNING):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.sample = sample
+        self.level = level
+        self.suppressed = 0
+        self._windows: Dict[Tuple[str, int, str], list] = {}  # key -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0 or record.levelno < self.level:
+            return True
+
+        key = (record.pathname, record.lineno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                skipped = window[2] if window else 0
+                if window is None and len(self._windows) >= self.MAX_KEYS:
+                    self._prune(now)
+                self._windows[key] = [now, 1, 0]
+                if skipped:
+                    record.msg = f"{record.msg} (suppressed {skipped} similar in the last {self.interval:g}s)"
+                return True
+            window[1] += 1
+            if window[1] <= self.limit:
+                return True
+            if self.sample > 0 and (window[1] - self.limit) % self.sample == 0:
+                return True
+            window[2] += 1
+            self.suppressed += 1
+            return False
+
+    def _prune(self, now: float):
+        for key in [key for key, window in self._windows.items() if now - window[0] >= self.interval]:
+            del self._windows[key]
+
+
+def _file_formatter(json_output: bool) -> logging.Formatter:
+    if json_output:
+        if jsonlogger is not None:
+            return jsonlogger.JsonFormatter(
+                '%(asctime)s %(name)s %(levelname)s %(funcName)s %(lineno)d %(message)s',
+                datefmt='%Y-%m-%dT%H:%M:%S'
+            )
+        print("python-json-logger is not installed, falling back to plain log lines", file=sys.stderr)
+    return logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+
+def setup_logger(
+    name: str,
+    log_file: Path,
+    level: str = 'INFO',
+    json_output: bool = False,
+    queue_size: int = 10000,
+    rate_limit: int = 20,
+    sample_rate: int = 0
+):
+    """Setup logger with console and file handlers behind a background queue
+
+    json_output switches the file log to one JSON object per line, queue_size
+    bounds the buffered records (extra ones are dropped and counted),
+    rate_limit caps repeated warnings and errors per call site per minute (0
+    disables it) and sample_rate lets every n-th repeat past the cap through.
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+
     # Console handler with color
     console_handler = colorlog.StreamHandler(sys.stdout)
     console_handler.setLevel(getattr(logging, level.upper()))
-    
+
     console_formatter = colorlog.ColoredFormatter(
         '%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s%(reset)s',
         datefmt='%Y-%m-%d %H:%M:%S',
@@ -31,7 +152,7 @@ def setup_logger(name: str, log_file: Path, level: str = 'INFO'):
         }
     )
     console_handler.setFormatter(console_formatter)
-    
+
     # File handler with rotation
     file_handler = RotatingFileHandler(
         log_file,
@@ -39,18 +160,48 @@ def setup_logger(name: str, log_file: Path, level: str = 'INFO'):
         backupCount=5
     )
     file_handler.setLevel(logging.DEBUG)
-    
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(file_formatter)
-    
-    # Add handlers
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
-    
-    return logger
+    file_handler.setFormatter(_file_formatter(json_output))
+
+    # Both run on the listener thread; the loop only enqueues
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_handler.addFilter(RateLimitFilter(rate_limit, sample=sample_rate))
+    _listener = QueueListener(_queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+
+    # The main logger plus the module loggers (src.handlers.*, src.utils.*)
+    for logger_name in {name, PACKAGE_LOGGER}:
+        configured = logging.getLogger(logger_name)
+        configured.setLevel(getattr(logging, level.upper()))
+        configured.handlers = [_queue_handler]
+        configured.propagate = False
+
+    return logging.getLogger(name)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def log_stats() -> Dict[str, int]:
+    """Queue depth and how many records were dropped or rate limited"""
+    if _queue_handler is None:
+        return {"depth": 0, "dropped": 0, "suppressed": 0}
+    rate_limit = next((f for f in _queue_handler.filters if isinstance(f, RateLimitFilter)), None)
+    return {
+        "depth": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "suppressed": rate_limit.suppressed if rate_limit else 0,
+    }
+
+
+atexit.register(shutdown_logging)
+
 
 def get_logger(name: str):
     """Get logger instance"""
@@ -0,0 +1,263 @@
+"""Local SQLite metadata index for saved media and stories"""
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from ..config import STORAGE_PATH, INDEX_PATH
+from ..utils.logger import get_logger
+from ..utils.storage import MediaStorage, ARCHIVE_DIRS, STORED_SUFFIXES
+from ..utils.derivatives import is_derivative
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    file_path TEXT NOT NULL UNIQUE,
+    media_type TEXT,
+    sender_id INTEGER,
+    sender_username TEXT COLLATE NOCASE,
+    sender_name TEXT,
+    chat_id INTEGER,
+    date REAL,
+    size INTEGER,
+    sha256 TEXT,
+    caption TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_media_sender ON media(sender_username, date);
+CREATE INDEX IF NOT EXISTS idx_media_chat ON media(chat_id, date);
+CREATE INDEX IF NOT EXISTS idx_media_type ON media(media_type, date);
+CREATE INDEX IF NOT EXISTS idx_media_date ON media(date);
+CREATE INDEX IF NOT EXISTS idx_media_sha ON media(sha256);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+    caption, content='media', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS media_ai AFTER INSERT ON media BEGIN
+    INSERT INTO media_fts(rowid, caption) VALUES (new.id, new.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS media_ad AFTER DELETE ON media BEGIN
+    INSERT INTO media_fts(media_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+END;
+CREATE TRIGGER IF NOT EXISTS media_au AFTER UPDATE ON media BEGIN
+    INSERT INTO media_fts(media_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+    INSERT INTO media_fts(rowid, caption) VALUES (new.id, new.caption);
+END;
+"""
+
+FIELDS = ("kind", "file_path", "media_type", "sender_id", "sender_username", "sender_name",
+          "chat_id", "date", "size", "sha256", "caption")
+
+# saved_media/YYYYMM/<file_id>_<media_type>_<file_id>.<ext>
+SAVED_MEDIA_RE = re.compile(r"^[0-9a-f]+_(?P<media_type>[a-z]+)_")
+# stories/<username>/YYYYMM/<story_id>_story_<media_type>_<story_id>.<ext>
+STORY_RE = re.compile(r"^\d+_story_(?P<media_type>[a-z]+)_")
+
+
+def hash_file(storage: MediaStorage, path) -> Dict[str, Any]:
+    """Compute sha256 and plaintext size of a stored file"""
+    digest = hashlib.sha256()
+    size = 0
+    with storage.open(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return {"sha256": digest.hexdigest(), "size": size}
+
+
+def parse_find_query(text: str) -> Dict[str, Any]:
+    """Parse `.find` arguments: @user type:photo kind:story since:2024-01 until:2024-02 words"""
+    query: Dict[str, Any] = {}
+    words = []
+    for token in text.split():
+        key, _, value = token.partition(':')
+        if token.startswith('@') and len(token) > 1:
+            query['sender'] = token[1:]
+        elif value and key in ('type', 'kind', 'chat', 'since', 'until', 'limit'):
+            if key in ('since', 'until'):
+                query[key] = _parse_date(value).timestamp()
+            elif key in ('chat', 'limit'):
+                query[key] = int(value)
+            else:
+                query[key] = value.lower()
+        else:
+            words.append(token)
+    if words:
+        query['text'] = " ".join(words)
+    return query
+
+
+def _parse_date(value: str) -> datetime:
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {value} (use YYYY-MM-DD, YYYY-MM or YYYY)")
+
+
+class MediaIndex:
+    def __init__(self, db_path: Path = INDEX_PATH, storage: Optional[MediaStorage] = None):
+        self.db_path = Path(db_path)
+        self.storage = storage or MediaStorage()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def add(self, kind: str, file_path, **fields) -> None:
+        """Index a saved item; hashing and the insert run off the event loop"""
+        await asyncio.to_thread(self._add_sync, kind, str(file_path), fields)
+
+    def _add_sync(self, kind: str, file_path: str, fields: Dict[str, Any]):
+        record = {key: None for key in FIELDS}
+        record.update({k: v for k, v in fields.items() if k in record})
+        record["kind"] = kind
+        record["file_path"] = file_path
+        if isinstance(record["date"], datetime):
+            record["date"] = record["date"].timestamp()
+        if not record["sha256"]:
+            record.update(hash_file(self.storage, file_path))
+
+        columns = ", ".join(FIELDS)
+        placeholders = ", ".join(f":{key}" for key in FIELDS)
+        updates = ", ".join(f"{key}=excluded.{key}" for key in FIELDS if key != "file_path")
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT INTO media ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT(file_path) DO UPDATE SET {updates}",
+                record
+            )
+            conn.commit()
+
+    async def search(self, **query) -> List[Dict[str, Any]]:
+        """Search the index (see parse_find_query for the supported keys)"""
+        return await asyncio.to_thread(self._search_sync, query)
+
+    def _search_sync(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        where, params = self._where(query)
+        sql = "SELECT m.* FROM media m" + where + " ORDER BY m.date DESC LIMIT ?"
+        params.append(query.get('limit') or 20)
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    async def select(self, **query) -> List[Dict[str, Any]]:
+        """Every match oldest first, in a stable order (for exports)"""
+        return await asyncio.to_thread(self._select_sync, query)
+
+    def _select_sync(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        where, params = self._where(query)
+        sql = "SELECT m.* FROM media m" + where + " ORDER BY m.date, m.id"
+        if query.get('limit'):
+            sql += " LIMIT ?"
+            params.append(query['limit'])
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def _where(self, query: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        clauses = []
+        params: List[Any] = []
+
+        if query.get('sender'):
+            clauses.append("(m.sender_username = ? OR m.sender_name = ?)")
+            params += [query['sender'], query['sender']]
+        if query.get('chat'):
+            clauses.append("m.chat_id = ?")
+            params.append(query['chat'])
+        if query.get('type'):
+            clauses.append("m.media_type = ?")
+            params.append(query['type'])
+        if query.get('kind'):
+            clauses.append("m.kind = ?")
+            params.append(query['kind'])
+        if query.get('since'):
+            clauses.append("m.date >= ?")
+            params.append(query['since'])
+        if query.get('until'):
+            clauses.append("m.date < ?")
+            params.append(query['until'])
+        if query.get('text'):
+            # Quote every word so user input can't break FTS query syntax
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in query['text'].split())
+            clauses.append("m.id IN (SELECT rowid FROM media_fts WHERE media_fts MATCH ?)")
+            params.append(match)
+
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    async def backfill(self, root: Path = STORAGE_PATH) -> int:
+        """Index files already in the STORAGE_PATH tree (hot and cold tiers)"""
+        return await asyncio.to_thread(self._backfill_sync, Path(root))
+
+    def _backfill_sync(self, root: Path) -> int:
+        with self._lock:
+            known = {row[0] for row in self._connect().execute("SELECT file_path FROM media")}
+
+        added = 0
+        for base in (root, self.storage.cold_root):
+            for archive_dir in ARCHIVE_DIRS:
+                tree = base / archive_dir
+                if not tree.exists():
+                    continue
+                for path in tree.rglob('*'):
+                    if not path.is_file() or path.name.endswith('.part') or is_derivative(path):
+                        continue
+                    logical = self._logical_path(path, base, root)
+                    if str(logical) in known:
+                        continue
+                    try:
+                        self._add_sync(*self._describe(logical, root, path))
+                        known.add(str(logical))
+                        added += 1
+                    except Exception as e:
+                        logger.error(f"Error indexing {path}: {e}")
+
+        logger.info(f"Backfill indexed {added} files")
+        return added
+
+    def _logical_path(self, path: Path, base: Path, root: Path) -> Path:
+        """Map a cold, compressed or encrypted file back to the path it was saved under"""
+        logical = root / path.relative_to(base)
+        for suffix in STORED_SUFFIXES:
+            if logical.name.endswith(suffix):
+                logical = logical.with_name(logical.name[:-len(suffix)])
+        return logical
+
+    def _describe(self, logical: Path, root: Path, actual: Path):
+        parts = logical.relative_to(root).parts
+        fields: Dict[str, Any] = {"date": actual.stat().st_mtime}
+        if parts[0] == "stories":
+            kind = "story"
+            fields["sender_username"] = parts[1] if len(parts) > 3 else None
+            match = STORY_RE.match(logical.name)
+        else:
+            kind = "media"
+            match = SAVED_MEDIA_RE.match(logical.name)
+        if match:
+            fields["media_type"] = match.group("media_type")
+        return kind, str(logical), fields
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,271 @@
+"""In-process metrics with a Prometheus text endpoint"""
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Latency buckets in seconds (5ms .. 5min)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Throughput buckets in bytes/second (64KB/s .. 256MB/s)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[LabelKey, float] = {}
+        self.functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Read the value lazily at scrape time"""
+        self.functions[_label_key(labels)] = function
+
+    def get(self, **labels) -> float:
+        key = _label_key(labels)
+        if key in self.functions:
+            return self.functions[key]()
+        return self.values.get(key, 0)
+
+    def render(self) -> List[str]:
+        values = dict(self.values)
+        for key, function in self.functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., +Inf count], sum
+        self.counts: Dict[LabelKey, List[int]] = {}
+        self.sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        if labels:
+            return sum(self.counts.get(_label_key(labels), ()))
+        return sum(sum(c) for c in self.counts.values())
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        """Approximate percentile (upper bucket bound) over one or all label sets"""
+        if labels:
+            series = [self.counts.get(_label_key(labels))] if _label_key(labels) in self.counts else []
+        else:
+            series = list(self.counts.values())
+        if not series:
+            return None
+        merged = [sum(column) for column in zip(*series)]
+        total = sum(merged)
+        if not total:
+            return None
+        threshold = q * total
+        running = 0
+        for idx, bucket_count in enumerate(merged):
+            running += bucket_count
+            if running >= threshold:
+                return self.buckets[idx] if idx < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, counts in self.counts.items():
+            running = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                running += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {running}")
+            running += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {self.sums[key]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {running}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, help_text, **kwargs)
+        return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str = "", buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+SUBSCRIPTION_CHECK = REGISTRY.histogram(
+    "tgsecret_subscription_check_seconds", "Force-subscribe gate check latency")
+SUBSCRIPTION_SPECULATION = REGISTRY.counter(
+    "tgsecret_subscription_speculation_total", "Commands started ahead of the gate check by outcome")
+SUBSCRIPTION_SAVED = REGISTRY.histogram(
+    "tgsecret_subscription_saved_seconds", "Latency hidden by overlapping the gate check with the first step")
+SUBSCRIPTION_WASTED = REGISTRY.counter(
+    "tgsecret_subscription_wasted_seconds_total", "Speculative work discarded because the gate denied")
+BACKEND_REQUEST = REGISTRY.histogram(
+    "tgsecret_backend_request_seconds", "Backend API request latency by endpoint")
+BACKEND_ERRORS = REGISTRY.counter(
+    "tgsecret_backend_errors_total", "Failed backend API requests by endpoint")
+AI_REQUEST = REGISTRY.histogram(
+    "tgsecret_ai_request_seconds", "AI provider request latency")
+AI_HEDGES = REGISTRY.counter(
+    "tgsecret_ai_hedges_total", "Hedged AI requests by provider and outcome")
+AI_TOKENS = REGISTRY.counter(
+    "tgsecret_ai_tokens_total", "AI tokens by provider and kind (prompt, cached, completion)")
+STORY_REQUESTS = REGISTRY.counter(
+    "tgsecret_story_requests_total", "Story listing requests by source (active, pinned, archive, by_id, history)")
+TRANSFER_BYTES = REGISTRY.counter(
+    "tgsecret_transfer_bytes_total", "Bytes downloaded from / uploaded to Telegram")
+TRANSFER_THROUGHPUT = REGISTRY.histogram(
+    "tgsecret_transfer_throughput_bytes_per_second", "Per-file transfer throughput",
+    buckets=THROUGHPUT_BUCKETS)
+FLOOD_WAIT = REGISTRY.counter(
+    "tgsecret_floodwait_seconds_total", "Seconds spent sleeping on FloodWait")
+LOOP_LAG = REGISTRY.histogram(
+    "tgsecret_event_loop_lag_seconds", "Event loop scheduling lag",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+
+def endpoint_label(endpoint: str) -> str:
+    """Collapse ids in a backend path so label cardinality stays bounded"""
+    return re.sub(r'/\d+', '/{id}', endpoint.split('?', 1)[0])
+
+
+def record_transfer(direction: str, size: int, seconds: float):
+    TRANSFER_BYTES.inc(size, direction=direction)
+    if seconds > 0 and size:
+        TRANSFER_THROUGHPUT.observe(size / seconds, direction=direction)
+
+
+def record_flood_wait(seconds: float, stage: str):
+    FLOOD_WAIT.inc(seconds, stage=stage)
+
+
+async def start_metrics_server(host: str, port: int, registry: MetricsRegistry = REGISTRY) -> web.AppRunner:
+    """Serve /metrics in Prometheus text format"""
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
+
+
+def summary(registry: MetricsRegistry = REGISTRY) -> List[str]:
+    """Human readable p50/p95 lines for the .stats command"""
+    lines = []
+    for name, metric in sorted(registry.metrics.items()):
+        short = name.replace("tgsecret_", "")
+        if isinstance(metric, Histogram):
+            for key in metric.counts:
+                labels = dict(key)
+                p50 = metric.percentile(0.5, **labels)
+                p95 = metric.percentile(0.95, **labels)
+                label_text = ",".join(f"{v}" for _, v in key)
+                lines.append(
+                    f"{short}{f'[{label_text}]' if label_text else ''}: "
+                    f"n={metric.count(**labels)} p50≤{p50:g} p95≤{p95:g}"
+                )
+        elif isinstance(metric, Counter) and metric.values:
+            lines.append(f"{short}: {metric.total():g}")
+        elif isinstance(metric, Gauge):
+            for line in metric.render():
+                lines.append(line.replace("tgsecret_", ""))
+    return lines
@@ -0,0 +1,125 @@
+"""Per-provider AI health scoring and hedge timing"""
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..config import AI_HEDGE_MIN_DELAY, AI_HEDGE_MAX_DELAY
+
+MIN_SAMPLES = 20  # latency samples before the observed p95 is trusted
+EWMA_ALPHA = 0.2
+FAILURE_COOLDOWN = 60  # seconds a provider with repeated failures is ranked last
+FAILURES_TO_TRIP = 3
+POSITION_WEIGHT = 0.9  # preference for the user's own ordering
+
+
+class ProviderStats:
+    def __init__(self, window: int = 200):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.success_rate = 1.0  # EWMA of successes
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure = 0.0
+        self.hedge_wins = 0
+        self.hedge_losses = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def tripped(self) -> bool:
+        return (
+            self.consecutive_failures >= FAILURES_TO_TRIP
+            and time.monotonic() - self.last_failure < FAILURE_COOLDOWN
+        )
+
+    def score(self, p95_prior: float = 0.0) -> float:
+        """Higher is better: success rate discounted by typical latency
+        (p95_prior until enough samples are in)"""
+        p95 = self.p95()
+        return self.success_rate / (1.0 + (p95 if p95 is not None else p95_prior))
+
+    def as_dict(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "successRate": round(self.success_rate, 3),
+            "p95Ms": round(p95 * 1000) if p95 is not None else None,
+            "hedgeWins": self.hedge_wins,
+            "hedgeLosses": self.hedge_losses,
+        }
+
+
+class ProviderHealth:
+    """Tracks latency and errors per provider to rank fallbacks and time hedges"""
+
+    def __init__(self):
+        self.stats: Dict[str, ProviderStats] = {}
+
+    def get(self, provider: str) -> ProviderStats:
+        if provider not in self.stats:
+            self.stats[provider] = ProviderStats()
+        return self.stats[provider]
+
+    def record(self, provider: str, seconds: float, ok: bool):
+        stats = self.get(provider)
+        stats.success_rate += EWMA_ALPHA * ((1.0 if ok else 0.0) - stats.success_rate)
+        if ok:
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.latencies.append(seconds)
+        else:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.last_failure = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Latency windows and success rates, so a restart doesn't re-learn hedge timing"""
+        return {
+            provider: {
+                "latencies": list(stats.latencies),
+                "success_rate": stats.success_rate,
+                "successes": stats.successes,
+                "failures": stats.failures,
+            }
+            for provider, stats in self.stats.items()
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        for provider, saved in state.items():
+            stats = self.get(provider)
+            stats.latencies.extend(saved.get("latencies", []))
+            stats.success_rate = saved.get("success_rate", stats.success_rate)
+            stats.successes = saved.get("successes", 0)
+            stats.failures = saved.get("failures", 0)
+
+    def record_hedge(self, provider: str, won: bool):
+        stats = self.get(provider)
+        if won:
+            stats.hedge_wins += 1
+        else:
+            stats.hedge_losses += 1
+
+    def order(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rank candidates by health, keeping the user's order as a tie-breaker"""
+        # Unmeasured providers are assumed typical (median p95 of the measured ones),
+        # so an untried fallback doesn't jump ahead of a healthy primary
+        measured = sorted(p95 for p95 in (self.get(c["provider"]).p95() for c in candidates) if p95 is not None)
+        prior = measured[len(measured) // 2] if measured else 0.0
+
+        def rank(item):
+            position, candidate = item
+            stats = self.get(candidate["provider"])
+            return (stats.tripped(), -stats.score(prior) * POSITION_WEIGHT ** position)
+
+        return [candidate for _, candidate in sorted(enumerate(candidates), key=rank)]
+
+    def hedge_delay(self, provider: str) -> float:
+        """How long to wait on a provider before hedging to the next one"""
+        p95 = self.get(provider).p95()
+        if p95 is None:
+            return AI_HEDGE_MAX_DELAY
+        return min(AI_HEDGE_MAX_DELAY, max(AI_HEDGE_MIN_DELAY, p95))
@@ -0,0 +1,181 @@
+"""Pluggable JSON codec: orjson, then msgspec, then the standard library
+
+Set JSON_CODEC to force one (e.g. `json` to benchmark the stdlib baseline).
+AI provider replies are decoded into typed structs with msgspec when it is
+installed, which only materializes the fields we read.
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional speedup
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # Optional speedup
+    msgspec = None
+
+from ..config import JSON_CODEC
+
+CODECS = ("orjson", "msgspec", "json")
+
+
+def _available() -> Dict[str, Tuple[Callable[[Any], str], Callable[[Any], Any]]]:
+    codecs = {}
+    if orjson is not None:
+        codecs["orjson"] = (
+            lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode(),
+            orjson.loads
+        )
+    if msgspec is not None:
+        encoder = msgspec.json.Encoder()
+        codecs["msgspec"] = (lambda obj: encoder.encode(obj).decode(), msgspec.json.decode)
+    codecs["json"] = (lambda obj: json.dumps(obj, separators=(",", ":")), json.loads)
+    return codecs
+
+
+CODEC = "json"
+_dumps, _loads = json.dumps, json.loads
+
+
+def set_codec(name: str = "auto") -> str:
+    """Select a codec by name, or the fastest installed one for "auto"; returns the name used"""
+    global CODEC, _dumps, _loads
+    codecs = _available()
+    if name not in codecs:
+        name = next(codec for codec in CODECS if codec in codecs)
+    CODEC = name
+    _dumps, _loads = codecs[name]
+    return name
+
+
+def dumps(obj: Any) -> str:
+    """Encode to a str (usable as aiohttp's json_serialize)"""
+    return _dumps(obj)
+
+
+def loads(data) -> Any:
+    """Decode bytes or str"""
+    return _loads(data)
+
+
+set_codec(JSON_CODEC)
+
+
+# ---- Typed provider replies ------------------------------------------------
+
+def _extract_text(provider: str, data: Dict[str, Any]) -> str:
+    if provider == "openai":
+        return data['choices'][0]['message']['content']
+    if provider == "claude":
+        return data['content'][0]['text']
+    if provider == "gemini":
+        return data['candidates'][0]['content']['parts'][0]['text']
+    return data.get('response') or data.get('text') or data.get('output') or str(data)
+
+
+def _extract_usage(provider: str, data: Dict[str, Any]) -> Dict[str, int]:
+    """prompt_tokens counts every input token, cached_tokens those read from the prompt cache"""
+    if provider == "gemini":
+        usage = data.get('usageMetadata') or {}
+        return {"prompt_tokens": usage.get('promptTokenCount', 0),
+                "completion_tokens": usage.get('candidatesTokenCount', 0),
+                "cached_tokens": usage.get('cachedContentTokenCount', 0)}
+    usage = data.get('usage') or {}
+    if provider == "claude":
+        # Claude's input_tokens excludes cache reads and writes
+        cached = usage.get('cache_read_input_tokens') or 0
+        return {"prompt_tokens": usage.get('input_tokens', 0) + cached
+                + (usage.get('cache_creation_input_tokens') or 0),
+                "completion_tokens": usage.get('output_tokens', 0),
+                "cached_tokens": cached}
+    details = usage.get('prompt_tokens_details') or {}
+    return {"prompt_tokens": usage.get('prompt_tokens', usage.get('input_tokens', 0)),
+            "completion_tokens": usage.get('completion_tokens', usage.get('output_tokens', 0)),
+            "cached_tokens": details.get('cached_tokens') or 0}
+
+
+if msgspec is not None:
+    class _OpenAIMessage(msgspec.Struct):
+        content: str = ""
+
+    class _OpenAIChoice(msgspec.Struct):
+        message: _OpenAIMessage
+
+    class _OpenAIPromptDetails(msgspec.Struct):
+        cached_tokens: int = 0
+
+    class _OpenAIUsage(msgspec.Struct):
+        prompt_tokens: int = 0
+        completion_tokens: int = 0
+        prompt_tokens_details: Optional[_OpenAIPromptDetails] = None
+
+    class OpenAIReply(msgspec.Struct):
+        choices: List[_OpenAIChoice]
+        usage: Optional[_OpenAIUsage] = None
+
+    class _ClaudeBlock(msgspec.Struct):
+        text: str = ""
+
+    class _ClaudeUsage(msgspec.Struct):
+        input_tokens: int = 0
+        output_tokens: int = 0
+        cache_read_input_tokens: Optional[int] = None
+        cache_creation_input_tokens: Optional[int] = None
+
+    class ClaudeReply(msgspec.Struct):
+        content: List[_ClaudeBlock]
+        usage: Optional[_ClaudeUsage] = None
+
+    class _GeminiPart(msgspec.Struct):
+        text: str = ""
+
+    class _GeminiContent(msgspec.Struct):
+        parts: List[_GeminiPart]
+
+    class _GeminiCandidate(msgspec.Struct):
+        content: _GeminiContent
+
+    class _GeminiUsage(msgspec.Struct):
+        promptTokenCount: int = 0
+        candidatesTokenCount: int = 0
+        cachedContentTokenCount: int = 0
+
+    class GeminiReply(msgspec.Struct):
+        candidates: List[_GeminiCandidate]
+        usageMetadata: Optional[_GeminiUsage] = None
+
+    _DECODERS = {
+        "openai": msgspec.json.Decoder(OpenAIReply),
+        "claude": msgspec.json.Decoder(ClaudeReply),
+        "gemini": msgspec.json.Decoder(GeminiReply),
+    }
+
+    def _decode_typed(provider: str, body: bytes) -> Tuple[str, Dict[str, int]]:
+        reply = _DECODERS[provider].decode(body)
+        if provider == "openai":
+            usage = reply.usage or _OpenAIUsage()
+            details = usage.prompt_tokens_details or _OpenAIPromptDetails()
+            return reply.choices[0].message.content, {
+                "prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+                "cached_tokens": details.cached_tokens}
+        if provider == "claude":
+            usage = reply.usage or _ClaudeUsage()
+            cached = usage.cache_read_input_tokens or 0
+            return reply.content[0].text, {
+                "prompt_tokens": usage.input_tokens + cached + (usage.cache_creation_input_tokens or 0),
+                "completion_tokens": usage.output_tokens, "cached_tokens": cached}
+        usage = reply.usageMetadata or _GeminiUsage()
+        return reply.candidates[0].content.parts[0].text, {
+            "prompt_tokens": usage.promptTokenCount, "completion_tokens": usage.candidatesTokenCount,
+            "cached_tokens": usage.cachedContentTokenCount}
+
+
+def decode_reply(provider: str, body: bytes) -> Tuple[str, Dict[str, int]]:
+    """Response text and token usage from a provider's raw JSON body"""
+    if msgspec is not None and CODEC != "json" and provider in _DECODERS:
+        return _decode_typed(provider, body)
+    data = loads(body)
+    return _extract_text(provider, data), _extract_usage(provider, data)
@@ -0,0 +1,119 @@
+"""Startup phase timing and configuration checks for run.py --check
+
+Only the standard library is imported here so run.py can start the clock
+before the heavy imports.
+"""
+import importlib.util
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+from urllib.parse import urlparse
+
+OK, WARN, FAIL = "ok", "warn", "fail"
+
+OPTIONAL_MODULES = {
+    "zstandard": "archive compaction falls back to gzip",
+    "PIL": "no photo thumbnails",
+    "moviepy": "no video posters or non-WAV waveforms",
+    "pythonjsonlogger": "LOG_JSON falls back to plain lines",
+    "orjson": "JSON goes through the slower stdlib codec",
+    "msgspec": "AI replies are decoded without typed structs",
+}
+
+
+class StartupTimer:
+    """Wall time of named startup phases, reported once the bot is up"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.origin
+        parts = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        return f"Startup took {total * 1000:.0f}ms ({parts})"
+
+
+STARTUP = StartupTimer()
+
+
+def install_uvloop() -> bool:
+    """Use uvloop for the event loop when USE_UVLOOP is set and it is installed"""
+    from ..config import USE_UVLOOP
+    if not USE_UVLOOP:
+        return False
+    try:
+        import uvloop
+    except ImportError:
+        print("⚠️ USE_UVLOOP is set but uvloop is not installed, using asyncio's loop")
+        return False
+    uvloop.install()
+    return True
+
+
+def check_config() -> List[Tuple[str, str]]:
+    """Validate configuration without connecting anywhere; (status, message) pairs"""
+    try:
+        from .. import config
+    except Exception as e:
+        return [(FAIL, f"Config failed to load: {e}")]
+
+    results = []
+
+    if config.API_ID and config.API_HASH:
+        results.append((OK, f"API_ID {config.API_ID} and API_HASH set"))
+    else:
+        results.append((FAIL, "API_ID and API_HASH must be set (https://my.telegram.org)"))
+
+    session_file = config.SESSIONS_PATH / "tgsecret_session.session"
+    if config.SESSION_STRING or session_file.exists():
+        results.append((OK, "Session string or session file present"))
+    else:
+        results.append((FAIL, f"No SESSION_STRING and no {session_file}; run init_session.py"))
+
+    backend = urlparse(config.BACKEND_URL)
+    if backend.scheme in ("http", "https") and backend.netloc:
+        results.append((OK, f"Backend URL {config.BACKEND_URL}"))
+    else:
+        results.append((FAIL, f"BACKEND_URL is not an http(s) URL: {config.BACKEND_URL!r}"))
+    if config.WEBHOOK_SECRET == "shared_secret":
+        results.append((WARN, "WEBHOOK_SECRET is the default value"))
+
+    try:
+        config.ensure_directories()
+        for path in (config.STORAGE_PATH, config.SESSIONS_PATH, config.TEMP_PATH, config.LOG_FILE.parent):
+            if not os.access(path, os.W_OK):
+                results.append((FAIL, f"{path} is not writable"))
+        results.append((OK, f"Storage at {config.STORAGE_PATH}"))
+    except OSError as e:
+        results.append((FAIL, f"Cannot create directories: {e}"))
+
+    if config.METRICS_ENABLED and not 0 < config.METRICS_PORT < 65536:
+        results.append((FAIL, f"METRICS_PORT out of range: {config.METRICS_PORT}"))
+
+    if config.STORAGE_ENCRYPTION:
+        if importlib.util.find_spec("cryptography") is None:
+            results.append((FAIL, "STORAGE_ENCRYPTION is on but cryptography is not installed"))
+        elif config.STORAGE_ENCRYPTION_KEY and len(config.STORAGE_ENCRYPTION_KEY) != 64:
+            results.append((FAIL, "STORAGE_ENCRYPTION_KEY must be 64 hex characters"))
+        else:
+            source = "STORAGE_ENCRYPTION_KEY" if config.STORAGE_ENCRYPTION_KEY else "the backend"
+            results.append((OK, f"Storage encryption on, keys from {source}"))
+
+    if config.USE_UVLOOP and importlib.util.find_spec("uvloop") is None:
+        results.append((WARN, "USE_UVLOOP is set but uvloop is not installed"))
+
+    for module, consequence in OPTIONAL_MODULES.items():
+        if importlib.util.find_spec(module) is None:
+            results.append((WARN, f"{module} not installed: {consequence}"))
+
+    return results
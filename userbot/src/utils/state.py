@@ -0,0 +1,53 @@
+"""Warm-restart state snapshots
+
+On shutdown, state that is slow to rebuild or must not be lost is written to
+one JSON file per owner under STATE_PATH. The shared services save their
+caches and unsent backend events; each account saves its peers and any
+unfinished jobs. A snapshot is consumed when loaded, so nothing is replayed
+twice. Caches from a snapshot older than STATE_MAX_AGE are treated as cold.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from ..config import STATE_MAX_AGE, STATE_PATH
+from ..utils.logger import get_logger
+from ..utils.serialization import dumps, loads
+
+logger = get_logger(__name__)
+
+STATE_VERSION = 1
+
+
+class StateFile:
+    def __init__(self, name: str, root: Path = STATE_PATH):
+        self.path = Path(root) / f"{name}.json"
+
+    def save(self, state: Dict[str, Any]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".part")
+        partial.write_text(dumps({"version": STATE_VERSION, "saved_at": time.time(), **state}))
+        # Pending events carry user ids and captions
+        os.chmod(partial, 0o600)
+        os.replace(partial, self.path)
+        logger.info(f"Saved state snapshot {self.path.name}")
+
+    def load(self) -> Dict[str, Any]:
+        """The saved state, removing the file; {} if there is none or it can't be read"""
+        try:
+            state = loads(self.path.read_bytes())
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable state snapshot {self.path}: {e}")
+            state = {}
+        self.path.unlink(missing_ok=True)
+        if state.get("version") != STATE_VERSION:
+            return {}
+        return state
+
+
+def is_fresh(state: Dict[str, Any]) -> bool:
+    """Whether a snapshot's caches are recent enough to serve from"""
+    return time.time() - state.get("saved_at", 0) <= STATE_MAX_AGE
@@ -0,0 +1,257 @@
+"""Archived media storage with compression and cold tiering"""
+import asyncio
+import gzip
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, BinaryIO, List
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+from ..config import (
+    STORAGE_PATH, COLD_STORAGE_PATH, COLD_TIER_DAYS,
+    COMPACTION_INTERVAL, COMPACTION_MIN_SAVING, STORAGE_ENCRYPTION, STORAGE_CHUNK_SIZE
+)
+from ..utils.logger import get_logger
+from ..utils.encryption import ENCRYPTED_SUFFIX, EncryptedWriter, StorageKeyring, open_encrypted
+
+logger = get_logger(__name__)
+
+# Directories under STORAGE_PATH that hold archived media
+ARCHIVE_DIRS = ("saved_media", "stories")
+
+# Documents and text compress well with a general purpose codec
+TEXT_EXTENSIONS = {'.txt', '.json', '.csv', '.log', '.xml', '.html', '.md', '.rtf', '.pdf', '.doc'}
+
+# Uncompressed audio containers; only kept compressed when it actually helps
+RAW_AUDIO_EXTENSIONS = {'.wav', '.aiff', '.aif'}
+
+COMPRESSED_SUFFIXES = ('.zst', '.gz')
+
+# Every suffix storage may add to a logical path
+STORED_SUFFIXES = COMPRESSED_SUFFIXES + (ENCRYPTED_SUFFIX,)
+
+# Derivatives are stored next to the content as <name><suffix>
+DERIVATIVE_SUFFIXES = {
+    "thumbnail": ".thumb.webp",
+    "poster": ".poster.webp",
+    "waveform": ".waveform.json",
+}
+
+
+def is_derivative(path) -> bool:
+    """Whether a path is a generated derivative rather than archived content"""
+    name = Path(path).name
+    for suffix in STORED_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name.endswith(tuple(DERIVATIVE_SUFFIXES.values()))
+
+
+class MediaStorage:
+    def __init__(
+        self,
+        root: Path = STORAGE_PATH,
+        cold_root: Path = COLD_STORAGE_PATH,
+        encrypt: bool = STORAGE_ENCRYPTION,
+        keyring: Optional[StorageKeyring] = None
+    ):
+        self.root = Path(root)
+        self.cold_root = Path(cold_root)
+        self.encrypt = encrypt
+        self.keyring = keyring or StorageKeyring()
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    # ---- Reads -------------------------------------------------------
+
+    def resolve(self, path) -> Optional[Path]:
+        """Find where an archived file currently lives (hot, cold, compressed, encrypted)"""
+        path = Path(path)
+        candidates = [path]
+
+        cold_path = self._cold_path(path)
+        if cold_path:
+            candidates.append(cold_path)
+
+        for candidate in candidates:
+            if candidate.exists():
+                return candidate
+            for suffix in STORED_SUFFIXES:
+                stored = candidate.with_name(candidate.name + suffix)
+                if stored.exists():
+                    return stored
+        return None
+
+    def open(self, path) -> BinaryIO:
+        """Open an archived file for reading, decompressing or decrypting on the fly
+
+        Encrypted files are seekable and only the chunks actually read are decrypted.
+        """
+        actual = self.resolve(path)
+        if actual is None:
+            raise FileNotFoundError(str(path))
+
+        if actual.suffix == ENCRYPTED_SUFFIX:
+            return open_encrypted(actual, self.keyring)
+        if actual.suffix == '.zst':
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read .zst archives")
+            return zstandard.ZstdDecompressor().stream_reader(open(actual, 'rb'), closefd=True)
+        if actual.suffix == '.gz':
+            return gzip.open(actual, 'rb')
+        return open(actual, 'rb')
+
+    async def read(self, path) -> bytes:
+        """Read a whole archived file without blocking the event loop"""
+        def _read():
+            with self.open(path) as f:
+                return f.read()
+        return await asyncio.to_thread(_read)
+
+    # ---- Writes ------------------------------------------------------
+
+    async def store(self, source, target) -> Path:
+        """Move a finished file into the archive at `target`, encrypting it on the way when enabled"""
+        return await asyncio.to_thread(self._store_sync, Path(source), Path(target))
+
+    def _store_sync(self, source: Path, target: Path) -> Path:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if not self.encrypt:
+            shutil.move(str(source), target)
+            return target
+
+        encrypted = target.with_name(target.name + ENCRYPTED_SUFFIX)
+        partial = encrypted.with_name(encrypted.name + '.part')
+        try:
+            with open(source, 'rb') as src, EncryptedWriter(open(partial, 'wb'), self.keyring) as dst:
+                shutil.copyfileobj(src, dst, STORAGE_CHUNK_SIZE)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        shutil.copystat(source, partial)
+        os.replace(partial, encrypted)
+        source.unlink()
+        return encrypted
+
+    # ---- Compaction --------------------------------------------------
+
+    async def compact(self) -> Dict[str, Any]:
+        """Move old items to the cold tier, compressing eligible ones"""
+        report = await asyncio.to_thread(self._compact_sync)
+        self.last_report = report
+        logger.info(
+            f"Compaction: moved {report['files_moved']} files, "
+            f"compressed {report['files_compressed']} "
+            f"({report['bytes_before']/1024/1024:.1f}MB -> {report['bytes_after']/1024/1024:.1f}MB, "
+            f"ratio {report['ratio']:.2f})"
+        )
+        return report
+
+    async def run_compaction_loop(self):
+        """Periodically run compaction in the background"""
+        while True:
+            try:
+                await self.compact()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Compaction failed: {e}", exc_info=True)
+            await asyncio.sleep(COMPACTION_INTERVAL)
+
+    def _compact_sync(self) -> Dict[str, Any]:
+        cutoff = time.time() - COLD_TIER_DAYS * 86400
+        report = {
+            "files_moved": 0,
+            "files_compressed": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "ratio": 1.0,
+            "by_extension": {}
+        }
+
+        for source in self._iter_archived_files():
+            try:
+                if source.stat().st_mtime > cutoff:
+                    continue  # Hot items stay directly readable
+                self._move_to_cold(source, report)
+            except Exception as e:
+                logger.error(f"Error compacting {source}: {e}")
+
+        if report["bytes_before"]:
+            report["ratio"] = report["bytes_after"] / report["bytes_before"]
+        for stats in report["by_extension"].values():
+            stats["ratio"] = stats["bytes_after"] / stats["bytes_before"] if stats["bytes_before"] else 1.0
+        return report
+
+    def _iter_archived_files(self) -> List[Path]:
+        files = []
+        for name in ARCHIVE_DIRS:
+            base = self.root / name
+            if base.exists():
+                # Derivatives stay hot: they are small and served by the paths logged for them
+                files.extend(
+                    p for p in base.rglob('*')
+                    if p.is_file() and not p.name.endswith('.part') and not is_derivative(p)
+                )
+        return files
+
+    def _move_to_cold(self, source: Path, report: Dict[str, Any]):
+        target = self._cold_path(source)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        size = source.stat().st_size
+        ext = source.suffix.lower()
+
+        if ext in TEXT_EXTENSIONS or ext in RAW_AUDIO_EXTENSIONS:
+            compressed = self._compress_file(source, target)
+            if compressed:
+                compressed_size = compressed.stat().st_size
+                stats = report["by_extension"].setdefault(ext, {"files": 0, "bytes_before": 0, "bytes_after": 0})
+                stats["files"] += 1
+                stats["bytes_before"] += size
+                stats["bytes_after"] += compressed_size
+                report["files_compressed"] += 1
+                report["files_moved"] += 1
+                report["bytes_before"] += size
+                report["bytes_after"] += compressed_size
+                source.unlink()
+                return
+
+        partial = target.with_name(target.name + '.part')
+        shutil.copy2(source, partial)
+        os.replace(partial, target)
+        source.unlink()
+        report["files_moved"] += 1
+        report["bytes_before"] += size
+        report["bytes_after"] += size
+
+    def _compress_file(self, source: Path, target: Path) -> Optional[Path]:
+        """Compress source next to target, keeping it only if it saves enough space"""
+        suffix = '.zst' if zstandard is not None else '.gz'
+        compressed = target.with_name(target.name + suffix)
+        partial = compressed.with_name(compressed.name + '.part')
+
+        with open(source, 'rb') as src, open(partial, 'wb') as dst:
+            if zstandard is not None:
+                zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+            else:
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=9) as gz:
+                    shutil.copyfileobj(src, gz)
+
+        size = source.stat().st_size
+        if size and partial.stat().st_size > size * (1 - COMPACTION_MIN_SAVING):
+            partial.unlink()
+            return None
+
+        shutil.copystat(source, partial)
+        os.replace(partial, compressed)
+        return compressed
+
+    def _cold_path(self, path: Path) -> Optional[Path]:
+        try:
+            return self.cold_root / Path(path).relative_to(self.root)
+        except ValueError:
+            return None
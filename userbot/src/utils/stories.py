@@ -0,0 +1,132 @@
+"""Story listing through the stories endpoints
+
+Active stories take one call, pinned (profile/highlight) and archived stories
+are paged with an offset_id cursor, and stories listed without their media are
+resolved by id in batches. The stories methods come from Pyrogram forks that
+track newer layers (get_peer_stories, get_pinned_stories, get_stories_archive,
+get_stories). On clients without them this falls back to the old capped
+history scan.
+"""
+from typing import Any, Dict, List
+
+from pyrogram.types import Story
+
+from ..config import STORY_FETCH_ARCHIVE, STORY_FETCH_LIMIT, STORY_FETCH_PINNED
+from ..utils.logger import get_logger
+from ..utils.metrics import STORY_REQUESTS
+from ..utils.tracing import span
+
+logger = get_logger(__name__)
+
+STORY_PAGE_SIZE = 100  # server maximum per stories.* request
+STORY_BATCH_SIZE = 100  # ids per stories.getStoriesByID
+
+
+async def _collect(result) -> List[Any]:
+    """Fork methods return an async generator, a list or a single story"""
+    if hasattr(result, "__aiter__"):
+        return [item async for item in result]
+    result = await result
+    if result is None:
+        return []
+    return list(result) if isinstance(result, (list, tuple)) else [result]
+
+
+def _has_media(story) -> bool:
+    return bool(getattr(story, "photo", None) or getattr(story, "video", None))
+
+
+class StoryFetcher:
+    def __init__(self, client, limit: int = STORY_FETCH_LIMIT):
+        self.client = client
+        self.limit = limit
+
+    @property
+    def supported(self) -> bool:
+        return callable(getattr(self.client, "get_peer_stories", None))
+
+    async def fetch(self, user) -> List[Any]:
+        """Active, then pinned, then (own account only) archived stories, deduplicated by id"""
+        if not self.supported:
+            return await self._history_scan(user)
+
+        stories: Dict[int, Any] = {}
+
+        def add(items):
+            for story in items:
+                if len(stories) >= self.limit:
+                    break
+                stories.setdefault(story.id, story)
+
+        with span("stories_fetch", user_id=user.id) as current:
+            add(await self._active(user))
+            pinned = getattr(self.client, "get_pinned_stories", None)
+            if STORY_FETCH_PINNED and pinned and len(stories) < self.limit:
+                add(await self._paged("pinned", pinned, user))
+            # The archive is only readable for the account's own stories
+            archive = getattr(self.client, "get_stories_archive", None)
+            if STORY_FETCH_ARCHIVE and archive and getattr(user, "is_self", False) and len(stories) < self.limit:
+                add(await self._paged("archive", archive, user))
+            await self._resolve_media(user, stories)
+            if current:
+                current.set(stories=len(stories))
+
+        return [story for story in stories.values() if _has_media(story)]
+
+    async def _active(self, user) -> List[Any]:
+        STORY_REQUESTS.inc(source="active")
+        try:
+            return await _collect(self.client.get_peer_stories(user.id))
+        except Exception as e:
+            logger.error(f"Error fetching active stories of {user.id}: {e}")
+            return []
+
+    async def _paged(self, source: str, method, user) -> List[Any]:
+        """Walk one listing page by page, using the last story id as the cursor"""
+        items: List[Any] = []
+        offset_id = 0
+        while len(items) < self.limit:
+            page_size = min(STORY_PAGE_SIZE, self.limit - len(items))
+            STORY_REQUESTS.inc(source=source)
+            try:
+                page = await _collect(method(user.id, offset_id=offset_id, limit=page_size))
+            except Exception as e:
+                logger.error(f"Error fetching {source} stories of {user.id}: {e}")
+                break
+            items.extend(page)
+            if len(page) < page_size:
+                break
+            offset_id = page[-1].id
+        return items
+
+    async def _resolve_media(self, user, stories: Dict[int, Any]):
+        """Fetch full stories (with media) for ids a listing returned without it"""
+        missing = [story_id for story_id, story in stories.items() if not _has_media(story)]
+        getter = getattr(self.client, "get_stories", None)
+        if not missing or getter is None:
+            return
+        for start in range(0, len(missing), STORY_BATCH_SIZE):
+            batch = missing[start:start + STORY_BATCH_SIZE]
+            STORY_REQUESTS.inc(source="by_id")
+            try:
+                resolved = await _collect(getter(user.id, batch))
+            except Exception as e:
+                logger.error(f"Error resolving {len(batch)} stories of {user.id}: {e}")
+                continue
+            for story in resolved:
+                if story is not None and story.id in stories:
+                    stories[story.id] = story
+
+    async def _history_scan(self, user) -> List[Any]:
+        """Pre-stories clients: look for Story objects in the last 100 history items"""
+        if not getattr(user, "has_stories", True):
+            return []
+        STORY_REQUESTS.inc(source="history")
+        stories = []
+        with span("history_scan") as current:
+            async for story in self.client.get_chat_history(user.id, limit=100):
+                if isinstance(story, Story):
+                    stories.append(story)
+            if current:
+                current.set(stories=len(stories))
+        return stories
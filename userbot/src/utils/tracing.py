@@ -0,0 +1,221 @@
+"""Lightweight per-command tracing and an on-demand sampling profiler"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..config import TRACING_ENABLED, TRACE_PATH, PROFILE_PATH
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MAX_TRACE_FILE_SIZE = 50 * 1024 * 1024  # rotate the collector file at 50MB
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("tgsecret_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.spans: List[Span] = []
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    def __init__(self, export_path: Path = TRACE_PATH, enabled: bool = TRACING_ENABLED):
+        self.export_path = Path(export_path)
+        self.enabled = enabled
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Start a new trace with a root span; exported when the block exits"""
+        if not self.enabled:
+            yield None
+            return
+
+        trace = Trace(name)
+        root = Span(trace, name, None, attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            root.end_ns = time.time_ns()
+            trace.spans.append(root)
+            _current_span.reset(token)
+            self._export(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Nested span under the current one; a no-op outside of a trace"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            parent.trace.spans.append(span)
+            _current_span.reset(token)
+
+    def _export(self, trace: Trace):
+        """Append one OTLP/JSON line per trace (collector 'otlpjsonfile' compatible)"""
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", "tgsecret-userbot")]},
+                "scopeSpans": [{
+                    "scope": {"name": "tgsecret"},
+                    "spans": [span.to_otlp() for span in trace.spans]
+                }]
+            }]
+        }, default=str)
+
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write, line)
+        except RuntimeError:
+            self._write(line)
+
+    def _write(self, line: str):
+        try:
+            with self._write_lock:
+                self.export_path.parent.mkdir(parents=True, exist_ok=True)
+                if self.export_path.exists() and self.export_path.stat().st_size > MAX_TRACE_FILE_SIZE:
+                    os.replace(self.export_path, self.export_path.with_suffix(self.export_path.suffix + ".1"))
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"Error exporting trace: {e}")
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes):
+    """Shortcut for TRACER.span"""
+    return TRACER.span(name, **attributes)
+
+
+def traced(name: str):
+    """Decorator that runs an async command handler inside its own trace"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with TRACER.trace(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_duration(value: str) -> float:
+    """Parse '30', '30s', '2m' into seconds"""
+    value = value.strip().lower()
+    if value.endswith("ms"):
+        return float(value[:-2]) / 1000
+    if value.endswith("m"):
+        return float(value[:-1]) * 60
+    return float(value.rstrip("s"))
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's Python stack into flamegraph 'folded' format"""
+
+    def __init__(self, output_dir: Path = PROFILE_PATH, interval: float = 0.005):
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.running = False
+
+    async def profile(self, duration: float) -> Dict[str, Any]:
+        """Profile the calling event loop for duration seconds"""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        target_thread = threading.get_ident()
+        self.running = True
+        try:
+            return await asyncio.to_thread(self._sample, target_thread, duration)
+        finally:
+            self.running = False
+
+    def _sample(self, thread_id: int, duration: float) -> Dict[str, Any]:
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration
+        samples = 0
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stacks[";".join(reversed(stack))] += 1
+                samples += 1
+            time.sleep(self.interval)
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        output = self.output_dir / f"profile_{time.strftime('%Y%m%d_%H%M%S')}.folded"
+        with open(output, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        return {"path": str(output), "samples": samples, "stacks": len(stacks)}
@@ -0,0 +1,143 @@
+"""Anonymized recording of incoming updates and commands for replay"""
+import asyncio
+import gzip
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..config import TRAFFIC_PATH
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MEDIA_ATTRS = ("photo", "video", "document", "audio", "voice", "video_note", "animation", "sticker")
+FLUSH_EVERY = 100  # events
+
+
+class TrafficRecorder:
+    """Writes one compact JSON line per update to a gzip log
+
+    Ids are replaced by small per-recording integers and text by its length,
+    so logs keep message shapes, media sizes and timing but no content.
+    """
+
+    def __init__(self, directory: Path = TRAFFIC_PATH):
+        self.directory = Path(directory)
+        self.path: Optional[Path] = None
+        self.active = False
+        self.events = 0
+        self._ids: Dict[Any, int] = {}
+        self._buffer: List[str] = []
+        self._file = None
+        self._start = 0.0
+        self._lock = threading.Lock()
+
+    def start(self) -> Path:
+        if self.active:
+            return self.path
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"traffic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz"
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        self._ids = {}
+        self.events = 0
+        self._start = time.monotonic()
+        self.active = True
+        logger.info(f"Recording traffic to {self.path}")
+        return self.path
+
+    def stop(self) -> Optional[Path]:
+        if not self.active:
+            return None
+        self.active = False
+        self._write(self._take_buffer())
+        with self._lock:
+            self._file.close()
+            self._file = None
+        logger.info(f"Recorded {self.events} events to {self.path}")
+        return self.path
+
+    def record(self, message):
+        """Record an update; cheap enough to call for every message"""
+        if not self.active:
+            return
+        event = self.describe(message)
+        event["t"] = round(time.monotonic() - self._start, 4)
+        self._buffer.append(json.dumps(event, separators=(",", ":")))
+        self.events += 1
+
+        if len(self._buffer) >= FLUSH_EVERY:
+            lines = self._take_buffer()
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+            except RuntimeError:
+                self._write(lines)
+
+    def describe(self, message) -> Dict[str, Any]:
+        event = {
+            "chat": self._anon(message.chat.id if message.chat else None),
+            "chat_type": str(getattr(message.chat, "type", "") or "").split(".")[-1].lower() or None,
+            "from": self._anon(message.from_user.id if message.from_user else None),
+            "out": bool(message.outgoing),
+        }
+
+        text = message.text or ""
+        if text.startswith("."):
+            name, _, rest = text[1:].partition(" ")
+            event["cmd"] = name.lower()
+            rest = rest.strip()
+            if rest:
+                event["arg_len"] = len(rest)
+                event["arg"] = self._anon(rest.lower())
+        elif text:
+            event["text_len"] = len(text)
+
+        event.update(self._media_shape(message))
+        if message.reply_to_message:
+            event["reply"] = {
+                "from": self._anon(message.reply_to_message.from_user.id if message.reply_to_message.from_user else None),
+                **self._media_shape(message.reply_to_message)
+            }
+        return {k: v for k, v in event.items() if v is not None}
+
+    def _media_shape(self, message) -> Dict[str, Any]:
+        for attr in MEDIA_ATTRS:
+            media = getattr(message, attr, None)
+            if media:
+                shape = {"media": attr, "size": getattr(media, "file_size", 0) or 0}
+                if getattr(media, "ttl_seconds", None):
+                    shape["ttl"] = media.ttl_seconds
+                if message.media_group_id:
+                    shape["group"] = self._anon(message.media_group_id)
+                if message.caption:
+                    shape["caption_len"] = len(message.caption)
+                return shape
+        return {}
+
+    def _anon(self, value) -> Optional[int]:
+        if value is None:
+            return None
+        return self._ids.setdefault(value, len(self._ids) + 1)
+
+    def _take_buffer(self) -> List[str]:
+        lines, self._buffer = self._buffer, []
+        return lines
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        try:
+            with self._lock:
+                if self._file:
+                    self._file.write("\n".join(lines) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing traffic log: {e}")
+
+
+def load_events(path: Path) -> List[Dict[str, Any]]:
+    """Read a recorded traffic log"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,134 @@
+"""Event loop lag watchdog and slow-callback detector"""
+import asyncio
+import io
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from ..utils import metrics
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+LOOP_STALLS = metrics.REGISTRY.counter(
+    "tgsecret_event_loop_stalls_total", "Callbacks or coroutine steps that blocked the loop past the threshold")
+STALL_DUMPS_INTERVAL = 60  # seconds between two task stack dumps
+
+
+def _write_dump(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+class LoopWatchdog:
+    """Measures loop scheduling lag and reports whatever is blocking the loop
+
+    A heartbeat coroutine stamps the time every `interval` seconds and records
+    how late it was woken up. A daemon thread watches the stamp: when it goes
+    stale by more than `threshold`, the loop thread's current stack (the
+    callback that's hogging it) is logged once per stall. Lag spikes above
+    `dump_threshold` also write every task's stack to `dump_dir` once the loop
+    is running again.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.1,
+        dump_threshold: float = 1.0,
+        dump_dir: Optional[Path] = None,
+        interval: float = 0.05
+    ):
+        self.threshold = threshold
+        self.dump_threshold = dump_threshold
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        self.interval = interval
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._reported_beat = 0.0
+        self._last_dump = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> asyncio.Task:
+        """Start the heartbeat and the watcher thread; call from the loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        # Only used when the loop runs in debug mode (PYTHONASYNCIODEBUG=1)
+        self._loop.slow_callback_duration = self.threshold
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+        return self._task
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            self._last_beat = start
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            metrics.LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if self.dump_dir and self.dump_threshold and lag >= self.dump_threshold:
+                await self._dump_tasks(lag)
+
+    def _watch(self):
+        """Runs on its own thread so it still works while the loop is blocked"""
+        while not self._stopped.wait(self.interval):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+
+            self._reported_beat = beat
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f}ms+, running:\n{stack}")
+
+    async def _dump_tasks(self, lag: float):
+        now = time.monotonic()
+        if now - self._last_dump < STALL_DUMPS_INTERVAL:
+            return
+        self._last_dump = now
+
+        try:
+            # Stacks have to be read on the loop; only the write is moved off it
+            text = io.StringIO()
+            text.write(f"Loop lag spike: {lag * 1000:.0f}ms\n\n")
+            for task in asyncio.all_tasks(self._loop):
+                text.write(f"--- {task.get_name()} {task.get_coro()!r}\n")
+                task.print_stack(file=text)
+                text.write("\n")
+            path = self.dump_dir / f"tasks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            await asyncio.to_thread(_write_dump, path, text.getvalue())
+            logger.warning(f"Loop lag spike of {lag * 1000:.0f}ms, task stacks written to {path}")
+        except Exception as e:
+            logger.error(f"Error dumping task stacks: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "stalls": self.stalls,
+            "max_lag_ms": self.max_lag * 1000,
+            "p50_ms": (metrics.LOOP_LAG.percentile(0.5) or 0.0) * 1000,
+            "p99_ms": (metrics.LOOP_LAG.percentile(0.99) or 0.0) * 1000,
+        }